@@ -1,41 +1,36 @@
-from aiortc import RTCIceCandidate, RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
+from aiortc import RTCIceCandidate, RTCPeerConnection, RTCSessionDescription, RTCConfiguration
 import json
 import asyncio
-import requests
 import logging
 import aiohttp
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.action_chains import ActionChains
 import time
 import aioconsole
-from twilio.rest import Client
 import os
+import mimetypes
 from dotenv import load_dotenv
 import io
 import base64
 from PIL import Image
+from protocol import PendingRequests, new_request_id
+from file_transfer import send_file
+from signaling import SignalingClient
+from upload_pipeline import ImageUploadPipeline, IMAGE_TYPES
+from ice import ice_servers
+from tracing import tracer, span, start_exporters
+from heartbeat import Heartbeat, backoff_delays
+from resend import ResendQueue
+from wire import WireFormat, WireError
 
 load_dotenv()
 
-account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-client = Client(account_sid, auth_token)
-
-# Generate NTS Token
-token = client.tokens.create()
-
-# Extract ICE servers from the token response
-ice_servers = [RTCIceServer(urls=server["urls"], username=server.get("username"), credential=server.get("credential")) for server in token.ice_servers]
-
 class WebRTCClient:
-    def __init__(self, signaling_server_url, id):
+    def __init__(self, signaling_server_url, id, image_pipeline=None):
         self.SIGNALING_SERVER_URL = signaling_server_url
         self.ID = id
-        self.config = RTCConfiguration(iceServers=ice_servers)
+        self.config = None
+        ice_servers.prefetch()
         self.peer_connection = None
+        self.signaling = SignalingClient(signaling_server_url)
         self.channels = {}
         self.channels_ready = {
             'chat': asyncio.Event(),
@@ -45,28 +40,58 @@ class WebRTCClient:
             'user':asyncio.Event()
         }
         self.driver = None
-        self.response_futures = {}
+        # Requests waiting for a response, keyed by the id the offer peer echoes back
+        self.pending = PendingRequests()
+        # When each request was sent, for the round trip and transit times
+        self.sent = {}
+        # Images are scaled down and re-encoded before upload; assign None to send them as they are
+        self.image_pipeline = image_pipeline or ImageUploadPipeline()
+        # One per peer connection; replaced on reconnect
+        self.heartbeat = None
+        self.reconnecting = None
+        self.closed = False
+        # Questions are kept until acknowledged and sent again after a reconnect
+        # Messages go out as JSON text until the peer says it reads the compact format
+        self.wire = WireFormat()
+        self.resend = ResendQueue(self.send_heartbeat, self.wire.encode)
+        # Files not yet acknowledged by the offer peer, sent again after a reconnect,
+        # and the channel each is being sent on
+        self.uploads = {}
+        self.sending = {}
 
-    async def keep_alive(self):
-        while True:
-            if self.channels_ready['keep_alive'].is_set():
-                try:
-                    self.channels['keep_alive'].send("keep-alive")
-                except Exception as e:
-                    print(f"Error sending keep-alive: {e}")
-            await asyncio.sleep(5)
+    def send_heartbeat(self, text):
+        channel = self.channels.get('keep_alive')
+        if channel and channel.readyState == "open":
+            channel.send(text)
+
+    def control(self, message):
+        # keep_alive carries heartbeats, acknowledgements for the resend queue and the
+        # wire format hello
+        data = self.heartbeat.receive(message)
+        if data is not None and data.get("type") == "ack":
+            self.resend.acked(data)
+        elif data is not None and data.get("type") == "hello":
+            self.wire.negotiate(data)
 
     async def setup_signal(self):
         print("Starting setup")
+        start_exporters()
         await self.create_peer_connection()
-        asyncio.create_task(self.periodic_reconnection())
 
     async def create_peer_connection(self):
-        self.peer_connection = RTCPeerConnection(configuration=self.config)
+        connect_started = time.perf_counter()
+        # Cached credentials unless they are about to expire
+        self.config = RTCConfiguration(iceServers=await ice_servers.get())
+        self.peer_connection = peer_connection = RTCPeerConnection(configuration=self.config)
+        self.heartbeat = Heartbeat(self.send_heartbeat, self.on_peer_dead)
+        self.wire.reset()
         
         @self.peer_connection.on("iceconnectionstatechange")
         async def on_iceconnectionstatechange():
-            print(f"ICE connection state is {self.peer_connection.iceConnectionState}")
+            print(f"ICE connection state is {peer_connection.iceConnectionState}")
+            # No need to wait for the heartbeat to notice
+            if peer_connection.iceConnectionState == "failed" and peer_connection is self.peer_connection:
+                self.on_peer_dead()
 
         @self.peer_connection.on("icegatheringstatechange")
         async def on_icegatheringstatechange():
@@ -84,31 +109,49 @@ class WebRTCClient:
             async def on_open(channel=channel, name=channel_name):
                 print(f"Channel {name} opened")
                 self.channels_ready[name].set()
+                if all(event.is_set() for event in self.channels_ready.values()):
+                    tracer.record("peer.connect", time.perf_counter() - connect_started)
                 if name == "keep_alive":
-                    asyncio.create_task(self.keep_alive())
+                    self.heartbeat.start()
+                    self.send_heartbeat(self.wire.hello())
 
             @channel.on("message")
             async def on_message(message, name=channel_name):
-                print(f"Message received on channel {name}: {message}")
+                self.heartbeat.heard()
+                if name == 'keep_alive':
+                    self.control(message)
+                    return
+                print(f"Message received on channel {name}: "
+                      f"{message if isinstance(message, str) else f'{len(message)} bytes'}")
                 if name == 'response':
                     try:
-                        data = json.loads(message)
+                        data = self.wire.decode(message)
+                        if not self.resend.accept(name, data):
+                            return
+                        if data["type"] in ("text", "progress"):
+                            # The offer peer has the file, no need to send it again
+                            self.uploads.pop(data.get("id"), None)
+                        if data.get("cached"):
+                            print(f"Response {data.get('id')} was served from the {data.get('cache')} answer cache")
+                        if data["type"] in ("text", "end"):
+                            self.answered(data)
                         if data["type"] == "text":
                             print(f"Received text response on channel {name}: {data['data']}")
-                            if 'response' in self.response_futures:
-                                print(f"Setting result for future on response channel")
-                                self.response_futures['response'].set_result(data["data"])
-                                del self.response_futures['response']
-                            else:
-                                print(f"No future found for response channel")
+                            if not self.pending.resolve(data.get("id"), data["data"]):
+                                print(f"No pending request for response {data.get('id')}")
+                        elif data["type"] in ("token", "end"):
+                            if not self.pending.feed(data.get("id"), data):
+                                print(f"No pending stream for response {data.get('id')}")
+                        elif data["type"] == "progress":
+                            self.pending.progress(data.get("id"), data["data"])
                         # ... (rest of the code)
-                    except json.JSONDecodeError:
+                    except (json.JSONDecodeError, WireError):
                         print(f"Received invalid JSON via RTC Datachannel {name}: {message}")
                     except Exception as e:
                         print(f"Error processing message: {e}")
                 else:
                     try:
-                        data = json.loads(message)
+                        data = self.wire.decode(message)
                         if data["type"] == "image":
                             # Decode and save or process the image
                             img_data = base64.b64decode(data["data"])
@@ -119,7 +162,7 @@ class WebRTCClient:
                             print(f"Received via RTC Datachannel {name}: {data['data']}")
                         else:
                             print(f"Received unknown data type via RTC Datachannel {name}")
-                    except json.JSONDecodeError:
+                    except (json.JSONDecodeError, WireError):
                         print(f"Received invalid JSON via RTC Datachannel {name}: {message}")
                     except Exception as e:
                         print(f"Error processing message: {e}")
@@ -132,22 +175,25 @@ class WebRTCClient:
             @channel.on("open")
             def on_open():
                 print(f"Data channel '{channel.label}' is open")
-                if channel.label == "keep_alive":
-                    asyncio.create_task(self.keep_alive())
 
             @channel.on("message")
             async def on_message(message):
+                self.heartbeat.heard()
+                if channel.label == 'keep_alive':
+                    self.control(message)
+                    return
                 print("message received from channel", message)
 
         await self.wait_for_offer()
 
     async def wait_for_offer(self):
         try:
-            resp = requests.get(self.SIGNALING_SERVER_URL + "/get_offer")
-            print(f"Offer request status: {resp.status_code}")
-            if resp.status_code == 200:
-                data = resp.json()
-                if data["type"] == "offer":
+            # Long-polls, so an offer posted after we start waiting is picked up at once
+            with span("signaling.wait_offer"):
+                data = await self.signaling.poll("/get_offer", {"id": self.ID})
+            print("Offer received")
+            if data["type"] == "offer":
+                with span("signaling.answer"):
                     rd = RTCSessionDescription(sdp=data["sdp"], type=data["type"])
                     await self.peer_connection.setRemoteDescription(rd)
                     await self.peer_connection.setLocalDescription(await self.peer_connection.createAnswer())
@@ -157,29 +203,94 @@ class WebRTCClient:
                         "sdp": self.peer_connection.localDescription.sdp,
                         "type": self.peer_connection.localDescription.type
                     }
-                    r = requests.post(self.SIGNALING_SERVER_URL + '/answer', data=message)
-                    print(f"Answer sent, status: {r.status_code}")
+                    status = await self.signaling.post('/answer', message)
+                print(f"Answer sent, status: {status}")
             else:
-                print(f"Failed to get offer. Status code: {resp.status_code}")
+                print("Wrong type")
         except Exception as e:
             print(f"Error during signaling: {str(e)}")
             return
 
-    async def periodic_reconnection(self):
-        while True:
-            await asyncio.sleep(180000)  # Wait for 3 minutes
-            print("Reconnecting after 3 minutes...")
-            await self.reconnect()
+    def on_peer_dead(self):
+        if self.closed or (self.reconnecting is not None and not self.reconnecting.done()):
+            return
+        print("Peer is not responding, reconnecting")
+        # Until the connection is back, questions wait in the resend queue
+        self.resend.holding = True
+        self.reconnecting = asyncio.create_task(self.reconnect())
+
+    async def resume(self):
+        # aiortc can't restart ICE, but while its ICE and SCTP transports are up a short
+        # outage can pass on its own, so the connection gets a grace period before it
+        # is torn down and renegotiated
+        pc = self.peer_connection
+        if pc is None or pc.connectionState != "connected" or pc.sctp is None or pc.sctp.state != "connected":
+            return False
+        return await self.heartbeat.revive(self.heartbeat.dead_after / 3)
+
+    def resent(self):
+        count = self.resend.replay(self.channels)
+        if self.uploads:
+            asyncio.create_task(self.resend_uploads())
+        return count
+
+    async def resend_uploads(self):
+        for request_id, (channel_name, data, name, mime) in list(self.uploads.items()):
+            channel = self.sending.get(request_id)
+            # Still going out on a resumed connection, which delivers it as it is
+            if request_id not in self.uploads or (channel is not None and channel.readyState == "open"):
+                continue
+            print(f"Sending {name} again after reconnecting")
+            try:
+                await self.send_file_frames(self.channels[channel_name], data, name, mime, request_id)
+            except (ConnectionError, KeyError) as e:
+                print(f"Error sending {name} again: {e}")
+
+    async def send_file_frames(self, channel, data, name, mime, request_id):
+        self.sending[request_id] = channel
+        try:
+            await send_file(channel, data, name, mime, request_id)
+        finally:
+            if self.sending.get(request_id) is channel:
+                del self.sending[request_id]
+
+    async def reconnect(self, timeout=30.0):
+        # Resumes the connection if it can, otherwise renegotiates with backoff until
+        # every channel is open again. Requests still waiting for a response stay in
+        # self.pending; questions and files the offer peer never acknowledged are sent
+        # again once the connection is back.
+        started = time.perf_counter()
+        if await self.resume():
+            tracer.record("peer.resume", time.perf_counter() - started)
+            print(f"Connection resumed, resending {self.resent()} message(s)")
+            return True
+        for attempt, delay in enumerate(backoff_delays(), 1):
+            if self.heartbeat:
+                self.heartbeat.stop()
+            if self.peer_connection:
+                await self.peer_connection.close()
+            self.channels = {}
+            self.channels_ready = {name: asyncio.Event() for name in self.channels_ready}
+            try:
+                await asyncio.wait_for(self.create_peer_connection(), timeout)
+                await asyncio.wait_for(asyncio.gather(*(event.wait() for event in self.channels_ready.values())),
+                                       timeout)
+                tracer.record("peer.reconnect", time.perf_counter() - started, attempts=attempt)
+                print(f"Reconnected after {attempt} attempt(s), resending {self.resent()} message(s)")
+                return True
+            except asyncio.TimeoutError:
+                print(f"Reconnect attempt {attempt} timed out, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
 
-    async def reconnect(self):
+    async def close(self):
+        self.closed = True
+        if self.reconnecting is not None:
+            self.reconnecting.cancel()
+        if self.heartbeat:
+            self.heartbeat.stop()
         if self.peer_connection:
             await self.peer_connection.close()
-        self.channels = {}
-        self.channels_ready = {
-            'chat': asyncio.Event(),
-            'keep_alive': asyncio.Event()
-        }
-        await self.create_peer_connection()
+        await self.signaling.close()
 
     async def send_message_to_rasa(self, message):
         url = "http://localhost:5006/webhooks/rest/webhook"
@@ -197,63 +308,205 @@ class WebRTCClient:
                     return response_json[0].get('text', '')
                 return ''
 
-    async def send_message(self, channel_name, message, is_image=False):
-        if channel_name not in self.channels:
+    def answered(self, data):
+        # Round trip of a request, and the part of it not spent on the offer peer:
+        # DataChannel transit and queueing on both sides
+        started = self.sent.pop(data.get("id"), None)
+        if started is None:
+            return
+        round_trip = time.perf_counter() - started
+        tracer.record("answer.round_trip", round_trip, trace_id=data["id"])
+        if data.get("server_time") is not None:
+            tracer.record("answer.transit", max(0.0, round_trip - data["server_time"]), trace_id=data["id"])
+
+    async def stream_message(self, channel_name, message, timeout=30.0):
+        # Sends a question and yields the answer tokens as they arrive, in sequence
+        # order. The timeout applies to the gap between frames, not the whole answer.
+        if channel_name not in self.channels_ready:
             print(f"Invalid channel name: {channel_name}")
             return
 
-        if not self.channels_ready[channel_name].is_set():
+        # While reconnecting, the question is queued and sent once the connection is back
+        if not self.channels_ready[channel_name].is_set() and not self.resend.holding:
             print(f"Channel {channel_name} is not ready yet. Please wait.")
             return
 
-        channel = self.channels[channel_name]
-        if channel and channel.readyState == "open":
+        channel = self.channels.get(channel_name)
+        if not self.resend.keeps(channel_name) and (not channel or channel.readyState != "open"):
+            print(f"Channel {channel_name} is not open. Cannot send message.")
+            return
+
+        request_id, queue = self.pending.open_stream()
+        print(f"Sending via RTC Datachannel {channel_name}: {message}")
+        self.sent[request_id] = started = time.perf_counter()
+        self.resend.send(channel, channel_name, {"type": "text", "data": message, "stream": True, "id": request_id})
+
+        expected = 0
+        pending = {}
+        try:
+            while True:
+                frame = await asyncio.wait_for(queue.get(), timeout=timeout)
+                pending[frame.get("seq", expected)] = frame
+                while expected in pending:
+                    frame = pending.pop(expected)
+                    expected += 1
+                    if frame["type"] == "end":
+                        return
+                    if expected == 1:
+                        tracer.record("answer.first_token", time.perf_counter() - started, trace_id=request_id)
+                    yield frame["data"]
+        except asyncio.TimeoutError:
+            print(f"Timeout waiting for streamed response")
+        finally:
+            # Timed without a span: the caller may stop iterating at any point
+            tracer.record("answer.question", time.perf_counter() - started, trace_id=request_id, stream=True)
+            self.sent.pop(request_id, None)
+            self.pending.discard(request_id)
+
+    async def send_file(self, channel_name, file, name=None, mime=None, timeout=120.0, on_progress=None):
+        # Sends a file as binary chunks; file is a path, raw bytes or a PIL Image.
+        # Resolves with the offer peer's acknowledgement once the file is ingested;
+        # on_progress is called with each ingest progress event before that. If the
+        # connection drops first, the file is sent again once it is back.
+        if channel_name not in self.channels_ready:
+            print(f"Invalid channel name: {channel_name}")
+            return None
+
+        if not self.channels_ready[channel_name].is_set() and not self.resend.holding:
+            print(f"Channel {channel_name} is not ready yet. Please wait.")
+            return None
+
+        channel = self.channels.get(channel_name)
+        if not self.resend.keeps(channel_name) and (not channel or channel.readyState != "open"):
+            print(f"Channel {channel_name} is not open. Cannot send file.")
+            return None
+
+        if isinstance(file, Image.Image):
+            data = file
+            name = name or "image.png"
+            mime = "image/png"
+        elif isinstance(file, str):
+            with open(file, "rb") as f:
+                data = f.read()
+            name = name or os.path.basename(file)
+        elif isinstance(file, (bytes, bytearray, memoryview)):
+            data = file
+        else:
+            raise ValueError("File must be a path, bytes or a PIL Image object")
+        name = name or "file"
+        mime = mime or mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+        if isinstance(data, Image.Image) or (self.image_pipeline and mime in IMAGE_TYPES):
+            data, mime = await self.encode_image(data, mime)
+
+        request_id, response_future = self.pending.create(on_progress=on_progress)
+        print(f"Sending {name} ({len(data)} bytes) via RTC Datachannel {channel_name}")
+        with span("answer.upload", trace_id=request_id, kind=mime, bytes=len(data)):
+            self.sent[request_id] = time.perf_counter()
+            self.uploads[request_id] = (channel_name, data, name, mime)
+            try:
+                if not self.resend.holding and channel is not None and channel.readyState == "open":
+                    with span("answer.send_file", bytes=len(data)):
+                        await self.send_file_frames(channel, data, name, mime, request_id)
+            except ConnectionError as e:
+                if self.closed:
+                    print(f"Error sending {name}: {e}")
+                    self.sent.pop(request_id, None)
+                    self.uploads.pop(request_id, None)
+                    self.pending.discard(request_id)
+                    return None
+                print(f"Connection lost while sending {name}, sending it again once it is back")
+
+            try:
+                response = await self.pending.wait(request_id, response_future, timeout)
+                print(f"Response received for {request_id}: {response}")
+                return response
+            except asyncio.TimeoutError:
+                print(f"Timeout waiting for response to {request_id}")
+                return None
+            finally:
+                self.sent.pop(request_id, None)
+                self.uploads.pop(request_id, None)
+
+    async def encode_image(self, image, mime):
+        # Runs the upload pipeline in a thread so decoding and encoding don't stall
+        # the DataChannels. Without a pipeline, PIL images are sent as PNG.
+        loop = asyncio.get_running_loop()
+        with span("answer.encode_image"):
+            if self.image_pipeline:
+                return await loop.run_in_executor(None, self.image_pipeline.prepare, image, mime)
+            if not isinstance(image, Image.Image):
+                return image, mime
+
+            def to_png():
+                buffered = io.BytesIO()
+                image.save(buffered, format="PNG")
+                return buffered.getvalue(), "image/png"
+            return await loop.run_in_executor(None, to_png)
+
+    async def send_message(self, channel_name, message, is_image=False, timeout=None):
+        if channel_name not in self.channels_ready:
+            print(f"Invalid channel name: {channel_name}")
+            return
+
+        # While reconnecting, the message is queued and sent once the connection is back
+        if not self.channels_ready[channel_name].is_set() and not self.resend.holding:
+            print(f"Channel {channel_name} is not ready yet. Please wait.")
+            return
+
+        # Messages on the request channels are kept even if the channel just closed
+        channel = self.channels.get(channel_name)
+        if self.resend.keeps(channel_name) or (channel and channel.readyState == "open"):
+            # Uploads are answered once ingestion finishes, which takes longer than a question
+            if timeout is None:
+                timeout = 120.0 if is_image else 30.0
+            request_id = new_request_id()
+
             if is_image:
                 # If the message is an image (file path or PIL Image object)
                 if isinstance(message, str):
                     # If message is a file path
-                    with Image.open(message) as img:
-                        buffered = io.BytesIO()
-                        img.save(buffered, format="PNG")
-                        img_str = base64.b64encode(buffered.getvalue()).decode()
+                    with open(message, "rb") as f:
+                        image_data = f.read()
+                    image_data, _ = await self.encode_image(image_data, mimetypes.guess_type(message)[0])
                 elif isinstance(message, Image.Image):
                     # If message is a PIL Image object
-                    buffered = io.BytesIO()
-                    message.save(buffered, format="PNG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode()
+                    image_data, _ = await self.encode_image(message, None)
                 else:
                     raise ValueError("Image must be a file path or a PIL Image object")
+                img_str = base64.b64encode(image_data).decode()
                 
                 # Prepare the message with a flag indicating it's an image
-                data_to_send = json.dumps({
+                frame = {
                     "type": "image",
-                    "data": img_str
-                })
+                    "data": img_str,
+                    "id": request_id
+                }
             else:
                 # If it's a regular text message
-                data_to_send = json.dumps({
+                frame = {
                     "type": "text",
-                    "data": message
-                })
-
-            # Create a future to wait for the response, but use 'response' as the key
-            response_future = asyncio.get_event_loop().create_future()
-            self.response_futures['response'] = response_future
+                    "data": message,
+                    "id": request_id
+                }
 
+            request_id, response_future = self.pending.create(request_id)
             print(f"Sending via RTC Datachannel {channel_name}: {'[IMAGE]' if is_image else message}")
-            channel.send(data_to_send)
+            with span("answer.upload" if is_image else "answer.question", trace_id=request_id):
+                self.sent[request_id] = time.perf_counter()
+                if not self.resend.send(channel, channel_name, frame):
+                    print(f"Connection is down, {channel_name} message queued until it is back")
 
-            # Wait for the response
-            try:
-                response = await asyncio.wait_for(response_future, timeout=30.0)
-                print(f"Response received: {response}")
-                return response
-            except asyncio.TimeoutError:
-                print(f"Timeout waiting for response")
-                return None
-            finally:
-                if 'response' in self.response_futures:
-                    del self.response_futures['response']
+                # Wait for the response to this request only
+                try:
+                    response = await self.pending.wait(request_id, response_future, timeout)
+                    print(f"Response received for {request_id}: {response}")
+                    return response
+                except asyncio.TimeoutError:
+                    print(f"Timeout waiting for response to {request_id}")
+                    return None
+                finally:
+                    self.sent.pop(request_id, None)
         else:
             print(f"Channel {channel_name} is not open. Cannot send message.")
             return None
\ No newline at end of file
@@ -2,7 +2,8 @@ import os
 import tempfile
 import streamlit as st
 from streamlit_chat import message
-from rag import ChatPDF
+from openai import OpenAI
+from actions import analyze_text_for_actions
 from PIL import Image
 import asyncio
 from dotenv import load_dotenv
@@ -22,6 +23,11 @@ client_id = os.getenv('CLIENT_ID')
 if not signal_server_url or not client_id:
     raise ValueError("Environment variables SIGNAL_SERVER_URL and CLIENT_ID must be set")
 
+@st.cache_resource
+def get_openai_client():
+    # Documents and notes live with the offer peer; the app only checks messages for actions
+    return OpenAI()
+
 # Initialize WebRTC client in session state
 if 'webrtc_client' not in st.session_state:
     st.session_state.webrtc_client = WebRTCClient(signal_server_url, client_id)
@@ -33,30 +39,35 @@ def display_messages():
     st.session_state["thinking_spinner"] = st.empty()
 
 async def process_input():
-    if "assistant" in st.session_state and st.session_state["user_input"] and len(st.session_state["user_input"].strip()) > 0:
+    if st.session_state["user_input"] and len(st.session_state["user_input"].strip()) > 0:
         user_text = st.session_state["user_input"].strip()
 
-        with st.session_state["thinking_spinner"], st.spinner(f"Thinking"):
-
-            agent_text = await st.session_state.webrtc_client.send_message('user', user_text)
+        # Render the answer as its tokens arrive
+        placeholder = st.session_state["thinking_spinner"]
+        agent_text = ""
+        with st.spinner(f"Thinking"):
+            async for token in st.session_state.webrtc_client.stream_message('user', user_text):
+                agent_text += token
+                placeholder.markdown(agent_text)
 
 
         st.session_state["messages"].append((user_text, True))
         st.session_state["messages"].append((agent_text, False))
 
         # Analyze the user input for actions
-        st.session_state["assistant"].analyze_text_for_actions(user_text)
+        analyze_text_for_actions(get_openai_client(), user_text)
 
-async def send_file_via_webrtc(file):
-    with tempfile.NamedTemporaryFile(delete=False) as tf:
-            tf.write(file.getbuffer())
-            file_path = tf.name
+def show_ingest_progress(event):
+    if event.get("stage") == "pages":
+        st.session_state["ingestion_spinner"].text(
+            f"Ingesting {event['source']}: page {event['pages_done']}/{event['pages_total']}, "
+            f"{event['chunks_stored']} chunks searchable")
 
+async def send_file_via_webrtc(file):
+    # Images and PDFs are sent as raw bytes in binary chunks
     with st.session_state["ingestion_spinner"], st.spinner(f"Ingesting {file.name}"):
-        if file.type.startswith('image'):
-            image = Image.open(file_path)
-    # Send message via WebRTC
-    await st.session_state.webrtc_client.send_message('upload', image, is_image=True)
+        await st.session_state.webrtc_client.send_file('upload', file.getvalue(), file.name, file.type,
+                                                       on_progress=show_ingest_progress)
     # st.success("File(s) sent successfully!")
 
 def read_and_send_file():
@@ -97,9 +108,6 @@ def main():
     if "messages" not in st.session_state:
         st.session_state["messages"] = []
 
-    if "assistant" not in st.session_state:
-        st.session_state["assistant"] = ChatPDF()
-
     st.header("ChatPDF and Image")
 
     st.subheader("Upload a document or image")
@@ -0,0 +1,122 @@
+# upload_pipeline.py
+# Prepares images before they go onto the upload DataChannel. The offer peer only
+# reads text out of them, so full-resolution lossless PNG is wasted bytes: images are
+# turned upright, scaled down and encoded to suit their content. Scaling caps the
+# short side and the pixel count, never the long side alone, so a tall receipt or
+# page photo keeps the width its text needs.
+import io
+import time
+from PIL import Image, ImageOps, ImageStat, features
+
+WEBP = features.check("webp")
+
+# Uploads of these types go through the pipeline; anything else is sent unchanged
+IMAGE_TYPES = ("image/png", "image/jpeg", "image/webp", "image/bmp", "image/tiff")
+
+
+def classify(image):
+    # "graphic" for screenshots and clean renders (a few exact colours cover nearly
+    # every pixel), "document" for scans and photos of pages (mostly paper and ink),
+    # "photo" for the rest. Nearest-neighbour sampling keeps the exact pixel values.
+    sample = image.convert("RGB").resize((256, 256), Image.NEAREST)
+    colors = sorted(sample.getcolors(256 * 256), reverse=True)
+    if sum(count for count, _ in colors[:8]) / (256 * 256) >= 0.95:
+        return "graphic"
+    histogram = sample.convert("L").histogram()
+    extremes = sum(histogram[:64]) + sum(histogram[192:])
+    return "document" if extremes / sum(histogram) > 0.8 else "photo"
+
+
+def is_grayscale(image, tolerance=8):
+    if image.mode in ("1", "L", "LA", "I", "F"):
+        return True
+    thumb = image.convert("RGB")
+    thumb.thumbnail((128, 128))
+    return ImageStat.Stat(thumb.convert("HSV").getchannel("S")).mean[0] < tolerance
+
+
+def flatten(image):
+    # Transparency onto white, since neither JPEG nor OCR keeps it
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+class ImageUploadPipeline:
+    # quality maps each content class to a lossy quality; graphics are sent as
+    # lossless WebP (PNG without WebP support), everything else as WebP or JPEG
+    def __init__(self, max_short_side=2000, max_pixels=8_000_000, quality=None, use_webp=True):
+        self.max_short_side = max_short_side
+        self.max_pixels = max_pixels
+        self.quality = {"document": 90, "photo": 80, **(quality or {})}
+        self.use_webp = use_webp and WEBP
+        self.images = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def scale(self, size):
+        # Factor to scale an image of this size by, at most 1
+        width, height = size
+        return min(1.0, self.max_short_side / min(width, height), (self.max_pixels / (width * height)) ** 0.5)
+
+    def encode(self, image):
+        # Returns (data, mime) for a decoded image
+        image = ImageOps.exif_transpose(image)
+        scale = self.scale(image.size)
+        if scale < 1:
+            image = image.resize((max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale))),
+                                 Image.LANCZOS)
+        image = flatten(image)
+        kind = classify(image)
+        if image.mode != "L" and is_grayscale(image):
+            image = image.convert("L")
+
+        buffered = io.BytesIO()
+        if kind == "graphic":
+            if self.use_webp:
+                image.save(buffered, format="WEBP", lossless=True, method=4)
+                mime = "image/webp"
+            else:
+                image.save(buffered, format="PNG", optimize=True)
+                mime = "image/png"
+        elif self.use_webp:
+            image.save(buffered, format="WEBP", quality=self.quality[kind], method=4)
+            mime = "image/webp"
+        else:
+            image.save(buffered, format="JPEG", quality=self.quality[kind], optimize=True)
+            mime = "image/jpeg"
+        return buffered.getvalue(), mime
+
+    def prepare(self, file, mime=None):
+        # file is a PIL Image or encoded image bytes. Blocking: run it in an executor.
+        # Bytes that are already smaller than the re-encoded image and need no
+        # rotating or scaling are sent unchanged.
+        start = time.perf_counter()
+        original = None
+        if isinstance(file, Image.Image):
+            image = file
+        else:
+            original = bytes(file)
+            image = Image.open(io.BytesIO(original))
+            scale = self.scale(image.size)
+            if image.format == "JPEG" and scale < 0.5:
+                # Let the JPEG decoder skip the detail the downscale would throw away
+                image.draft("RGB", (int(image.size[0] * scale), int(image.size[1] * scale)))
+        with_exif = image.getexif().get(0x0112, 1) != 1
+        oversized = self.scale(image.size) < 1
+        data, new_mime = self.encode(image)
+        if original is not None and mime and not with_exif and not oversized and len(original) <= len(data):
+            data, new_mime = original, mime
+
+        self.images += 1
+        self.bytes_out += len(data)
+        self.seconds += time.perf_counter() - start
+        return data, new_mime
+
+    def stats(self):
+        return {"images": self.images, "bytes_out": self.bytes_out, "seconds": self.seconds}
@@ -0,0 +1,62 @@
+# bench_actions.py
+# Compares serial per-chunk action extraction with the batched, concurrent pipeline
+# against the local stub OpenAI server.
+#
+#   python benchmarks/bench_actions.py --chunks 200 --latency 0.5
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from openai import OpenAI
+from actions import ActionExtractor
+from stub_openai import StubOpenAIServer
+
+
+def make_chunks(count):
+    texts = []
+    for i in range(count):
+        if i % 10 == 0:
+            texts.append(f"Page {i}: team meeting on Friday at 10am about the quarterly report.")
+        else:
+            texts.append(f"Page {i}: " + "lorem ipsum dolor sit amet " * 30)
+    return texts
+
+
+def run(client, texts, batch_size, concurrency):
+    actions = []
+    extractor = ActionExtractor(client, actions.append, batch_size=batch_size, max_concurrency=concurrency)
+    start = time.perf_counter()
+    future = extractor.submit(texts, "bench.pdf")
+    submitted = time.perf_counter() - start
+    report = future.result()
+    extractor.shutdown()
+    return submitted, report, len(actions)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(latency=args.latency).start()
+    client = OpenAI(base_url=server.base_url, api_key="stub")
+    texts = make_chunks(args.chunks)
+
+    for name, batch_size, concurrency in [("serial", 1, 1), ("batched", args.batch_size, args.concurrency)]:
+        requests_before = server.requests
+        submitted, report, actions = run(client, texts, batch_size, concurrency)
+        print(f"{name:8s} requests={server.requests - requests_before:4d} latency={report['latency']:.2f}s "
+              f"submit={submitted * 1000:.2f}ms prompt_tokens={report['prompt_tokens']} "
+              f"completion_tokens={report['completion_tokens']} actions={actions}")
+
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench_context.py
+# Prompt size and answer latency with the three retrieved chunks passed straight
+# into the prompt, against the packed context (over-fetch, MMR, merged neighbours,
+# token budget). The stub Ollama server charges a delay per prompt token, like
+# llama3 prefill on CPU; "found" is the share of questions whose context contains
+# what they asked about.
+#
+#   python benchmarks/bench_context.py --pages 40 --prefill 0.002 --budgets 512,768,1024
+import os
+import sys
+import time
+import warnings
+import argparse
+import statistics
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from stub_openai import StubOpenAIServer
+from stub_ollama import StubOllamaServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+from bench_retrieval import queries
+
+
+def report(name, prefill, latencies, found, lookups=0):
+    prefill = sorted(prefill)
+    print(f"{name:<11} {statistics.mean(prefill):>8.0f} {prefill[len(prefill) // 2]:>8} "
+          f"{prefill[int(len(prefill) * 0.99)]:>8} {statistics.pstdev(prefill):>8.0f} "
+          f"{statistics.mean(latencies) * 1000:>10.0f} {sum(found) / len(found):>7.2f} {lookups:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=10, help="questions of each kind")
+    parser.add_argument("--prefill", type=float, default=0.002, help="stub model seconds per prompt token")
+    parser.add_argument("--budgets", default="512,768,1024", help="context token budgets to try")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", module="langchain_core")
+
+    openai_stub = StubOpenAIServer(latency=0.0).start()
+    ollama_stub = StubOllamaServer(first_token=0.02, per_token=0.0, tokens=5, prefill=args.prefill).start()
+    os.environ["OPENAI_BASE_URL"] = openai_stub.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["OLLAMA_BASE_URL"] = ollama_stub.base_url
+    from rag import ChatPDF
+    from context import estimate_tokens
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = make_corpus(args.pages)
+        pdf_path = os.path.join(tmp, "corpus.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(make_pdf(corpus))
+        assistant = ChatPDF(json_path=os.path.join(tmp, "memory.json"),
+                            persist_directory=os.path.join(tmp, "chroma_db"), embedding=CountingEmbeddings())
+        assistant.ingest(pdf_path, source="corpus.pdf")
+        assistant.actions.shutdown()
+        cases = queries(corpus, args.queries)
+
+        print(f"{'':<11} {'prefill':>8} {'p50':>8} {'p99':>8} {'stdev':>8} {'answer ms':>10} {'found':>7} {'embeds':>8}")
+
+        # Before: the top three chunks, joined as they come
+        prefill, latencies, found = [], [], []
+        for _, query, expected in cases:
+            start = time.perf_counter()
+            docs = assistant.retriever.get_relevant_documents(query, k=3)
+            context = "\n\n".join(doc.page_content for doc in docs)
+            prefill.append(estimate_tokens(assistant.prompt.format(context=context, question=query)))
+            assistant.chain.invoke({"context": context, "question": query})
+            latencies.append(time.perf_counter() - start)
+            found.append(expected in context)
+        report("top-3", prefill, latencies, found)
+
+        # After: what respond() does, at each budget
+        for budget in [int(b) for b in args.budgets.split(",")]:
+            assistant.context_packer.budget = budget
+            assistant.context_packer.prefill.clear()
+            latencies, found = [], []
+            # Texts sent to the embedding layer (cache or model) while retrieving and packing
+            before = assistant.embedding.hits + assistant.embedding.misses
+            for _, query, expected in cases:
+                start = time.perf_counter()
+                context, _ = assistant._build_context(query)
+                assistant.chain.invoke({"context": context, "question": query})
+                latencies.append(time.perf_counter() - start)
+                found.append(expected in context)
+            lookups = assistant.embedding.hits + assistant.embedding.misses - before
+            report(f"packed {budget}", list(assistant.context_packer.prefill), latencies, found, lookups)
+    ollama_stub.stop()
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# bench_e2e.py
+# The whole system in one process: the signaling server (server.py), an offer peer
+# with its ChatPDF and a headless answer peer, connected over real aiortc
+# DataChannels on host ICE candidates. Ollama and OpenAI are the deterministic
+# stubs, embeddings the hashing stand-in. For each corpus size a fresh pair of peers
+# connects, uploads a PDF of that many pages, then asks questions, one stream at a
+# time and then --concurrency at a time. Results go to --out as JSON, with the
+# commit and settings, so runs can be compared across versions.
+#
+#   python benchmarks/bench_e2e.py --sizes 10,40,160 --questions 50 --concurrency 8 --out e2e.json
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import warnings
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "offer"), os.path.join(ROOT, "answer")]
+
+from stub_openai import StubOpenAIServer
+from stub_ollama import StubOllamaServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def stage_sum(tracer, name):
+    histogram = tracer.histograms.get(name)
+    return histogram.sum if histogram is not None else 0.0
+
+
+async def connect(url, pair_id, registry):
+    import offer
+    import answer
+    started = time.perf_counter()
+    offer_peer = offer.WebRTCClient(url, pair_id, registry=registry)
+    answer_peer = answer.WebRTCClient(url, pair_id)
+    await asyncio.gather(offer_peer.setup_signal(), answer_peer.setup_signal())
+    while not all(event.is_set() for event in answer_peer.channels_ready.values()):
+        if time.perf_counter() - started > 30:
+            raise RuntimeError("DataChannels did not open within 30s")
+        await asyncio.sleep(0.01)
+    connected = time.perf_counter() - started
+    # Questions wait for the assistant; time them without its loading
+    await offer_peer.get_assistant()
+    return offer_peer, answer_peer, connected
+
+
+async def ask_all(answer_peer, questions, concurrency):
+    latencies, failures = [], 0
+    limit = asyncio.Semaphore(concurrency)
+
+    async def ask(question):
+        nonlocal failures
+        async with limit:
+            start = time.perf_counter()
+            response = await answer_peer.send_message("user", question)
+            if response is None:
+                failures += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(ask(question) for question in questions))
+    wall = time.perf_counter() - start
+    return {"questions": len(questions), "concurrency": concurrency, "failures": failures,
+            "throughput_qps": len(latencies) / wall if wall else 0.0,
+            "latency_p50_ms": percentile(latencies, 0.5) * 1000, "latency_p99_ms": percentile(latencies, 0.99) * 1000}
+
+
+async def stream_all(answer_peer, questions):
+    first, total = [], []
+    for question in questions:
+        start = time.perf_counter()
+        tokens = 0
+        async for _ in answer_peer.stream_message("user", question):
+            if not tokens:
+                first.append(time.perf_counter() - start)
+            tokens += 1
+        total.append(time.perf_counter() - start)
+    return {"questions": len(questions), "first_token_p50_ms": percentile(first, 0.5) * 1000,
+            "first_token_p99_ms": percentile(first, 0.99) * 1000, "latency_p50_ms": percentile(total, 0.5) * 1000,
+            "latency_p99_ms": percentile(total, 0.99) * 1000}
+
+
+async def run_size(url, registry, pages, args):
+    import tracing
+    tracer = tracing.tracer
+    corpus = make_corpus(pages, seed=pages)
+    pdf = make_pdf(corpus)
+    invoices = sorted({word for page in corpus for line in page for word in line.split() if word.startswith("INV-")})
+
+    offer_peer, answer_peer, connected = await connect(url, f"e2e-{pages}", registry)
+
+    receive, ingest = stage_sum(tracer, "offer.receive"), stage_sum(tracer, "rag.ingest")
+    start = time.perf_counter()
+    ack = await answer_peer.send_file("upload", pdf, f"corpus-{pages}.pdf", timeout=600)
+    upload = time.perf_counter() - start
+    receive, ingest = stage_sum(tracer, "offer.receive") - receive, stage_sum(tracer, "rag.ingest") - ingest
+    chunks = len((await offer_peer.get_assistant()).keyword_index)
+
+    # Every question names a different invoice, so none is answered from the cache
+    questions = [f"what is the status of invoice {invoices[i % len(invoices)]}?" for i in range(args.questions)]
+    sequential = await ask_all(answer_peer, questions[:args.questions // 2], 1)
+    concurrent = await ask_all(answer_peer, questions[args.questions // 2:], args.concurrency)
+    streamed = await stream_all(answer_peer, [f"summarize what my notes say about {invoice}"
+                                              for invoice in invoices[:args.streams]])
+
+    for peer in (offer_peer, answer_peer):
+        await peer.close()
+    return {
+        "pages": pages, "pdf_bytes": len(pdf), "chunks": chunks, "upload_ack": ack,
+        "connect_ms": connected * 1000,
+        "upload_s": upload, "upload_mb_per_s": len(pdf) / receive / 2 ** 20 if receive else None,
+        "ingest_s": ingest, "ingest_pages_per_s": pages / ingest if ingest else None,
+        "ingest_chunks_per_s": chunks / ingest if ingest else None,
+        "sequential": sequential, "concurrent": concurrent, "streamed": streamed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,40,160", help="corpus sizes in pages")
+    parser.add_argument("--questions", type=int, default=40, help="per size; half one at a time, half concurrently")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--streams", type=int, default=5, help="streamed questions per size")
+    parser.add_argument("--first-token", type=float, default=0.05, help="stub model seconds before the first token")
+    parser.add_argument("--per-token", type=float, default=0.005)
+    parser.add_argument("--openai-latency", type=float, default=0.05)
+    parser.add_argument("--out", default="e2e_results.json")
+    args = parser.parse_args()
+    out = os.path.abspath(args.out)
+    warnings.filterwarnings("ignore", module="langchain_core")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    openai_stub = StubOpenAIServer(latency=args.openai_latency).start()
+    ollama_stub = StubOllamaServer(first_token=args.first_token, per_token=args.per_token, tokens=20).start()
+    os.environ.update(OPENAI_BASE_URL=openai_stub.base_url, OPENAI_API_KEY="stub",
+                      OLLAMA_BASE_URL=ollama_stub.base_url)
+    # Host candidates only, even if a .env has Twilio credentials
+    os.environ["ICE_HOST_ONLY"] = "1"
+    for name in ("METRICS_PORT", "TRACE_EXPORT"):
+        os.environ.pop(name, None)
+
+    import server
+    import tracing
+    from werkzeug.serving import make_server
+    from tenants import TenantRegistry, SharedResources
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_port}"
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        registry = TenantRegistry(SharedResources(os.path.join(tmp, "tenants"), embedding=CountingEmbeddings()))
+        for pages in [int(size) for size in args.sizes.split(",")]:
+            result = asyncio.run(run_size(url, registry, pages, args))
+            results.append(result)
+            print(f"{pages:>4} pages: connect {result['connect_ms']:.0f} ms, upload {result['upload_s']:.2f} s, "
+                  f"ingest {result['ingest_pages_per_s'] or 0:.1f} pages/s, "
+                  f"p50 {result['sequential']['latency_p50_ms']:.0f} ms, "
+                  f"p99 {result['sequential']['latency_p99_ms']:.0f} ms, "
+                  f"{result['concurrent']['throughput_qps']:.1f} q/s at {args.concurrency}, "
+                  f"first token p50 {result['streamed']['first_token_p50_ms']:.0f} ms", flush=True)
+        registry.close()
+        os.chdir(ROOT)
+
+    report = {"commit": commit(), "time": time.time(), "python": platform.python_version(),
+              "platform": platform.platform(), "settings": vars(args), "results": results,
+              "stages": tracing.tracer.stats()}
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {out}")
+    httpd.shutdown()
+    ollama_stub.stop()
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
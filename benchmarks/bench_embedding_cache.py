@@ -0,0 +1,60 @@
+# bench_embedding_cache.py
+# Ingest a corpus, clear() the store and reindex it from the memory log, with the
+# embedding cache cold and then warm. The embedding model is a stand-in with a fixed
+# cost per text, so the difference is what the cache saves.
+#
+#   python benchmarks/bench_embedding_cache.py --pages 40 --delay 0.01
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from stub_openai import StubOpenAIServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=0.01, help="seconds of model time per text")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    openai_stub = StubOpenAIServer(latency=0.0).start()
+    os.environ["OPENAI_BASE_URL"] = openai_stub.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    from rag import ChatPDF
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "corpus.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(make_pdf(make_corpus(args.pages)))
+        model = CountingEmbeddings(delay=args.delay)
+        assistant = ChatPDF(json_path=os.path.join(tmp, "memory.json"),
+                            persist_directory=os.path.join(tmp, "chroma_db"), embedding=model,
+                            embedding_batch_size=args.batch_size)
+
+        start = time.perf_counter()
+        assistant.ingest(pdf_path, source="corpus.pdf").result()
+        print(f"ingest (cold cache):  {time.perf_counter() - start:6.2f}s, {model.texts_embedded} texts embedded")
+
+        # A fresh vector store over the same memory log
+        shutil.rmtree(os.path.join(tmp, "chroma_db", "reindexed"), ignore_errors=True)
+        assistant.persist_directory = os.path.join(tmp, "chroma_db", "reindexed")
+        assistant.clear()
+        before = model.texts_embedded
+        start = time.perf_counter()
+        count = assistant.reindex()
+        print(f"reindex (warm cache): {time.perf_counter() - start:6.2f}s, {count} chunks, "
+              f"{model.texts_embedded - before} texts embedded")
+        print(f"cache stats: {assistant.embedding.stats()}")
+        assistant.actions.shutdown()
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# bench_heartbeat.py
+# The heartbeat between two real peers in one process, as in bench_e2e.py: pings and
+# round-trip times while the connection is idle and while questions keep it busy,
+# then a partition that silently drops every DataChannel message in both directions.
+# Reports how long each peer took to declare the other dead (against --dead-after),
+# how long reconnecting took, and whether a question asked just before the
+# partition, still being answered through it, got its answer afterwards.
+#
+#   python benchmarks/bench_heartbeat.py --dead-after 6 --idle 20
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import warnings
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "offer"), os.path.join(ROOT, "answer")]
+
+from stub_openai import StubOpenAIServer
+from stub_ollama import StubOllamaServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+
+
+def sent_pings(peer):
+    return peer.heartbeat.pings
+
+
+async def run(url, registry, ollama_stub, args):
+    import offer
+    import answer
+    import tracing
+    from aiortc import RTCDataChannel
+
+    offer_peer = offer.WebRTCClient(url, "heartbeat", registry=registry)
+    answer_peer = answer.WebRTCClient(url, "heartbeat")
+    await asyncio.gather(offer_peer.setup_signal(), answer_peer.setup_signal())
+    while not all(event.is_set() for event in answer_peer.channels_ready.values()):
+        await asyncio.sleep(0.01)
+    await offer_peer.get_assistant()
+    await answer_peer.send_file("upload", make_pdf(make_corpus(5, seed=5)), "notes.pdf", timeout=120)
+    peers = {"offer": offer_peer, "answer": answer_peer}
+
+    # Idle: only heartbeats on the wire
+    before = {name: sent_pings(peer) for name, peer in peers.items()}
+    await asyncio.sleep(args.idle)
+    for name, peer in peers.items():
+        stats = peer.heartbeat.stats()
+        print(f"idle {args.idle:.0f}s   {name:<6} {stats['pings'] - before[name]:>3} pings "
+              f"(fixed 5s keep-alive: {int(args.idle // 5)}), interval now {stats['interval']:.1f}s, "
+              f"rtt p50 {(stats['rtt_p50'] or 0) * 1000:.1f} ms p99 {(stats['rtt_p99'] or 0) * 1000:.1f} ms")
+
+    # Busy: questions back to back, so traffic alone shows both peers are alive
+    before = {name: sent_pings(peer) for name, peer in peers.items()}
+    deadline = time.monotonic() + args.idle
+    asked = 0
+    while time.monotonic() < deadline:
+        await answer_peer.send_message("user", f"question {asked} about invoice INV-{100000 + asked}")
+        asked += 1
+    for name, peer in peers.items():
+        print(f"busy {args.idle:.0f}s   {name:<6} {sent_pings(peer) - before[name]:>3} pings during {asked} questions")
+
+    detected = {}
+    for name, peer in peers.items():
+        def on_peer_dead(peer=peer, name=name, original=peer.on_peer_dead):
+            detected.setdefault(name, time.monotonic() - cut)
+            original()
+        peer.on_peer_dead = on_peer_dead
+        # The heartbeat holds the method it was created with
+        peer.heartbeat.on_dead = on_peer_dead
+
+    # Slow enough to still be running when the connection comes back
+    ollama_stub.first_token = args.dead_after + 3
+    in_flight = asyncio.create_task(answer_peer.send_message("user", "what is still pending?", timeout=120))
+    await asyncio.sleep(0.2)
+
+    # Partition: everything sent is dropped until both peers have given up
+    partitioned = True
+    send = RTCDataChannel.send
+
+    def drop(channel, data):
+        if not partitioned:
+            send(channel, data)
+    RTCDataChannel.send = drop
+    cut = time.monotonic()
+    while len(detected) < 2 and time.monotonic() - cut < args.dead_after * 3:
+        await asyncio.sleep(0.01)
+    partitioned = False
+    RTCDataChannel.send = send
+    for name in peers:
+        if name in detected:
+            print(f"partition  {name:<6} declared the peer dead after {detected[name]:.2f}s "
+                  f"(bound {args.dead_after:.1f}s)")
+        else:
+            print(f"partition  {name:<6} did not notice")
+
+    while not all(peer.reconnecting is not None and peer.reconnecting.done() for peer in peers.values()):
+        if time.monotonic() - cut > 120:
+            break
+        await asyncio.sleep(0.05)
+    reconnect = tracing.tracer.histograms.get("peer.reconnect")
+    if reconnect is not None and reconnect.count:
+        print(f"reconnect  {reconnect.count} peers back in {reconnect.sum / reconnect.count:.2f}s on average")
+    answer_text = await in_flight
+    print(f"in flight  {'answered' if answer_text else 'lost'} after {time.monotonic() - cut:.1f}s")
+
+    for peer in peers.values():
+        await peer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dead-after", type=float, default=6.0, help="HEARTBEAT_DEAD_AFTER for both peers")
+    parser.add_argument("--idle", type=float, default=20.0, help="seconds of each of the idle and busy phases")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", module="langchain_core")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    openai_stub = StubOpenAIServer(latency=0.01).start()
+    ollama_stub = StubOllamaServer(first_token=0.02, per_token=0.001, tokens=10).start()
+    os.environ.update(OPENAI_BASE_URL=openai_stub.base_url, OPENAI_API_KEY="stub",
+                      OLLAMA_BASE_URL=ollama_stub.base_url, ICE_HOST_ONLY="1",
+                      HEARTBEAT_DEAD_AFTER=str(args.dead_after))
+    for name in ("METRICS_PORT", "TRACE_EXPORT"):
+        os.environ.pop(name, None)
+
+    import server
+    from werkzeug.serving import make_server
+    from tenants import TenantRegistry, SharedResources
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_port}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        registry = TenantRegistry(SharedResources(os.path.join(tmp, "tenants"), embedding=CountingEmbeddings()))
+        asyncio.run(run(url, registry, ollama_stub, args))
+        registry.close()
+        os.chdir(ROOT)
+    httpd.shutdown()
+    ollama_stub.stop()
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# bench_loop_lag.py
+# Event loop lag while ChatPDF-like blocking calls are handled inline on the loop
+# versus through the WorkerPool, with a mix of questions and uploads in flight.
+#
+#   python benchmarks/bench_loop_lag.py --requests 20 --work 0.3
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from workers import WorkerPool, LoopLagMonitor
+
+
+def blocking_call(seconds):
+    # Stands in for embedding + Chroma + an LLM round-trip
+    time.sleep(seconds)
+    return seconds
+
+
+async def handle_inline(seconds):
+    return blocking_call(seconds)
+
+
+async def run(mode, requests, work):
+    monitor = LoopLagMonitor(interval=0.01, report_every=0).start()
+    pool = WorkerPool(io_workers=8, max_running=8, max_waiting=requests)
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    if mode == "inline":
+        await asyncio.gather(*(handle_inline(work) for _ in range(requests)))
+    else:
+        await asyncio.gather(*(pool.run_io(blocking_call, work) for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.05)
+    monitor.stop()
+    pool.shutdown()
+    return elapsed, monitor.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--work", type=float, default=0.3)
+    args = parser.parse_args()
+
+    for mode in ("inline", "pool"):
+        elapsed, stats = asyncio.run(run(mode, args.requests, args.work))
+        print(f"{mode:6s} total={elapsed:.2f}s lag p50={stats['p50'] * 1000:.1f}ms "
+              f"p99={stats['p99'] * 1000:.1f}ms max={stats['max'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
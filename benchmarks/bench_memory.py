@@ -0,0 +1,67 @@
+# bench_memory.py
+# Ingest and startup cost of the old whole-file memory.json against the
+# append-only memory.jsonl log, for growing corpus sizes.
+#
+#   python benchmarks/bench_memory.py --sizes 1000 10000 50000
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from memory_store import MemoryLog
+
+CHUNK = "lorem ipsum dolor sit amet " * 38  # about one 1024-character chunk
+
+
+def make_entries(count, offset=0):
+    return [{"source": f"doc{(offset + i) // 20}.pdf", "content": f"{offset + i} {CHUNK}"} for i in range(count)]
+
+
+def bench_legacy(path, corpus, batch):
+    # What ChatPDF did before: load everything, append, rewrite everything
+    with open(path, "w") as f:
+        json.dump(corpus, f)
+    start = time.perf_counter()
+    with open(path) as f:
+        data = json.load(f)
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    data.extend(batch)
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return load, time.perf_counter() - start
+
+
+def bench_log(path, corpus, batch):
+    with open(path, "w") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in corpus))
+    start = time.perf_counter()
+    log = MemoryLog(path, compact_threshold=0)
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    log.append(batch)
+    return load, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--batch", type=int, default=50, help="chunks added per ingest")
+    args = parser.parse_args()
+
+    print(f"{'corpus':>8s} {'format':>7s} {'startup ms':>11s} {'ingest ms':>10s}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            corpus = make_entries(size)
+            batch = make_entries(args.batch, offset=size)
+            for name, bench, filename in [("json", bench_legacy, "memory.json"), ("jsonl", bench_log, "memory.jsonl")]:
+                load, ingest = bench(os.path.join(tmp, filename), corpus, batch)
+                print(f"{size:8d} {name:>7s} {load * 1000:11.2f} {ingest * 1000:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
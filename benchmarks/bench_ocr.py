@@ -0,0 +1,119 @@
+# bench_ocr.py
+# Throughput and text recall of the OCR backends over generated images: a short
+# note, a dense page, a noisy photo of a page, a full-size 300 dpi scan and a long
+# receipt (about 7900 px tall, which untiled is shrunk to a third of its size). Recall
+# is the share of the words drawn into an image that come back out of the OCR.
+#
+#   python benchmarks/bench_ocr.py --backends tesseract,tesseract-untiled,openai
+#
+# The openai backend calls the real GPT-4o API and needs OPENAI_API_KEY.
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from PIL import ImageFilter
+from fixtures import make_text_image, make_corpus
+
+
+def noisy(image, seed=0):
+    # Slight blur, rotation and speckle, like a phone photo of a printout
+    rng = random.Random(seed)
+    image = image.filter(ImageFilter.GaussianBlur(0.8)).rotate(1.5, expand=True, fillcolor="white")
+    pixels = image.load()
+    width, height = image.size
+    for _ in range(width * height // 200):
+        pixels[rng.randrange(width), rng.randrange(height)] = (90, 90, 90)
+    return image
+
+
+def fixture_images(count):
+    pages = make_corpus(pages=count * 9, lines_per_page=40)
+    images = []
+    for i in range(count):
+        note = pages[i * 9][:6]
+        dense = pages[i * 9 + 1][:26]
+        photo = pages[i * 9 + 2][:20]
+        scan = pages[i * 9 + 3][:40]
+        tall = [line for page in pages[i * 9 + 4:i * 9 + 9] for line in page]
+        images.append((f"note-{i}", note, make_text_image(note, size=(1000, 400))))
+        images.append((f"dense-{i}", dense, make_text_image(dense, size=(1400, 1100), font_size=28)))
+        images.append((f"photo-{i}", photo, noisy(make_text_image(photo, size=(1400, 900), font_size=26), seed=i)))
+        images.append((f"scan-{i}", scan, make_text_image(scan, size=(2480, 3508), font_size=44)))
+        images.append((f"tall-{i}", tall, make_text_image(tall, size=(1240, 40 + 39 * len(tall)), font_size=28)))
+    return images
+
+
+def words(text):
+    return re.findall(r"[a-z0-9-]+", text.lower())
+
+
+def recall(lines, text):
+    expected = words(" ".join(lines))
+    found = set(words(text))
+    return sum(1 for word in expected if word in found) / len(expected)
+
+
+def make_backend(name, workers):
+    from ocr import TesseractOCR, OpenAIVisionOCR
+    if name == "tesseract":
+        return TesseractOCR(workers=workers)
+    if name == "tesseract-untiled":
+        backend = TesseractOCR(workers=workers, tile_above=10 ** 6)
+        backend.name = name
+        return backend
+    if name == "openai":
+        from openai import OpenAI
+        return OpenAIVisionOCR(OpenAI())
+    raise ValueError(f"unknown backend {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", default="tesseract,tesseract-untiled")
+    parser.add_argument("--sets", type=int, default=3, help="number of note/dense/photo/scan/tall sets")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    from ocr import TesseractOCR
+    images = fixture_images(args.sets)
+    print(f"{len(images)} images")
+    print(f"{'backend':<18} {'images/s':>9} {'mean s':>8} {'max s':>8} {'recall':>8}   recall by kind")
+
+    for name in args.backends.split(","):
+        if name.startswith("tesseract") and not TesseractOCR.available():
+            print(f"{name:<18} skipped: pytesseract or the tesseract binary is not installed")
+            continue
+        if name == "openai" and not os.getenv("OPENAI_API_KEY"):
+            print(f"{name:<18} skipped: OPENAI_API_KEY is not set")
+            continue
+        backend = make_backend(name, args.workers)
+        # Worker processes are started once per peer, not per image
+        backend.extract(images[0][2])
+
+        times, recalls = [], {}
+        start = time.perf_counter()
+        for label, lines, image in images:
+            t = time.perf_counter()
+            try:
+                text = backend.extract(image)
+            except Exception as e:
+                print(f"{name}: {label} failed: {e}")
+                text = ""
+            times.append(time.perf_counter() - t)
+            recalls.setdefault(label.split("-")[0], []).append(recall(lines, text))
+        total = time.perf_counter() - start
+        backend.shutdown()
+
+        overall = [r for values in recalls.values() for r in values]
+        by_kind = "  ".join(f"{kind} {sum(v) / len(v):.2f}" for kind, v in recalls.items())
+        print(f"{name:<18} {len(images) / total:>9.2f} {sum(times) / len(times):>8.2f} {max(times):>8.2f} "
+              f"{sum(overall) / len(overall):>8.2f}   {by_kind}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# bench_reconnect.py
+# What survives a connection problem, between two real peers in one process as in
+# bench_e2e.py. Each scenario starts an upload and --questions questions, then:
+#   blip    drops every packet both ways for --blip seconds, shorter than the heartbeat's
+#           --dead-after, so SCTP's own retransmission covers it
+#   outage  drops every packet for --dead-after plus --outage seconds; both peers give
+#           up on the connection, try to resume it and renegotiate if that fails
+#   drop    closes the offer peer's connection outright, so only renegotiating helps
+# and reports how many questions were answered, whether the upload was acknowledged,
+# how the connection came back and what the resend queues replayed and suppressed.
+#
+#   python benchmarks/bench_reconnect.py --questions 8 --dead-after 6
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import warnings
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "offer"), os.path.join(ROOT, "answer")]
+
+from stub_openai import StubOpenAIServer
+from stub_ollama import StubOllamaServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+
+partitioned = False
+
+
+def lose_packets():
+    # Every DTLS and SCTP packet goes through aioice's Connection.send; STUN consent
+    # checks don't, so ICE itself stays up as it would through a short outage
+    import aioice
+    send = aioice.Connection.send
+
+    async def lossy(self, data):
+        if not partitioned:
+            await send(self, data)
+    aioice.Connection.send = lossy
+
+
+def counts(tracer, name):
+    histogram = tracer.histograms.get(name)
+    return histogram.count if histogram is not None else 0
+
+
+async def scenario(name, offer_peer, answer_peer, pdf, args):
+    global partitioned
+    import tracing
+    tracer = tracing.tracer
+    before = {stage: counts(tracer, stage) for stage in ("peer.resume", "peer.reconnect")}
+    replayed = offer_peer.resend.replayed + answer_peer.resend.replayed
+    duplicates = offer_peer.resend.duplicates + answer_peer.resend.duplicates
+
+    start = time.monotonic()
+    upload = asyncio.create_task(answer_peer.send_file("upload", pdf, f"{name}.pdf", timeout=180))
+    questions = [asyncio.create_task(answer_peer.send_message("user", f"{name} question {i} about INV-{100000 + i}",
+                                                              timeout=180))
+                 for i in range(args.questions)]
+    await asyncio.sleep(0.05)
+    if name == "drop":
+        await offer_peer.peer_connection.close()
+    else:
+        partitioned = True
+        await asyncio.sleep(args.blip if name == "blip" else args.dead_after + args.outage)
+        partitioned = False
+
+    answers = await asyncio.gather(*questions)
+    ack = await upload
+    elapsed = time.monotonic() - start
+    # Reconnecting may still be finishing on one side
+    for peer in (offer_peer, answer_peer):
+        if peer.reconnecting is not None:
+            await peer.reconnecting
+    after = {stage: counts(tracer, stage) - before[stage] for stage in before}
+    how = (f"{after['peer.resume']} resumed, {after['peer.reconnect']} renegotiated"
+           if any(after.values()) else "stayed up")
+    print(f"{name:<7} {sum(answer is not None for answer in answers):>3}/{len(answers)} answered, "
+          f"upload {'acknowledged' if ack else 'lost'}, all done in {elapsed:.1f}s; peers {how}; "
+          f"{offer_peer.resend.replayed + answer_peer.resend.replayed - replayed} messages replayed, "
+          f"{offer_peer.resend.duplicates + answer_peer.resend.duplicates - duplicates} duplicates dropped",
+          flush=True)
+
+
+async def run(url, registry, args):
+    import offer
+    import answer
+    lose_packets()
+    offer_peer = offer.WebRTCClient(url, "reconnect", registry=registry)
+    answer_peer = answer.WebRTCClient(url, "reconnect")
+    await asyncio.gather(offer_peer.setup_signal(), answer_peer.setup_signal())
+    while not all(event.is_set() for event in answer_peer.channels_ready.values()):
+        await asyncio.sleep(0.01)
+    await offer_peer.get_assistant()
+    pdf = make_pdf(make_corpus(args.pages, seed=args.pages))
+
+    for name in ("blip", "outage", "drop"):
+        await scenario(name, offer_peer, answer_peer, pdf, args)
+        await asyncio.sleep(1)
+
+    for peer in (offer_peer, answer_peer):
+        await peer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=40, help="pages in the uploaded PDF")
+    parser.add_argument("--dead-after", type=float, default=6.0, help="HEARTBEAT_DEAD_AFTER for both peers")
+    parser.add_argument("--blip", type=float, default=2.0)
+    parser.add_argument("--outage", type=float, default=3.0, help="seconds beyond --dead-after")
+    parser.add_argument("--first-token", type=float, default=0.5, help="stub model seconds before the first token")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", module="langchain_core")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    openai_stub = StubOpenAIServer(latency=0.01).start()
+    ollama_stub = StubOllamaServer(first_token=args.first_token, per_token=0.005, tokens=10).start()
+    os.environ.update(OPENAI_BASE_URL=openai_stub.base_url, OPENAI_API_KEY="stub",
+                      OLLAMA_BASE_URL=ollama_stub.base_url, ICE_HOST_ONLY="1",
+                      HEARTBEAT_DEAD_AFTER=str(args.dead_after))
+    for name in ("METRICS_PORT", "TRACE_EXPORT"):
+        os.environ.pop(name, None)
+
+    import server
+    from werkzeug.serving import make_server
+    from tenants import TenantRegistry, SharedResources
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_port}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        registry = TenantRegistry(SharedResources(os.path.join(tmp, "tenants"), embedding=CountingEmbeddings()))
+        asyncio.run(run(url, registry, args))
+        registry.close()
+        os.chdir(ROOT)
+    httpd.shutdown()
+    ollama_stub.stop()
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
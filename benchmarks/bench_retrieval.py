@@ -0,0 +1,125 @@
+# bench_retrieval.py
+# Recall@3 and latency of the vector-only retriever ChatPDF used to have, BM25 alone
+# and the hybrid retriever, on a generated corpus. Queries name an invoice number or
+# a date, ask about one in a sentence, or quote a line of text; a query is a hit if
+# one of the returned chunks contains what it asked for.
+#
+#   python benchmarks/bench_retrieval.py --pages 40 --delay 0.02
+#   python benchmarks/bench_retrieval.py --fastembed
+import os
+import re
+import sys
+import time
+import random
+import warnings
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from stub_openai import StubOpenAIServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+
+
+def queries(corpus, count, seed=0):
+    rng = random.Random(seed)
+    lines = [line for page in corpus for line in page]
+    invoices = sorted({m for line in lines for m in re.findall(r"INV-\d+", line)})
+    dates = sorted({m for line in lines for m in re.findall(r"\d{4}-\d\d-\d\d", line)})
+    out = []
+    for _ in range(count):
+        invoice, date = rng.choice(invoices), rng.choice(dates)
+        line = rng.choice(lines)
+        out.append(("invoice", invoice, invoice))
+        out.append(("date", date, date))
+        out.append(("sentence", f"what do my notes say about invoice {invoice}?", invoice))
+        words = line.split()[:6]
+        out.append(("line", " ".join(words), " ".join(words)))
+    return out
+
+
+def run(name, retrieve, cases, embedding):
+    hits, times = {}, []
+    calls = embedding.query_calls
+    for kind, query, expected in cases:
+        start = time.perf_counter()
+        docs = retrieve(query)
+        times.append(time.perf_counter() - start)
+        hits.setdefault(kind, []).append(any(expected in doc.page_content for doc in docs))
+    times.sort()
+    recall = {kind: sum(values) / len(values) for kind, values in hits.items()}
+    total = sum(sum(values) for values in hits.values()) / len(cases)
+    print(f"{name:<8} {total:>7.2f} " + " ".join(f"{recall[kind]:>9.2f}" for kind in recall) +
+          f" {times[len(times) // 2] * 1000:>8.1f} {times[int(len(times) * 0.99)] * 1000:>8.1f}"
+          f" {embedding.query_calls - calls:>11}")
+    return recall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=50, help="queries of each kind")
+    parser.add_argument("--delay", type=float, default=0.02, help="seconds of model time per embedded text")
+    parser.add_argument("--fastembed", action="store_true", help="use the real FastEmbed model")
+    args = parser.parse_args()
+    # The stand-in embedding gives Chroma relevance scores below 0, which LangChain warns about
+    warnings.filterwarnings("ignore", module="langchain_core")
+
+    openai_stub = StubOpenAIServer(latency=0.0).start()
+    os.environ["OPENAI_BASE_URL"] = openai_stub.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    from rag import ChatPDF
+
+    class Counted(CountingEmbeddings):
+        # Counts query embeddings of whichever model is underneath
+        def __init__(self, base, delay):
+            super().__init__(delay=delay)
+            self.base = base
+
+        def embed_documents(self, texts):
+            if self.base is None:
+                return super().embed_documents(texts)
+            return self.base.embed_documents(texts)
+
+        def embed_query(self, text):
+            if self.base is None:
+                return super().embed_query(text)
+            self.query_calls += 1
+            return self.base.embed_query(text)
+
+    base = None
+    if args.fastembed:
+        from langchain.embeddings import FastEmbedEmbeddings
+        base = FastEmbedEmbeddings()
+    embedding = Counted(base, args.delay)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = make_corpus(args.pages)
+        pdf_path = os.path.join(tmp, "corpus.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(make_pdf(corpus))
+        assistant = ChatPDF(json_path=os.path.join(tmp, "memory.json"),
+                            persist_directory=os.path.join(tmp, "chroma_db"), embedding=embedding)
+        assistant.ingest(pdf_path, source="corpus.pdf")
+        assistant.actions.shutdown()
+        print(f"{len(assistant.keyword_index)} chunks")
+
+        cases = queries(corpus, args.queries)
+        # Distinct query texts only: the embedding cache would otherwise hide the model cost
+        assistant.embedding.embed_query = assistant.embedding.base.embed_query
+        vector = assistant.vector_store.as_retriever(search_type="similarity_score_threshold",
+                                                     search_kwargs={"k": 3, "score_threshold": 0.5})
+        retriever = assistant.retriever
+
+        kinds = list(dict.fromkeys(kind for kind, _, _ in cases))
+        print(f"{'':<8} {'recall':>7} " + " ".join(f"{kind:>9}" for kind in kinds) +
+              f" {'p50 ms':>8} {'p99 ms':>8} {'query embeds':>11}")
+        run("vector", vector.get_relevant_documents, cases, embedding)
+        run("bm25", lambda q: retriever.keyword_search(q, k=3), cases, embedding)
+        run("hybrid", retriever.get_relevant_documents, cases, embedding)
+        print(f"hybrid routing: {retriever.stats()}")
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# bench_semantic_cache.py
+# Replays a stream of questions in which a few topics come back in different
+# wordings, with the exact-match answer cache alone and with the semantic cache on
+# top at several similarity thresholds. Reports hit rates, wrong hits (an answer
+# served for a different topic or a different invoice number) and mean answer time
+# against the stub Ollama server. Where the threshold should sit depends on the
+# embedding model: the hashing stand-in scores paraphrases far lower than a real
+# model, so run with --fastembed to pick one for production.
+#
+#   python benchmarks/bench_semantic_cache.py --questions 300 --thresholds 0.95,0.9,0.8,0.7
+#   python benchmarks/bench_semantic_cache.py --fastembed
+import os
+import sys
+import time
+import random
+import warnings
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from stub_openai import StubOpenAIServer
+from stub_ollama import StubOllamaServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+
+TOPICS = [
+    ["what is the budget for the project", "what's the project budget", "project budget?",
+     "can you tell me the budget of the project", "tell me the project budget please"],
+    ["when is the next client meeting", "next meeting with the client: when is it",
+     "when do we meet the client next", "what date is the next client meeting"],
+    ["summarize the quarterly report", "give me a summary of the quarterly report",
+     "quarterly report summary", "can you summarize the quarterly report for me"],
+    ["which shipments are late", "what shipments are running late", "late shipments?",
+     "list the shipments that are late"],
+    ["what does the contract say about payment", "payment terms in the contract",
+     "what are the contract payment terms", "contract: what does it say about payment"],
+]
+
+
+def workload(count, invoices, seed=0):
+    # Popular topics come up more often; some questions name a specific invoice
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(TOPICS))]
+    out = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            invoice = rng.choice(invoices)
+            wording = rng.choice(["what is the status of invoice {}", "status of invoice {} please",
+                                  "has invoice {} been paid"])
+            out.append((f"invoice {invoice}", wording.format(invoice)))
+        else:
+            topic = rng.choices(range(len(TOPICS)), weights)[0]
+            wording = rng.choice(TOPICS[topic])
+            out.append((f"topic {topic}", wording if rng.random() < 0.5 else wording.upper() + "?"))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--thresholds", default="0.92,0.8,0.7,0.6")
+    parser.add_argument("--first-token", type=float, default=0.3, help="stub model seconds before the first token")
+    parser.add_argument("--fastembed", action="store_true", help="use the real FastEmbed model")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", module="langchain_core")
+
+    openai_stub = StubOpenAIServer(latency=0.0).start()
+    ollama_stub = StubOllamaServer(first_token=args.first_token, per_token=0.0, tokens=20).start()
+    os.environ["OPENAI_BASE_URL"] = openai_stub.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["OLLAMA_BASE_URL"] = ollama_stub.base_url
+    from rag import ChatPDF
+    from cache import normalize_query
+
+    if args.fastembed:
+        from langchain.embeddings import FastEmbedEmbeddings
+        embedding = FastEmbedEmbeddings()
+    else:
+        embedding = CountingEmbeddings()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = make_corpus(10)
+        pdf_path = os.path.join(tmp, "corpus.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(make_pdf(corpus))
+        invoices = [word for page in corpus for line in page for word in line.split() if word.startswith("INV-")]
+        questions = workload(args.questions, invoices[:20])
+
+        print(f"{'threshold':<10} {'exact':>7} {'semantic':>9} {'wrong':>7} {'model calls':>12} {'mean ms':>8}")
+        runs = [("exact only", 2.0)] + [(threshold, float(threshold)) for threshold in args.thresholds.split(",")]
+        for name, threshold in runs:
+            workdir = tempfile.mkdtemp(dir=tmp)
+            assistant = ChatPDF(json_path=os.path.join(workdir, "memory.json"),
+                                persist_directory=os.path.join(workdir, "chroma_db"), embedding=embedding,
+                                semantic_threshold=threshold)
+            assistant.ingest(pdf_path, source="corpus.pdf")
+            assistant.actions.shutdown()
+
+            asked = {normalize_query(question): truth for truth, question in questions}
+            counts = {"exact": 0, "semantic": 0, "wrong": 0}
+            calls = ollama_stub.requests
+            start = time.perf_counter()
+            for truth, question in questions:
+                result = assistant.respond(question)
+                if result["cached"]:
+                    counts[result["cache"]] += 1
+                    if asked[result.get("matched", normalize_query(question))] != truth:
+                        counts["wrong"] += 1
+            elapsed = time.perf_counter() - start
+            print(f"{name:<10} {counts['exact'] / len(questions):>7.0%} {counts['semantic'] / len(questions):>9.0%} "
+                  f"{counts['wrong']:>7} {ollama_stub.requests - calls:>12} {elapsed / len(questions) * 1000:>8.0f}")
+    ollama_stub.stop()
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_signaling.py
+# Connection-setup time through the local Flask signaling server: the old
+# one-second /get_answer polling against long-polling with a pooled session.
+# Both peers are aiortc peers in this process, using host candidates only.
+#
+#   python benchmarks/bench_signaling.py --runs 10
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+import aiohttp
+from werkzeug.serving import make_server
+from aiortc import RTCPeerConnection, RTCConfiguration, RTCSessionDescription
+from signaling import SignalingClient
+import server
+
+
+def start_server():
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_port}"
+
+
+async def legacy_poll(url, path):
+    # What the offer peer used to do: GET, and sleep a second on 503
+    async with aiohttp.ClientSession() as http:
+        while True:
+            async with http.get(url + path) as resp:
+                if resp.status == 200:
+                    return await resp.json(content_type=None)
+            await asyncio.sleep(1)
+
+
+async def connect(url, mode, answer_delay):
+    config = RTCConfiguration(iceServers=[])
+    offer_pc, answer_pc = RTCPeerConnection(config), RTCPeerConnection(config)
+    channel = offer_pc.createDataChannel("chat")
+    opened = asyncio.Event()
+    channel.on("open", opened.set)
+    offer_signaling, answer_signaling = SignalingClient(url), SignalingClient(url)
+
+    async def answer_side():
+        # The answer peer shows up a little after the offer was posted
+        await asyncio.sleep(answer_delay)
+        data = await answer_signaling.poll("/get_offer", {"id": "bench"})
+        await answer_pc.setRemoteDescription(RTCSessionDescription(sdp=data["sdp"], type=data["type"]))
+        await answer_pc.setLocalDescription(await answer_pc.createAnswer())
+        await answer_signaling.post("/answer", {"id": "bench", "type": "answer", "sdp": answer_pc.localDescription.sdp})
+
+    start = time.perf_counter()
+    await offer_pc.setLocalDescription(await offer_pc.createOffer())
+    await offer_signaling.post("/offer", {"id": "bench", "type": "offer", "sdp": offer_pc.localDescription.sdp})
+    answer_task = asyncio.create_task(answer_side())
+    if mode == "polling":
+        data = await legacy_poll(url, "/get_answer")
+    else:
+        data = await offer_signaling.poll("/get_answer", {"id": "bench"})
+    await offer_pc.setRemoteDescription(RTCSessionDescription(sdp=data["sdp"], type=data["type"]))
+    await opened.wait()
+    elapsed = time.perf_counter() - start
+
+    await answer_task
+    await offer_signaling.close()
+    await answer_signaling.close()
+    await offer_pc.close()
+    await answer_pc.close()
+    return elapsed
+
+
+async def main(runs, answer_delay):
+    httpd, url = start_server()
+    for mode in ("polling", "long-poll"):
+        times = [await connect(url, mode, answer_delay) for _ in range(runs)]
+        print(f"{mode:10s} connect p50={statistics.median(times) * 1000:.0f}ms "
+              f"max={max(times) * 1000:.0f}ms over {runs} runs")
+    httpd.shutdown()
+
+
+if __name__ == "__main__":
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--answer-delay", type=float, default=0.2)
+    args = parser.parse_args()
+    asyncio.run(main(args.runs, args.answer_delay))
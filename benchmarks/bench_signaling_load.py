@@ -0,0 +1,82 @@
+# bench_signaling_load.py
+# Load test for the multi-session signaling server: many offer/answer pairings
+# signaling at once, each through its own mailbox. Checks every peer gets its own
+# partner's SDP and reports per-pairing latency.
+#
+#   python benchmarks/bench_signaling_load.py --pairings 300
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from werkzeug.serving import make_server
+from signaling import SignalingClient
+import server
+
+
+async def pairing(url, index, jitter):
+    pairing_id = f"pair-{index}"
+    offerer, answerer = SignalingClient(url), SignalingClient(url)
+    start = time.perf_counter()
+
+    async def offer_side():
+        await offerer.post("/offer", {"id": pairing_id, "client": f"offer-{index}", "type": "offer",
+                                      "sdp": f"offer-sdp-{index}"})
+        await offerer.post("/candidate", {"id": pairing_id, "role": "offer", "candidate": f"cand-{index}"})
+        answer = await offerer.poll("/get_answer", {"id": pairing_id})
+        assert answer["sdp"] == f"answer-sdp-{index}", answer
+
+    async def answer_side():
+        await asyncio.sleep(jitter * (index % 10) / 10)
+        offer = await answerer.poll("/get_offer", {"id": pairing_id})
+        assert offer["sdp"] == f"offer-sdp-{index}", offer
+        await answerer.post("/answer", {"id": pairing_id, "client": f"answer-{index}", "type": "answer",
+                                        "sdp": f"answer-sdp-{index}"})
+        async with answerer.session().get(url + "/get_candidates",
+                                          params={"id": pairing_id, "role": "answer", "wait": 5}) as resp:
+            candidates = await resp.json()
+        assert candidates and candidates[0]["candidate"] == f"cand-{index}", candidates
+
+    try:
+        await asyncio.gather(offer_side(), answer_side())
+        return time.perf_counter() - start
+    finally:
+        await offerer.close()
+        await answerer.close()
+
+
+async def main(pairings, jitter):
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_port}"
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(pairing(url, i, jitter) for i in range(pairings)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    times = sorted(r for r in results if isinstance(r, float))
+    failures = [r for r in results if not isinstance(r, float)]
+
+    print(f"pairings={pairings} ok={len(times)} failed={len(failures)} total={elapsed:.2f}s "
+          f"rate={len(times) / elapsed:.1f}/s")
+    if times:
+        print(f"per-pairing p50={statistics.median(times) * 1000:.0f}ms "
+              f"p99={times[min(len(times) - 1, int(len(times) * 0.99))] * 1000:.0f}ms")
+    for failure in failures[:5]:
+        print(f"failure: {failure!r}")
+    print(f"sessions held by server: {len(server.sessions)}")
+    httpd.shutdown()
+
+
+if __name__ == "__main__":
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairings", type=int, default=300)
+    parser.add_argument("--jitter", type=float, default=0.5, help="max delay before an answer peer starts")
+    args = parser.parse_args()
+    asyncio.run(main(args.pairings, args.jitter))
@@ -0,0 +1,115 @@
+# bench_startup.py
+# Time from starting the offer peer's process until its offer reaches the signaling
+# server, in a fresh interpreter each run. "eager" waits for ICE credentials and the
+# assistant before signaling, as the peer did when both happened at import and in
+# the constructor; "lazy" is the current startup, where they load in the background.
+# The Twilio request is stood in for by a sleep of --ice-delay seconds. Also reports
+# when the assistant (Chroma, the user's store and indexes) was ready.
+#
+#   python benchmarks/bench_startup.py --runs 5 --ice-delay 0.8 --memory 20000
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+
+OFFER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer")
+sys.path.insert(0, OFFER)
+
+CHILD = """
+import time
+start = time.perf_counter()
+import os, sys, json, asyncio
+sys.path.insert(0, {offer!r})
+import ice
+def fetch():
+    time.sleep({ice_delay})
+    return [], 86400
+ice.ice_servers.fetch = fetch
+import offer
+imported = time.perf_counter() - start
+
+async def main():
+    client = offer.WebRTCClient({url!r}, "startup")
+    if {eager}:
+        ice.ice_servers.get_sync()
+        client.assistant
+    asyncio.create_task(client.setup_signal())
+    await client.get_assistant()
+    print("STARTUP " + json.dumps({{"import": imported, "assistant": time.perf_counter() - start}}), flush=True)
+    await asyncio.sleep(30)
+asyncio.run(main())
+"""
+
+
+def seed_memory(root, count):
+    # A user with an existing memory log, so opening the store has work to do
+    from tenants import tenant_key
+    directory = os.path.join(root, "users", tenant_key("startup"))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "memory.jsonl"), "w") as f:
+        for i in range(count):
+            f.write(json.dumps({"source": f"doc{i // 20}.pdf", "content": f"note {i} invoice INV-{100000 + i}"}) + "\n")
+
+
+def run_once(url, eager, ice_delay, memory, tmp):
+    import requests
+    root = tempfile.mkdtemp(dir=tmp)
+    if memory:
+        seed_memory(root, memory)
+    env = dict(os.environ, TENANTS_DIR=root, OPENAI_API_KEY="stub", TWILIO_ACCOUNT_SID="stub",
+               TWILIO_AUTH_TOKEN="stub")
+    seen = {}
+
+    def wait_for_offer():
+        requests.get(url + "/get_offer", params={"id": "startup", "wait": 60}, timeout=90)
+        seen["offer"] = time.perf_counter() - start
+
+    waiter = threading.Thread(target=wait_for_offer)
+    waiter.start()
+    time.sleep(0.2)
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, "-c", CHILD.format(offer=OFFER, ice_delay=ice_delay, url=url,
+                                                                 eager=eager)],
+                             env=env, cwd=root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    report = None
+    for line in child.stdout:
+        if line.startswith("STARTUP "):
+            report = json.loads(line[len("STARTUP "):])
+            break
+    waiter.join()
+    child.kill()
+    child.wait()
+    return seen["offer"], report["import"], report["assistant"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--ice-delay", type=float, default=0.8, help="seconds the Twilio token request takes")
+    parser.add_argument("--memory", type=int, default=0, help="entries already in the user's memory log")
+    args = parser.parse_args()
+
+    import logging
+    import server
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_port}"
+
+    print(f"{'':<6} {'offer sent s':>13} {'import s':>9} {'assistant s':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, eager in [("eager", True), ("lazy", False)]:
+            results = [run_once(url, eager, args.ice_delay, args.memory, tmp) for _ in range(args.runs)]
+            offer, imported, assistant = (statistics.median(column) for column in zip(*results))
+            print(f"{name:<6} {offer:>13.2f} {imported:>9.2f} {assistant:>12.2f}")
+    httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bench_stream_ingest.py
+# Whole-file ingest() against streaming ingest_stream() on a generated PDF: total
+# time, time until the first chunks are searchable, and peak Python heap in the
+# ingesting process.
+#
+#   python benchmarks/bench_stream_ingest.py --pages 200
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from stub_openai import StubOpenAIServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+
+
+def run(mode, pdf_path, tmp, args):
+    from rag import ChatPDF
+    workdir = tempfile.mkdtemp(dir=tmp)
+    assistant = ChatPDF(json_path=os.path.join(workdir, "memory.json"),
+                        persist_directory=os.path.join(workdir, "chroma_db"),
+                        embedding=CountingEmbeddings(delay=args.delay), page_workers=args.workers)
+    first_searchable = [None]
+    # The offer peer keeps its page workers between uploads; don't time their startup
+    from pdf_pages import page_count
+    assistant._get_page_pool().submit(page_count, pdf_path).result()
+    start = time.perf_counter()
+
+    def progress(event):
+        if first_searchable[0] is None and event.get("chunks_stored"):
+            first_searchable[0] = time.perf_counter() - start
+
+    tracemalloc.start()
+    if mode == "ingest":
+        assistant.ingest(pdf_path, source="corpus.pdf")
+        first_searchable[0] = time.perf_counter() - start
+    else:
+        assistant.ingest_stream(pdf_path, source="corpus.pdf", progress=progress, batch_size=args.batch_size)
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assistant.actions.shutdown()
+    return total, first_searchable[0], peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--delay", type=float, default=0.002, help="seconds of model time per text")
+    args = parser.parse_args()
+
+    openai_stub = StubOpenAIServer(latency=0.0).start()
+    os.environ["OPENAI_BASE_URL"] = openai_stub.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "corpus.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(make_pdf(make_corpus(args.pages)))
+        print(f"{'mode':>7s} {'total s':>8s} {'first searchable s':>19s} {'peak heap MB':>13s}")
+        for mode in ("ingest", "stream"):
+            total, first, peak = run(mode, pdf_path, tmp, args)
+            print(f"{mode:>7s} {total:8.2f} {first:19.2f} {peak / 1024 / 1024:13.1f}")
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# bench_summarize.py
+# Load test for /summarize against the stub Ollama server: concurrent requests over
+# a few distinct texts, so the pool limit, queue bound and coalescing all show up.
+#
+#   python benchmarks/bench_summarize.py --requests 200 --distinct 20 --concurrency 50
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+import aiohttp
+from werkzeug.serving import make_server
+from stub_ollama import StubOllamaServer
+
+
+async def main(args):
+    ollama = StubOllamaServer(first_token=args.first_token, per_token=args.per_token).start()
+    os.environ["OLLAMA_BASE_URL"] = ollama.base_url
+    import server
+
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_port}/summarize"
+
+    gate = asyncio.Semaphore(args.concurrency)
+    statuses = {}
+    latencies = []
+
+    async def one(http, i):
+        async with gate:
+            start = time.perf_counter()
+            async with http.post(url, json={"text": f"option list {i % args.distinct}"}) as resp:
+                await resp.read()
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+                if resp.status == 200:
+                    latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        await asyncio.gather(*(one(http, i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"requests={args.requests} total={elapsed:.2f}s rate={args.requests / elapsed:.1f}/s statuses={statuses}")
+    if latencies:
+        print(f"latency p50={statistics.median(latencies) * 1000:.0f}ms "
+              f"p99={latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.0f}ms")
+    print(f"model calls={ollama.requests} summarizer={server.summarizer.stats()}")
+    httpd.shutdown()
+    ollama.stop()
+
+
+if __name__ == "__main__":
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--first-token", type=float, default=0.2)
+    parser.add_argument("--per-token", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,127 @@
+# bench_tenants.py
+# Many users with a few active at a time. "per-user" builds a full ChatPDF for every
+# user, as each Streamlit session used to; "registry" opens tenants through
+# TenantRegistry, which shares the models and clients and keeps at most --max-open
+# tenants open. Reports Python heap in use after the run, open stores, open and close
+# counts, mean question time, and whether any user's answer context contained
+# another user's invoice numbers.
+#
+#   python benchmarks/bench_tenants.py --users 40 --active 4 --rounds 200 --max-open 8
+import os
+import re
+import sys
+import time
+import random
+import warnings
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from stub_openai import StubOpenAIServer
+from stub_ollama import StubOllamaServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus
+
+
+def user_corpora(tmp, users, pages):
+    out = []
+    for user in range(users):
+        corpus = make_corpus(pages, seed=user)
+        path = os.path.join(tmp, f"user{user}.pdf")
+        with open(path, "wb") as f:
+            f.write(make_pdf(corpus))
+        invoices = sorted({m for page in corpus for line in page for m in re.findall(r"INV-\d+", line)})
+        out.append((path, invoices))
+    return out
+
+
+def workload(users, active, rounds, seed=0):
+    # A sliding window of active users: each round a user from the window asks, and
+    # now and then someone leaves the window and a new user joins it
+    rng = random.Random(seed)
+    window = list(range(active))
+    joined = active
+    out = []
+    for _ in range(rounds):
+        if rng.random() < 0.1 and joined < users:
+            window[rng.randrange(active)] = joined
+            joined += 1
+        out.append(rng.choice(window))
+    return out
+
+
+def run(name, acquire, release, corpora, questions, stats=None):
+    tracemalloc.start()
+    ingested, leaks, times = set(), 0, []
+    for user in questions:
+        assistant = acquire(user)
+        path, invoices = corpora[user]
+        if user not in ingested:
+            assistant.ingest(path, source=os.path.basename(path))
+            assistant.actions.shutdown()
+            ingested.add(user)
+        invoice = random.choice(invoices)
+        start = time.perf_counter()
+        assistant.respond(f"what is the status of invoice {invoice}")
+        times.append(time.perf_counter() - start)
+        context, _ = assistant._build_context(invoice)
+        leaks += any(m not in invoices for m in re.findall(r"INV-\d+", context))
+        release(user)
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    extra = stats() if stats else {}
+    print(f"{name:<10} {len(ingested):>6} {extra.get('open', len(ingested)):>6} {extra.get('opened', len(ingested)):>7} "
+          f"{extra.get('closed', 0):>7} {heap / 2 ** 20:>8.1f} {sum(times) / len(times) * 1000:>8.1f} {leaks:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--active", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--max-open", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=3)
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", module="langchain_core")
+
+    openai_stub = StubOpenAIServer(latency=0.0).start()
+    ollama_stub = StubOllamaServer(first_token=0.0, per_token=0.0, tokens=5).start()
+    os.environ["OPENAI_BASE_URL"] = openai_stub.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["OLLAMA_BASE_URL"] = ollama_stub.base_url
+    from rag import ChatPDF
+    from tenants import TenantRegistry, SharedResources
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpora = user_corpora(tmp, args.users, args.pages)
+        questions = workload(args.users, args.active, args.rounds)
+        print(f"{len(set(questions))} of {args.users} users ask {len(questions)} questions, {args.active} at a time")
+        print(f"{'':<10} {'users':>6} {'open':>6} {'opened':>7} {'closed':>7} {'heap MB':>8} {'mean ms':>8} {'leaks':>6}")
+
+        # Before: one ChatPDF, with its own clients and stores, per user for the process lifetime
+        assistants = {}
+
+        def acquire(user):
+            if user not in assistants:
+                workdir = os.path.join(tmp, "per-user", str(user))
+                assistants[user] = ChatPDF(json_path=os.path.join(workdir, "memory.json"), persist_directory=workdir,
+                                           embedding=CountingEmbeddings())
+            return assistants[user]
+        run("per-user", acquire, lambda user: None, corpora, questions)
+        for assistant in assistants.values():
+            assistant.close()
+        assistants.clear()
+
+        # After: shared models, at most max_open tenant stores open
+        registry = TenantRegistry(SharedResources(os.path.join(tmp, "tenants"), embedding=CountingEmbeddings()),
+                                  max_open=args.max_open)
+        run("registry", lambda user: registry.acquire(f"user-{user}"), lambda user: registry.release(f"user-{user}"),
+            corpora, questions, registry.stats)
+        registry.close()
+    ollama_stub.stop()
+    openai_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
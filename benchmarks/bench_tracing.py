@@ -0,0 +1,83 @@
+# bench_tracing.py
+# What tracing costs: time per span and per recorded duration, nested spans in a
+# worker thread reached through WorkerPool.run_io, and rendering the Prometheus
+# text. Also checks that spans opened in the worker join the caller's trace.
+#
+#   python benchmarks/bench_tracing.py --spans 200000
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from tracing import Tracer
+import tracing
+import workers
+
+
+def per_call(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spans", type=int, default=200000)
+    parser.add_argument("--calls", type=int, default=2000, help="run_io calls")
+    args = parser.parse_args()
+
+    tracer = Tracer(sample_rate=0.1)
+
+    def bare():
+        pass
+
+    def one_span():
+        with tracer.span("bench.span"):
+            pass
+
+    def nested():
+        with tracer.span("bench.outer", trace_id="feedface"):
+            with tracer.span("bench.inner"):
+                pass
+
+    base = per_call(bare, args.spans)
+    print(f"span            {(per_call(one_span, args.spans) - base) * 1e6:>6.2f} us")
+    print(f"nested pair     {(per_call(nested, args.spans) - base) * 1e6:>6.2f} us")
+    print(f"record          {(per_call(lambda: tracer.record('bench.record', 0.01), args.spans) - base) * 1e6:>6.2f} us")
+    start = time.perf_counter()
+    text = tracer.prometheus()
+    print(f"prometheus text {(time.perf_counter() - start) * 1000:>6.2f} ms for {len(tracer.histograms)} stages, "
+          f"{len(text)} bytes")
+
+    # Through the worker pool, against the process-wide tracer the peers use
+    tracing.tracer.sample_rate = 1.0
+    pool = workers.WorkerPool()
+
+    def work():
+        with tracing.span("bench.worker"):
+            return tracing.current_trace_id()
+
+    async def run_calls(traced):
+        loop_start = time.perf_counter()
+        joined = 0
+        for i in range(args.calls):
+            if traced:
+                with tracing.span("bench.request", trace_id=f"{i:016x}"):
+                    joined += await pool.run_io(work) == f"{i:016x}"
+            else:
+                await pool.run_io(bare)
+        return (time.perf_counter() - loop_start) / args.calls, joined
+
+    plain, _ = asyncio.run(run_calls(False))
+    traced, joined = asyncio.run(run_calls(True))
+    print(f"run_io          {plain * 1e6:>6.1f} us untraced, {traced * 1e6:.1f} us with two spans; "
+          f"{joined}/{args.calls} worker spans joined the caller's trace")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# bench_transfer.py
+# Upload throughput between two in-process aiortc peers (host candidates only):
+# the old base64-in-JSON message against binary chunked transfer.
+#
+#   python benchmarks/bench_transfer.py --sizes 1 4 16
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+from aiortc import RTCPeerConnection, RTCConfiguration
+from file_transfer import send_file, FileReceiver, is_file_frame
+
+
+async def connect_pair():
+    config = RTCConfiguration(iceServers=[])
+    sender_pc, receiver_pc = RTCPeerConnection(config), RTCPeerConnection(config)
+    channel = sender_pc.createDataChannel("upload")
+    remote = asyncio.get_running_loop().create_future()
+    receiver_pc.on("datachannel", lambda ch: remote.done() or remote.set_result(ch))
+    opened = asyncio.Event()
+    channel.on("open", opened.set)
+
+    await sender_pc.setLocalDescription(await sender_pc.createOffer())
+    await receiver_pc.setRemoteDescription(sender_pc.localDescription)
+    await receiver_pc.setLocalDescription(await receiver_pc.createAnswer())
+    await sender_pc.setRemoteDescription(receiver_pc.localDescription)
+    await opened.wait()
+    return sender_pc, receiver_pc, channel, await remote
+
+
+async def bench_json(channel, remote, payload):
+    done = asyncio.get_running_loop().create_future()
+
+    def on_message(message):
+        data = json.loads(message)
+        done.set_result(len(base64.b64decode(data["data"])))
+
+    remote.on("message", on_message)
+    start = time.perf_counter()
+    message = json.dumps({"type": "image", "data": base64.b64encode(payload).decode()})
+    channel.send(message)
+    received = await asyncio.wait_for(done, timeout=120)
+    remote.remove_listener("message", on_message)
+    return time.perf_counter() - start, len(message), received
+
+
+async def bench_binary(channel, remote, payload, transfer_id):
+    done = asyncio.get_running_loop().create_future()
+    receiver = FileReceiver()
+    wire_bytes = [0]
+
+    def on_message(message):
+        if is_file_frame(message):
+            wire_bytes[0] += len(message)
+            transfer = receiver.feed(message)
+            if transfer is not None:
+                done.set_result(transfer.size)
+
+    remote.on("message", on_message)
+    start = time.perf_counter()
+    await send_file(channel, payload, "bench.bin", "application/octet-stream", transfer_id)
+    received = await asyncio.wait_for(done, timeout=120)
+    remote.remove_listener("message", on_message)
+    return time.perf_counter() - start, wire_bytes[0], received
+
+
+async def main(sizes):
+    sender_pc, receiver_pc, channel, remote = await connect_pair()
+    print(f"{'size MB':>8s} {'mode':>7s} {'seconds':>8s} {'MB/s':>7s} {'wire MB':>8s}")
+    for i, size in enumerate(sizes):
+        payload = os.urandom(int(size * 1024 * 1024))
+        runs = [("json", lambda: bench_json(channel, remote, payload)),
+                ("binary", lambda: bench_binary(channel, remote, payload, f"{i:016x}"))]
+        for mode, run in runs:
+            try:
+                elapsed, wire, received = await run()
+            except Exception as e:
+                print(f"{size:8.1f} {mode:>7s} failed: {e!r}")
+                continue
+            assert received == len(payload)
+            print(f"{size:8.1f} {mode:>7s} {elapsed:8.2f} {size / elapsed:7.2f} {wire / 1024 / 1024:8.2f}")
+    await sender_pc.close()
+    await receiver_pc.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="payload sizes in MB")
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes))
@@ -0,0 +1,126 @@
+# bench_upload_images.py
+# Bytes put on the upload channel per image: full-resolution PNG (what the answer
+# peer used to send for PIL images), the original file, and the upload pipeline's
+# output. With Tesseract installed, also the OCR recall the offer peer gets from
+# the PNG, from the pipeline's output and from the old pipeline, which capped the
+# long side at 2000 px. Tall documents (a receipt, a long page photo) show the
+# difference; without Tesseract, the height of the text after scaling stands in
+# for recall (Tesseract needs roughly 20 px).
+#
+#   python benchmarks/bench_upload_images.py --max-short-side 2000 --max-pixels 8000000
+import io
+import os
+import sys
+import time
+import argparse
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, "..", "offer"))
+sys.path.insert(0, os.path.join(here, "..", "answer"))
+
+from PIL import Image, ImageOps
+from fixtures import make_text_image, make_corpus
+from bench_ocr import noisy, recall
+
+
+def encoded(image, **params):
+    buffered = io.BytesIO()
+    image.save(buffered, **params)
+    return buffered.getvalue()
+
+
+def long_side_capped(image, max_side=2000):
+    # What the pipeline did before: the long side scaled to max_side
+    image = image.copy()
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+def fixtures():
+    # (label, lines drawn, encoded image, mime, font size in px)
+    pages = make_corpus(pages=10, lines_per_page=30)
+    cases = []
+
+    # A phone photo of a printed page: 12 MP, stored sideways with an EXIF rotation
+    page = noisy(make_text_image(pages[0], size=(3024, 4032), font_size=64))
+    sideways = page.rotate(90, expand=True)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    cases.append(("phone photo", pages[0], encoded(sideways, format="JPEG", quality=95, exif=exif), "image/jpeg",
+                  64))
+
+    # A screenshot of notes
+    shot = make_text_image(pages[1][:20], size=(2560, 1440), font_size=30)
+    cases.append(("screenshot", pages[1][:20], encoded(shot, format="PNG"), "image/png", 30))
+
+    # A 300 dpi scan
+    scan = noisy(make_text_image(pages[2], size=(2480, 3508), font_size=48), seed=1)
+    cases.append(("scan", pages[2], encoded(scan, format="PNG"), "image/png", 48))
+
+    # A long till receipt, scanned narrow and tall
+    receipt_lines = [line for page in pages[4:7] for line in page][:80]
+    receipt = make_text_image(receipt_lines, size=(1000, 40 + 34 * len(receipt_lines)), font_size=24)
+    cases.append(("receipt", receipt_lines, encoded(receipt, format="PNG"), "image/png", 24))
+
+    # A photo of a long document page
+    long_lines = [line for page in pages[7:10] for line in page]
+    long_page = noisy(make_text_image(long_lines, size=(2000, 60 + 56 * len(long_lines)), font_size=40), seed=3)
+    cases.append(("long page", long_lines, encoded(long_page, format="JPEG", quality=92), "image/jpeg", 40))
+
+    # A colour photo with no text
+    gradient = Image.linear_gradient("L").resize((4000, 3000))
+    photo = noisy(Image.merge("RGB", (gradient, gradient.rotate(90), gradient.rotate(180))), seed=2)
+    cases.append(("colour photo", None, encoded(photo, format="JPEG", quality=92), "image/jpeg", None))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-short-side", type=int, default=2000)
+    parser.add_argument("--max-pixels", type=int, default=8_000_000)
+    parser.add_argument("--no-webp", action="store_true")
+    args = parser.parse_args()
+
+    from upload_pipeline import ImageUploadPipeline, classify
+    from ocr import TesseractOCR
+    pipeline = ImageUploadPipeline(max_short_side=args.max_short_side, max_pixels=args.max_pixels,
+                                   use_webp=not args.no_webp)
+    ocr = TesseractOCR(workers=2) if TesseractOCR.available() else None
+    if ocr is None:
+        print("Tesseract not installed: reporting bytes only")
+
+    print(f"{'image':<14} {'class':<9} {'png KB':>8} {'orig KB':>8} {'sent KB':>8} {'vs png':>7} {'encode ms':>10} "
+          f"{'text px':>8} {'old px':>7} {'recall png':>11} {'recall sent':>12} {'recall old':>11}")
+    totals = [0, 0]
+    for label, lines, data, mime, font_size in fixtures():
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        png = encoded(image, format="PNG")
+        start = time.perf_counter()
+        sent, sent_mime = pipeline.prepare(data, mime)
+        elapsed = time.perf_counter() - start
+        received = Image.open(io.BytesIO(sent))
+        old = long_side_capped(image)
+        totals[0] += len(png)
+        totals[1] += len(sent)
+
+        text_px = ["", ""]
+        if font_size:
+            text_px = [f"{font_size * received.size[0] / image.size[0]:.0f}",
+                       f"{font_size * old.size[0] / image.size[0]:.0f}"]
+        recalls = ["", "", ""]
+        if ocr is not None and lines:
+            recalls = [f"{recall(lines, ocr.extract(Image.open(io.BytesIO(png)))):.2f}",
+                       f"{recall(lines, ocr.extract(received)):.2f}",
+                       f"{recall(lines, ocr.extract(old)):.2f}"]
+        print(f"{label:<14} {classify(image):<9} {len(png) / 1024:>8.0f} {len(data) / 1024:>8.0f} "
+              f"{len(sent) / 1024:>8.0f} {len(sent) / len(png):>6.0%} {elapsed * 1000:>10.0f} "
+              f"{text_px[0]:>8} {text_px[1]:>7} {recalls[0]:>11} {recalls[1]:>12} {recalls[2]:>11}   "
+              f"{sent_mime} {received.size[0]}x{received.size[1]}")
+
+    print(f"total: {totals[0] / 1024:.0f} KB as PNG, {totals[1] / 1024:.0f} KB sent ({totals[1] / totals[0]:.0%})")
+    if ocr is not None:
+        ocr.shutdown()
+
+
+if __name__ == "__main__":
+    main()
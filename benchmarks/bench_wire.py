@@ -0,0 +1,98 @@
+# bench_wire.py
+# Bytes on the wire and CPU per message for the DataChannel messages the peers send:
+# stream tokens, ingest progress, short and long answers, a page of extracted text
+# and a legacy base64 image upload. The messages are encoded as JSON text (what old
+# peers get), and as wire frames with each codec and compression, at the default
+# threshold below which frames are not compressed. Text is drawn at random from a
+# vocabulary, so it compresses roughly like prose, not like the repetitive fixtures.
+#
+#   python benchmarks/bench_wire.py --repeat 2000
+import io
+import os
+import sys
+import time
+import base64
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "offer"))
+
+import wire
+from wire import WireFormat
+from fixtures import make_text_image
+
+VOCABULARY = ("the a of to and in that is for on with as it by this from be are was at or an which "
+              "invoice payment contract client report meeting budget schedule delivery review approval "
+              "order shipment deadline quarterly summary notes team project update document page says "
+              "according total amount due date received pending paid overdue account number reference "
+              "customer supplier service agreement section clause terms renewal period notice").split()
+
+
+def text(rng, words):
+    parts = []
+    for i in range(words):
+        parts.append(f"INV-{rng.randrange(100000, 999999)}" if rng.random() < 0.02 else rng.choice(VOCABULARY))
+    return " ".join(parts)
+
+
+def messages():
+    rng = random.Random(0)
+    ids = dict(id=f"{rng.getrandbits(64):016x}", ep=f"{rng.getrandbits(32):08x}")
+    image = make_text_image([text(rng, 8) for _ in range(12)], size=(900, 500))
+    png = io.BytesIO()
+    image.save(png, format="PNG")
+    return {
+        "token": {"type": "token", "data": " payment", "seq": 17, "sn": 412, **ids},
+        "progress": {"type": "progress", "data": {"type": "progress", "source": "contract.pdf", "stage": "pages",
+                                                  "pages_done": 12, "pages_total": 40, "chunks_stored": 96},
+                     "sn": 413, **ids},
+        "answer 80w": {"type": "text", "data": text(rng, 80), "cached": False, "cache": None,
+                       "server_time": 0.8123, "sn": 414, **ids},
+        "answer 600w": {"type": "text", "data": text(rng, 600), "cached": False, "cache": None,
+                        "server_time": 2.417, "sn": 415, **ids},
+        "page text 5kw": {"type": "text", "data": text(rng, 5000), "sn": 416, **ids},
+        "image base64": {"type": "image", "data": base64.b64encode(png.getvalue()).decode(), "sn": 7, **ids},
+    }
+
+
+def formats():
+    yield "json text", WireFormat()
+    for codec in wire.CODECS:
+        for compression in (None,) + wire.COMPRESSION:
+            encoder = WireFormat()
+            encoder.codec, encoder.compression = codec, compression
+            yield f"{codec}+{compression or 'none'}", encoder
+
+
+def per_call(fn, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--threshold", type=int, default=wire.COMPRESS_THRESHOLD)
+    args = parser.parse_args()
+
+    frames = messages()
+    print(f"{'message':<14} {'format':<16} {'bytes':>8} {'vs json':>8} {'encode us':>10} {'decode us':>10}")
+    for name, frame in frames.items():
+        baseline = None
+        repeat = max(20, args.repeat * 200 // max(200, len(str(frame))))
+        for label, encoder in formats():
+            encoder.threshold = args.threshold
+            encoded = encoder.encode(frame)
+            assert encoder.decode(encoded) == frame
+            size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+            baseline = baseline or size
+            encode = per_call(encoder.encode, frame, repeat)
+            decode = per_call(encoder.decode, encoded, repeat)
+            print(f"{name:<14} {label:<16} {size:>8} {size / baseline:>7.0%} {encode * 1e6:>10.1f} {decode * 1e6:>10.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# fixtures.py
+# Deterministic stand-ins shared by the benchmarks: a cheap hashing embedding that
+# counts its calls, and generators for text PDFs and text images.
+import math
+import time
+import hashlib
+from langchain.embeddings.base import Embeddings
+
+
+class CountingEmbeddings(Embeddings):
+    # Bag-of-words hashed into a fixed-size vector; similar texts get similar vectors.
+    # delay simulates model time per text.
+    def __init__(self, dim=256, delay=0.0):
+        self.dim = dim
+        self.delay = delay
+        self.document_calls = 0
+        self.query_calls = 0
+        self.texts_embedded = 0
+
+    def _vector(self, text):
+        vector = [0.0] * self.dim
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        self.document_calls += 1
+        self.texts_embedded += len(texts)
+        time.sleep(self.delay * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.query_calls += 1
+        time.sleep(self.delay)
+        return self._vector(text)
+
+
+def make_pdf(pages):
+    # Minimal valid PDF with one text page per entry in pages (a list of line lists)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = " ".join(f"({line.replace('(', '[').replace(')', ']')}) Tj T*" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_ref = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_text_image(lines, size=(1200, 800), font_size=28):
+    from PIL import Image, ImageDraw, ImageFont
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype("DejaVuSans.ttf", font_size)
+    except OSError:
+        font = ImageFont.load_default()
+    y = 20
+    for line in lines:
+        draw.text((20, y), line, fill="black", font=font)
+        y += int(font_size * 1.4)
+    return image
+
+
+def make_corpus(pages, lines_per_page=40, seed=0):
+    # Pseudo-random notes with some exact identifiers (invoice numbers, dates) mixed in
+    words = ("meeting invoice report budget project client schedule review delivery contract "
+             "payment update team quarterly notes summary deadline approval order shipment").split()
+    corpus = []
+    for page in range(pages):
+        lines = []
+        for line in range(lines_per_page):
+            n = seed + page * lines_per_page + line
+            picked = [words[(n * 7 + k * 3) % len(words)] for k in range(8)]
+            if line % 10 == 0:
+                picked.append(f"INV-{100000 + n}")
+            if line % 15 == 0:
+                picked.append(f"2024-{1 + n % 12:02d}-{1 + n % 28:02d}")
+            lines.append(" ".join(picked))
+        corpus.append(lines)
+    return corpus
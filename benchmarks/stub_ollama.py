@@ -0,0 +1,119 @@
+# stub_ollama.py
+# A local stand-in for the Ollama HTTP API (/api/generate, /api/chat, /api/tags).
+# Replies are deterministic, and streamed as NDJSON like the real server, with a
+# configurable time-to-first-token and per-token delay. prefill adds a delay per
+# prompt token before the first one, like a model reading its prompt.
+#
+#   python benchmarks/stub_ollama.py --port 11435 --first-token 0.3 --per-token 0.02
+#   OLLAMA_BASE_URL=http://127.0.0.1:11435 python ...
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ("the document says the answer is in the retrieved context and it is "
+         "concise accurate and based only on the provided notes").split()
+
+
+def reply_for(prompt, tokens):
+    # Same prompt, same reply
+    seed = int(hashlib.sha256(prompt.encode()).hexdigest(), 16)
+    return [WORDS[(seed + i * 7) % len(WORDS)] + " " for i in range(tokens)]
+
+
+class StubOllamaServer:
+    def __init__(self, host="127.0.0.1", port=0, first_token=0.3, per_token=0.02, tokens=40, prefill=0.0):
+        self.first_token = first_token
+        self.prefill = prefill
+        self.per_token = per_token
+        self.tokens = tokens
+        self.requests = 0
+        self.prompt_chars = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = json.dumps({"models": [{"name": "llama3"}, {"name": "phi3"}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if "messages" in request:
+                    prompt = "\n".join(str(m.get("content", "")) for m in request["messages"])
+                else:
+                    prompt = request.get("prompt", "")
+                with stub.lock:
+                    stub.requests += 1
+                    stub.prompt_chars += len(prompt)
+                tokens = reply_for(prompt, stub.tokens)
+                chat = self.path.endswith("/api/chat")
+                stream = request.get("stream", True)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(stub.first_token + stub.prefill * (len(prompt) // 4))
+                if stream:
+                    for token in tokens:
+                        self._chunk(self._frame(request, token, chat, False))
+                        time.sleep(stub.per_token)
+                    self._chunk(self._frame(request, "", chat, True, len(prompt) // 4, len(tokens)))
+                else:
+                    time.sleep(stub.per_token * len(tokens))
+                    self._chunk(self._frame(request, "".join(tokens), chat, True, len(prompt) // 4, len(tokens)))
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _frame(self, request, text, chat, done, prompt_tokens=0, eval_tokens=0):
+                frame = {"model": request.get("model", "stub"), "created_at": "2024-01-01T00:00:00Z", "done": done}
+                if chat:
+                    frame["message"] = {"role": "assistant", "content": text}
+                else:
+                    frame["response"] = text
+                if done:
+                    frame.update({"prompt_eval_count": prompt_tokens, "eval_count": eval_tokens})
+                return json.dumps(frame).encode() + b"\n"
+
+            def _chunk(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--first-token", type=float, default=0.3)
+    parser.add_argument("--per-token", type=float, default=0.02)
+    args = parser.parse_args()
+    server = StubOllamaServer(args.host, args.port, args.first_token, args.per_token)
+    print(f"Stub Ollama server on {server.base_url}")
+    server.httpd.serve_forever()
@@ -0,0 +1,100 @@
+# stub_openai.py
+# A local OpenAI-compatible server for benchmarks. It answers /v1/chat/completions
+# after a fixed delay with deterministic content, so runs are repeatable and free.
+#
+#   python benchmarks/stub_openai.py --port 8001 --latency 0.8
+#   OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python ...
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SECTION_PATTERN = re.compile(r"^###\s*SECTION\s+(\d+)\s*$", re.MULTILINE)
+
+
+def analyze(text):
+    if re.search(r"\b(meeting|appointment|remind|due|tomorrow|monday|friday)\b", text, re.IGNORECASE):
+        return "ACTION: SET_REMINDER\nDETAILS: 2024-01-01 09:00 " + " ".join(text.split()[:8])
+    return "No action required."
+
+
+def complete(messages):
+    user = messages[-1]["content"] if messages else ""
+    if isinstance(user, list):
+        # Vision request: return the text part as the "extracted" text
+        return "Stub OCR text for an uploaded image."
+    sections = list(SECTION_PATTERN.finditer(user))
+    if not sections:
+        return analyze(user)
+    answers = []
+    for i, match in enumerate(sections):
+        end = sections[i + 1].start() if i + 1 < len(sections) else len(user)
+        answers.append(f"### SECTION {match.group(1)}\n{analyze(user[match.end():end])}")
+    return "\n\n".join(answers)
+
+
+class StubOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.5, per_token_latency=0.0):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub.lock:
+                    stub.requests += 1
+                messages = body.get("messages", [])
+                content = complete(messages)
+                prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+                completion_tokens = len(content.split())
+                time.sleep(stub.latency + stub.per_token_latency * prompt_tokens)
+                payload = json.dumps({
+                    "id": f"chatcmpl-stub-{stub.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    server = StubOpenAIServer(args.host, args.port, args.latency)
+    print(f"Stub OpenAI server on {server.base_url}")
+    server.httpd.serve_forever()
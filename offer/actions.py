@@ -0,0 +1,213 @@
+# actions.py
+import re
+import time
+import threading
+import datetime
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from tracing import span
+
+
+SECTION_HEADER = "### SECTION {}"
+SECTION_PATTERN = re.compile(r"^###\s*SECTION\s+(\d+)\s*$", re.MULTILINE)
+
+
+def action_system_prompt(current_date=None):
+    current_date = current_date or datetime.datetime.now()
+    return ("Analyze the following text and identify if any actions need to be taken. "
+            "Specifically, look for: "
+            "1. Dates of events or appointments "
+            "2. Tasks or to-do items "
+            "3. Reminders "
+            f"Today's date is {current_date.strftime('%Y-%m-%d')}. "
+            "For any dates mentioned in relative terms (e.g., 'this Friday,' 'next Monday'), "
+            "calculate and provide the actual date. "
+            "If an action is found, provide it in the following format: "
+            "ACTION: [Type of action (e.g., SET_ALARM, ADD_TODO, SET_REMINDER)] "
+            "DETAILS: [Relevant details including specific date (YYYY-MM-DD), time, and description] "
+            "If no action is needed, respond with 'No action required.'")
+
+
+def batch_system_prompt(current_date=None):
+    return (action_system_prompt(current_date) +
+            " The text is split into numbered sections, each starting with a line like "
+            f"'{SECTION_HEADER.format(1)}'. Analyze every section on its own and answer for each one, "
+            "starting each answer with the same section header line.")
+
+
+def pack_sections(texts):
+    return "\n\n".join(f"{SECTION_HEADER.format(i + 1)}\n{text}" for i, text in enumerate(texts))
+
+
+def split_sections(analysis, count):
+    # Returns one analysis string per input section; sections the model skipped
+    # are treated as 'No action required.'
+    results = ["No action required."] * count
+    matches = list(SECTION_PATTERN.finditer(analysis))
+    if not matches:
+        if count == 1:
+            results[0] = analysis
+        return results
+    for i, match in enumerate(matches):
+        index = int(match.group(1)) - 1
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(analysis)
+        if 0 <= index < count:
+            results[index] = analysis[match.end():end].strip()
+    return results
+
+
+def request_analysis(openai_client, model, system_prompt, text, max_tokens):
+    # Returns the analysis and (prompt, completion) token counts
+    with span("actions.request", model=model):
+        response = openai_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text}
+            ],
+            max_tokens=max_tokens
+        )
+    usage = getattr(response, "usage", None)
+    tokens = (getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+    return response.choices[0].message.content or "", tokens
+
+
+def analyze_text_for_actions(openai_client, text, model="gpt-4", max_tokens=150):
+    # One blocking request for a single text, such as a chat message. Needs only an
+    # OpenAI client, so callers without a ChatPDF can use it.
+    analysis, _ = request_analysis(openai_client, model, action_system_prompt(), text, max_tokens)
+    if "ACTION:" in analysis:
+        print("Action identified:")
+        print(analysis)
+        perform_action(analysis)
+    else:
+        print("No action required.")
+    return analysis
+
+
+def perform_action(action_text):
+    action_type = action_text.split("ACTION:")[1].split("\n")[0].strip()
+    details = action_text.split("DETAILS:")[1].strip()
+
+    if action_type == "SET_ALARM":
+        set_alarm(details)
+    elif action_type == "ADD_TODO":
+        add_todo(details)
+    elif action_type == "SET_REMINDER":
+        set_reminder(details)
+
+
+def set_alarm(details):
+    # This is a placeholder function. In a real application, you would integrate
+    # with a calendar or alarm system.
+    print(f"Alarm set: {details}")
+
+
+def add_todo(details):
+    # This is a placeholder function. In a real application, you would integrate
+    # with a to-do list or task management system.
+    print(f"Todo added: {details}")
+
+
+def set_reminder(details):
+    # This is a placeholder function. In a real application, you would integrate
+    # with a reminder or notification system.
+    print(f"Reminder set: {details}")
+
+
+class ActionExtractor:
+    def __init__(self, openai_client, on_action, model="gpt-4", batch_size=8, max_concurrency=4,
+                 max_tokens_per_chunk=150):
+        self.openai_client = openai_client
+        self.on_action = on_action
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.max_tokens_per_chunk = max_tokens_per_chunk
+        # The pool size is the bound on concurrent requests to the model
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="actions")
+        self.reports = deque(maxlen=100)
+        self.lock = threading.Lock()
+
+    def submit(self, texts, source):
+        # Packs the texts into batches and analyzes them in the background.
+        # The returned future resolves to the extraction report for the document.
+        texts = [text for text in texts if text and text.strip()]
+        done = Future()
+        report = {
+            "source": source,
+            "chunks": len(texts),
+            "batches": 0,
+            "actions": 0,
+            "errors": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "latency": 0.0,
+        }
+        if not texts:
+            done.set_result(report)
+            return done
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        report["batches"] = len(batches)
+        remaining = [len(batches)]
+        start = time.perf_counter()
+
+        def on_batch_done(future):
+            with self.lock:
+                try:
+                    usage, actions = future.result()
+                    report["prompt_tokens"] += usage[0]
+                    report["completion_tokens"] += usage[1]
+                    report["actions"] += actions
+                except Exception as e:
+                    report["errors"] += 1
+                    print(f"Error analyzing text for actions in {source}: {e}")
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+                if finished:
+                    report["latency"] = time.perf_counter() - start
+                    self.reports.append(report)
+            if finished:
+                print(f"Action extraction for {source}: {report['chunks']} chunks in {report['batches']} requests, "
+                      f"{report['latency']:.2f}s, {report['prompt_tokens']} prompt / "
+                      f"{report['completion_tokens']} completion tokens, {report['actions']} actions")
+                done.set_result(report)
+
+        for batch in batches:
+            # Each batch runs in a copy of the caller's context, so it joins the ingest trace
+            self.executor.submit(contextvars.copy_context().run, self._analyze_batch, batch).add_done_callback(
+                on_batch_done)
+        return done
+
+    def analyze(self, text):
+        # Single text, blocking; returns the raw analysis
+        analysis, _ = self._request(action_system_prompt(), text, self.max_tokens_per_chunk)
+        return analysis
+
+    def _analyze_batch(self, texts):
+        if len(texts) == 1:
+            analysis, usage = self._request(action_system_prompt(), texts[0], self.max_tokens_per_chunk)
+            results = [analysis]
+        else:
+            analysis, usage = self._request(batch_system_prompt(), pack_sections(texts),
+                                            self.max_tokens_per_chunk * len(texts))
+            results = split_sections(analysis, len(texts))
+
+        actions = 0
+        for result in results:
+            if "ACTION:" in result:
+                actions += 1
+                print("Action identified:")
+                print(result)
+                try:
+                    self.on_action(result)
+                except Exception as e:
+                    print(f"Error performing action: {e}")
+        return usage, actions
+
+    def _request(self, system_prompt, text, max_tokens):
+        return request_analysis(self.openai_client, self.model, system_prompt, text, max_tokens)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
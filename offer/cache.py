@@ -0,0 +1,131 @@
+# cache.py
+import re
+import math
+import time
+import operator
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(query: str):
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+def identifiers(text):
+    # Numbers, dates and codes: "invoice INV-100123" and "invoice INV-100124" embed
+    # almost identically but must never share an answer
+    return frozenset(re.findall(r"[\w-]*\d[\w./-]*", text.lower()))
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class LRUCache:
+    # Bounded least-recently-used cache whose entries also expire after ttl seconds
+    def __init__(self, maxsize=256, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None:
+                value, expires = item
+                if self.ttl is None or expires > time.monotonic():
+                    self.data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            expires = time.monotonic() + self.ttl if self.ttl is not None else None
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self.data), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+class SemanticCache:
+    # Answers keyed by the embedding of their question. A new question is served an
+    # earlier answer when it is at least threshold cosine-similar, names the same
+    # identifiers and was asked against the same vector store version. Bounded to
+    # maxsize entries, least recently used first out, each living ttl seconds.
+    def __init__(self, maxsize=256, threshold=0.92, ttl=3600):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def get(self, query, vector, version):
+        # Returns (answer, cached question, similarity) or None
+        vector = _normalize(vector)
+        names = identifiers(query)
+        now = time.monotonic()
+        with self.lock:
+            best, best_score, near_miss = None, self.threshold, False
+            for key, entry in list(self.data.items()):
+                if entry["expires"] <= now:
+                    del self.data[key]
+                    continue
+                if entry["version"] != version:
+                    continue
+                score = sum(map(operator.mul, vector, entry["vector"]))
+                if score < best_score:
+                    continue
+                if entry["identifiers"] != names:
+                    near_miss = True
+                    continue
+                best, best_score = key, score
+            if best is None:
+                self.misses += 1
+                self.rejected += near_miss
+                return None
+            self.data.move_to_end(best)
+            self.hits += 1
+            return self.data[best]["answer"], best, best_score
+
+    def put(self, query, vector, answer, version):
+        with self.lock:
+            key = normalize_query(query)
+            self.data[key] = {"vector": _normalize(vector), "answer": answer, "version": version,
+                              "identifiers": identifiers(query), "expires": time.monotonic() + self.ttl}
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self.data), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "identifier_mismatches": self.rejected}
@@ -0,0 +1,151 @@
+# context.py
+# Turns retrieved chunks into the context of the llama3 prompt: reorder them for
+# relevance and diversity, merge neighbouring chunks of the same source back
+# together, and stop at a fixed token budget so prompt length, and with it prefill
+# time, stays predictable.
+import math
+from collections import deque
+
+from ingest_index import content_hash
+
+
+def estimate_tokens(text):
+    # About four characters per token for English text with the llama3 tokenizer
+    return (len(text) + 3) // 4
+
+
+def overlap(left, right, min_overlap=20, max_overlap=400):
+    # Length of the longest suffix of left that is also a prefix of right
+    seed = right[:min_overlap]
+    if len(seed) < min_overlap:
+        return 0
+    position = left.find(seed, max(0, len(left) - max_overlap))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(seed, position + 1)
+    return 0
+
+
+def merge_adjacent(docs):
+    # docs are (source, text) in rank order. Chunks that overlap (the splitter repeats
+    # up to chunk_overlap characters) or contain one another are joined; a merged
+    # piece keeps the rank of its best chunk.
+    pieces = []
+    for source, text in docs:
+        for piece in pieces:
+            if piece[0] != source:
+                continue
+            if text in piece[1]:
+                break
+            if piece[1] in text:
+                piece[1] = text
+                break
+            size = overlap(piece[1], text)
+            if size:
+                piece[1] = piece[1] + text[size:]
+                break
+            size = overlap(text, piece[1])
+            if size:
+                piece[1] = text + piece[1][size:]
+                break
+        else:
+            pieces.append([source, text])
+    merged = [tuple(piece) for piece in pieces]
+    # A chunk that joined two pieces may have made them adjacent; go again until stable
+    return merged if len(merged) == len(docs) else merge_adjacent(merged)
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def mmr_order(vectors, mmr_lambda=0.7):
+    # Maximal marginal relevance without a query vector: relevance is the retriever's
+    # rank, so keyword-only queries still never need the embedding model. Returns
+    # indexes in the new order.
+    count = len(vectors)
+    relevance = [1.0 - i / count for i in range(count)]
+    order, remaining = [], list(range(count))
+    similarity = {}
+    while remaining:
+        def score(i):
+            redundancy = 0.0
+            for j in order:
+                key = (min(i, j), max(i, j))
+                if key not in similarity:
+                    similarity[key] = _cosine(vectors[i], vectors[j])
+                redundancy = max(redundancy, similarity[key])
+            return mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy
+        best = max(remaining, key=score)
+        order.append(best)
+        remaining.remove(best)
+    return order
+
+
+class ContextPacker:
+    def __init__(self, embedding=None, budget=768, mmr_lambda=0.7, min_fill=48, window=1000, vectors=None):
+        # budget: the baseline passed three 1000-character chunks, about 768 tokens.
+        # vectors: optional lookup of stored vectors, {content hash: vector}
+        self.embedding = embedding
+        self.vectors = vectors
+        self.budget = budget
+        self.mmr_lambda = mmr_lambda
+        self.min_fill = min_fill
+        self.prefill = deque(maxlen=window)
+
+    def rerank(self, docs):
+        # The chunks were embedded at ingest, so their vectors come from the store;
+        # only chunks it doesn't have go to the embedding model
+        if len(docs) < 3 or (self.embedding is None and self.vectors is None):
+            return docs
+        digests = [content_hash(doc.page_content) for doc in docs]
+        found = self.vectors(digests) if self.vectors else {}
+        missing = [i for i, digest in enumerate(digests) if digest not in found]
+        if missing:
+            if self.embedding is None:
+                return docs
+            embedded = self.embedding.embed_documents([docs[i].page_content for i in missing])
+            found.update((digests[i], vector) for i, vector in zip(missing, embedded))
+        vectors = [found[digest] for digest in digests]
+        return [docs[i] for i in mmr_order(vectors, self.mmr_lambda)]
+
+    def pack(self, docs):
+        ranked = self.rerank(docs)
+        pieces = merge_adjacent([(doc.metadata.get("source"), doc.page_content) for doc in ranked])
+        selected, used = [], 0
+        for _, text in pieces:
+            tokens = estimate_tokens(text)
+            if used + tokens <= self.budget:
+                selected.append(text)
+                used += tokens
+                continue
+            room = self.budget - used
+            if room >= self.min_fill:
+                # Fill what is left with the start of the next piece, cut at a line break
+                text = text[:room * 4]
+                cut = text.rfind("\n")
+                if cut > len(text) // 2:
+                    text = text[:cut]
+                selected.append(text)
+                used += estimate_tokens(text)
+            break
+        info = {"candidates": len(docs), "pieces": len(pieces), "used": len(selected), "context_tokens": used}
+        return "\n\n".join(selected), info
+
+    def record(self, prefill_tokens):
+        self.prefill.append(prefill_tokens)
+
+    def stats(self):
+        samples = sorted(self.prefill)
+        if not samples:
+            return {"questions": 0, "prefill_mean": 0, "prefill_p50": 0, "prefill_p99": 0, "prefill_max": 0}
+        return {
+            "questions": len(samples),
+            "prefill_mean": sum(samples) / len(samples),
+            "prefill_p50": samples[len(samples) // 2],
+            "prefill_p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "prefill_max": samples[-1],
+        }
@@ -0,0 +1,133 @@
+# embedding_cache.py
+import time
+import array
+import sqlite3
+import threading
+from collections import deque
+from langchain.embeddings.base import Embeddings
+from ingest_index import content_hash
+
+
+def _pack(vector):
+    return array.array('f', vector).tobytes()
+
+
+def _unpack(blob):
+    vector = array.array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class LazyEmbeddings(Embeddings):
+    # Builds the model on first use, or on a background thread after warm(), so
+    # constructing a ChatPDF doesn't wait for the model to load
+    def __init__(self, factory, model_name=None):
+        self.factory = factory
+        self.model_name = model_name
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.model is None:
+                self.model = self.factory()
+        return self.model
+
+    def warm(self):
+        threading.Thread(target=self.load, name="embedding-warmup", daemon=True).start()
+
+    def embed_documents(self, texts):
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.load().embed_query(text)
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps another embedding model with a persistent cache keyed by model name and
+    # text hash, stored as float32 blobs in sqlite. Only uncached texts reach the
+    # model, batch_size at a time.
+    def __init__(self, base, path, model_name=None, batch_size=64):
+        self.base = base
+        self.model_name = model_name or getattr(base, "model_name", None) or type(base).__name__
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS vectors "
+                            "(model TEXT, kind TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, kind, hash))")
+        self.hits = 0
+        self.misses = 0
+        self.batch_times = deque(maxlen=100)
+
+    def _lookup(self, kind, digests):
+        found = {}
+        with self.lock:
+            for i in range(0, len(digests), 500):
+                batch = digests[i:i + 500]
+                rows = self.db.execute(
+                    f"SELECT hash, vector FROM vectors WHERE model = ? AND kind = ? "
+                    f"AND hash IN ({','.join('?' * len(batch))})", [self.model_name, kind, *batch])
+                found.update((digest, _unpack(blob)) for digest, blob in rows)
+        return found
+
+    def _store(self, kind, items):
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)",
+                                [(self.model_name, kind, digest, _pack(vector)) for digest, vector in items])
+
+    def embed_documents(self, texts):
+        digests = [content_hash(text) for text in texts]
+        found = self._lookup("doc", list(set(digests)))
+
+        # Each distinct uncached text is embedded once, even if repeated in the input
+        missing = {}
+        for text, digest in zip(texts, digests):
+            if digest not in found:
+                missing.setdefault(digest, text)
+        self.hits += len(texts) - sum(1 for digest in digests if digest in missing)
+        self.misses += len(missing)
+
+        pending = list(missing.items())
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            start = time.perf_counter()
+            vectors = self.base.embed_documents([text for _, text in batch])
+            self.batch_times.append((len(batch), time.perf_counter() - start))
+            items = [(digest, vector) for (digest, _), vector in zip(batch, vectors)]
+            self._store("doc", items)
+            found.update(items)
+
+        return [found[digest] for digest in digests]
+
+    def embed_query(self, text):
+        # Queries are cached separately: some models embed them with a different prefix
+        digest = content_hash(text)
+        found = self._lookup("query", [digest])
+        if digest in found:
+            self.hits += 1
+            return found[digest]
+        self.misses += 1
+        start = time.perf_counter()
+        vector = self.base.embed_query(text)
+        self.batch_times.append((1, time.perf_counter() - start))
+        self._store("query", [(digest, vector)])
+        return vector
+
+    def stats(self):
+        total = self.hits + self.misses
+        batches = list(self.batch_times)
+        embedded = sum(size for size, _ in batches)
+        seconds = sum(elapsed for _, elapsed in batches)
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "batches": len(batches),
+            "seconds_per_batch": seconds / len(batches) if batches else 0.0,
+            "seconds_per_text": seconds / embedded if embedded else 0.0,
+        }
+
+    def close(self):
+        self.db.close()
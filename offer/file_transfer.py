@@ -0,0 +1,191 @@
+# file_transfer.py
+# Binary, chunked file transfer over a DataChannel. Shared by the offer and answer peers.
+#
+# Every frame is a binary message starting with HEADER:
+#   magic "NF", version, kind, 8-byte transfer id, 8-byte offset
+# START carries the JSON metadata (name, mime, size), CHUNK carries raw bytes to be
+# written at offset, END carries the sha256 of the whole file.
+import json
+import time
+import struct
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+MAGIC = b"NF"
+VERSION = 1
+START, CHUNK, END = 0, 1, 2
+HEADER = struct.Struct("!2sBB8sQ")
+
+# Keep every message within 16 KiB, the size all SCTP stacks accept unfragmented
+FRAME_SIZE = 16 * 1024
+CHUNK_SIZE = FRAME_SIZE - HEADER.size
+
+# Pause sending above HIGH_WATER buffered bytes, resume once below LOW_WATER
+HIGH_WATER = 1024 * 1024
+LOW_WATER = 256 * 1024
+
+MAX_FILE_SIZE = 256 * 1024 * 1024
+# Buffers preallocated for unfinished transfers, across all of them
+MAX_IN_FLIGHT = 512 * 1024 * 1024
+# Seconds without a frame before an unfinished transfer is dropped
+IDLE_TIMEOUT = 60.0
+
+
+class TransferError(ValueError):
+    # A transfer that was given up on; transfer_id tells the sender which one
+    def __init__(self, message, transfer_id):
+        super().__init__(message)
+        self.transfer_id = transfer_id
+
+
+def is_file_frame(message):
+    return isinstance(message, (bytes, bytearray)) and message[:2] == MAGIC
+
+
+def _transfer_key(transfer_id):
+    # Request ids are hex strings; on the wire they take 8 bytes
+    return bytes.fromhex(transfer_id)[:8].ljust(8, b"\0")
+
+
+async def _drain(channel, low_water):
+    if channel.bufferedAmount <= HIGH_WATER:
+        return
+    loop = asyncio.get_running_loop()
+    while channel.bufferedAmount > low_water and channel.readyState == "open":
+        drained = loop.create_future()
+        channel.once("bufferedamountlow", lambda: drained.done() or drained.set_result(None))
+        if channel.bufferedAmount <= low_water:
+            break
+        try:
+            await asyncio.wait_for(drained, timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def send_file(channel, data, name, mime, transfer_id, chunk_size=CHUNK_SIZE, low_water=LOW_WATER):
+    view = memoryview(data)
+    key = _transfer_key(transfer_id)
+    channel.bufferedAmountLowThreshold = low_water
+
+    meta = {"id": transfer_id, "name": name, "mime": mime, "size": len(view)}
+    channel.send(HEADER.pack(MAGIC, VERSION, START, key, 0) + json.dumps(meta).encode())
+
+    digest = hashlib.sha256()
+    for offset in range(0, len(view), chunk_size):
+        await _drain(channel, low_water)
+        if channel.readyState != "open":
+            raise ConnectionError(f"Channel {channel.label} closed during transfer of {name}")
+        piece = view[offset:offset + chunk_size]
+        digest.update(piece)
+        channel.send(HEADER.pack(MAGIC, VERSION, CHUNK, key, offset) + piece)
+
+    channel.send(HEADER.pack(MAGIC, VERSION, END, key, len(view)) + digest.hexdigest().encode())
+
+
+class Transfer:
+    def __init__(self, meta):
+        self.id = meta["id"]
+        self.name = meta.get("name") or "file"
+        self.mime = meta.get("mime") or "application/octet-stream"
+        self.size = int(meta["size"])
+        self.buffer = bytearray(self.size)
+        self.received = 0
+        self.started = time.perf_counter()
+        self.last_frame = time.monotonic()
+        self.elapsed = None
+
+    @property
+    def data(self):
+        return memoryview(self.buffer)
+
+
+class FileReceiver:
+    # Reassembles file frames into preallocated buffers. feed() returns the finished
+    # Transfer once its END frame arrives and the checksum matches. Unfinished
+    # transfers are dropped after idle_timeout seconds without a frame, and no more
+    # than max_in_flight bytes are preallocated at once. A transfer that fails raises
+    # TransferError once; its later frames are ignored.
+    def __init__(self, max_file_size=MAX_FILE_SIZE, max_in_flight=MAX_IN_FLIGHT, idle_timeout=IDLE_TIMEOUT):
+        self.max_file_size = max_file_size
+        self.max_in_flight = max_in_flight
+        self.idle_timeout = idle_timeout
+        self.transfers = {}
+        self.failed = OrderedDict()
+        self.expired = 0
+
+    def in_flight(self):
+        return sum(transfer.size for transfer in self.transfers.values())
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        for key, transfer in list(self.transfers.items()):
+            if now - transfer.last_frame > self.idle_timeout:
+                print(f"Dropping the transfer of {transfer.name}, nothing received for {self.idle_timeout:.0f}s")
+                del self.transfers[key]
+                self._remember_failed(key)
+                self.expired += 1
+
+    def _remember_failed(self, key):
+        self.failed[key] = True
+        if len(self.failed) > 256:
+            self.failed.popitem(last=False)
+
+    def _fail(self, key, message, transfer_id):
+        self.transfers.pop(key, None)
+        self._remember_failed(key)
+        raise TransferError(message, transfer_id)
+
+    def feed(self, message):
+        if len(message) < HEADER.size:
+            raise ValueError(f"File frame of {len(message)} bytes is shorter than its header")
+        magic, version, kind, key, offset = HEADER.unpack_from(message)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a file transfer frame")
+        body = memoryview(message)[HEADER.size:]
+        self.expire()
+
+        if kind == START:
+            try:
+                meta = json.loads(bytes(body))
+                meta["id"] = str(meta["id"])
+                size = int(meta["size"])
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"Invalid transfer metadata: {e!r}")
+            # A transfer sent again after a reconnect starts over
+            self.transfers.pop(key, None)
+            self.failed.pop(key, None)
+            if not 0 <= size <= self.max_file_size:
+                self._fail(key, f"File {meta.get('name')} is larger than {self.max_file_size} bytes", meta["id"])
+            if self.in_flight() + size > self.max_in_flight:
+                self._fail(key, f"Too many uploads in progress to receive {meta.get('name')}", meta["id"])
+            self.transfers[key] = Transfer(meta)
+            return None
+
+        if key in self.failed:
+            return None
+        transfer = self.transfers.get(key)
+        if transfer is None:
+            # Transfer ids are 16 hex digits, so the 8-byte key is the whole id
+            self._fail(key, "Frame for an unknown transfer", key.hex())
+        transfer.last_frame = time.monotonic()
+
+        if kind == CHUNK:
+            end = offset + len(body)
+            if end > transfer.size:
+                self._fail(key, f"Chunk past the end of {transfer.name}", transfer.id)
+            transfer.buffer[offset:end] = body
+            transfer.received += len(body)
+            return None
+
+        if kind == END:
+            del self.transfers[key]
+            if transfer.received != transfer.size:
+                self._fail(key, f"Transfer of {transfer.name} ended with {transfer.received}/{transfer.size} bytes",
+                           transfer.id)
+            if hashlib.sha256(transfer.buffer).hexdigest() != bytes(body).decode(errors="replace"):
+                self._fail(key, f"Checksum mismatch for {transfer.name}", transfer.id)
+            transfer.elapsed = time.perf_counter() - transfer.started
+            return transfer
+
+        raise ValueError(f"Unknown frame kind {kind}")
@@ -0,0 +1,156 @@
+# heartbeat.py
+# Liveness for one peer connection, used by both peers over the keep_alive channel.
+# Any message from the other side proves it is alive, so pings are only sent after
+# a quiet interval. The interval grows while the connection is idle and pings keep
+# being answered, and drops to fast probing as soon as a ping goes unanswered. With
+# nothing heard for dead_after seconds the peer is declared dead and on_dead runs.
+# Round-trip times come from ping/pong pairs.
+#
+# Peers from before this only send the string "keep-alive" and never answer pings;
+# their keep-alives still count as hearing from them.
+import os
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from tracing import tracer
+
+# Seconds without hearing from the peer before it is declared dead
+DEAD_AFTER = float(os.getenv("HEARTBEAT_DEAD_AFTER", "15"))
+
+
+class Heartbeat:
+    def __init__(self, send, on_dead, dead_after=DEAD_AFTER, min_interval=1.0, max_interval=None, growth=1.5,
+                 window=100):
+        self.send = send
+        self.on_dead = on_dead
+        self.dead_after = dead_after
+        self.min_interval = min(min_interval, dead_after / 4)
+        # At least two pings go unanswered before the peer is given up on
+        self.max_interval = min(max_interval or dead_after / 2, dead_after / 2)
+        self.interval = self.min_interval
+        self.growth = growth
+        self.last_heard = time.monotonic()
+        self.last_ping = 0.0
+        self.outstanding = None
+        self.seq = 0
+        self.srtt = None
+        self.rtts = deque(maxlen=window)
+        self.pings = 0
+        self.pongs = 0
+        self.task = None
+        self.dead = False
+
+    def start(self):
+        if self.task is None:
+            self.last_heard = time.monotonic()
+            self.task = asyncio.create_task(self._run())
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def heard(self):
+        self.last_heard = time.monotonic()
+
+    def receive(self, message):
+        # Handles pings and pongs on the keep_alive channel and returns any other frame
+        self.heard()
+        try:
+            data = json.loads(message)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(data, dict):
+            return None
+        if data.get("type") == "ping":
+            self._send({"type": "pong", "seq": data.get("seq"), "time": data.get("time")})
+        elif data.get("type") == "pong" and data.get("seq") == self.outstanding:
+            sent = data.get("time")
+            if not isinstance(sent, (int, float)):
+                # Malformed pong: the next ping goes out when the probe interval runs out
+                return None
+            rtt = time.monotonic() - sent
+            self.outstanding = None
+            self.pongs += 1
+            self.rtts.append(rtt)
+            self.srtt = rtt if self.srtt is None else 0.875 * self.srtt + 0.125 * rtt
+            tracer.record("peer.rtt", rtt)
+            # Answered while idle: the next ping can wait longer
+            self.interval = min(self.interval * self.growth, self.max_interval)
+        elif data.get("type") != "pong":
+            return data
+        return None
+
+    def _send(self, frame):
+        try:
+            self.send(json.dumps(frame))
+        except Exception as e:
+            print(f"Error sending heartbeat: {e}")
+
+    def _probe_interval(self):
+        # How long to wait for a pong before pinging again
+        return max(self.min_interval, 4 * self.srtt) if self.srtt is not None else self.min_interval
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            silence = now - self.last_heard
+            if silence >= self.dead_after:
+                self.dead = True
+                self.task = None
+                print(f"No response from peer for {silence:.1f}s")
+                self.on_dead()
+                return
+            if self.outstanding is not None and now - self.last_ping >= self._probe_interval():
+                # Unanswered: probe quickly until the peer answers or dead_after runs out
+                self.interval = self.min_interval
+                self._ping(now)
+            elif self.outstanding is None and silence >= self.interval:
+                self._ping(now)
+            if self.outstanding is not None:
+                wake = self.last_ping + self._probe_interval()
+            else:
+                wake = self.last_heard + self.interval
+            wake = min(wake, self.last_heard + self.dead_after)
+            await asyncio.sleep(max(0.05, wake - time.monotonic()))
+
+    async def revive(self, grace):
+        # After the peer was declared dead: keeps probing the same connection for up to
+        # grace seconds and restarts the heartbeat if anything is heard
+        declared = time.monotonic()
+        deadline = declared + grace
+        while time.monotonic() < deadline:
+            if self.last_heard > declared:
+                self.dead = False
+                self.interval = self.min_interval
+                self.start()
+                return True
+            if time.monotonic() - self.last_ping >= self.min_interval:
+                self._ping(time.monotonic())
+            await asyncio.sleep(0.05)
+        return False
+
+    def _ping(self, now):
+        self.seq += 1
+        self.outstanding = self.seq
+        self.last_ping = now
+        self.pings += 1
+        self._send({"type": "ping", "seq": self.seq, "time": now})
+
+    def stats(self):
+        samples = sorted(self.rtts)
+        return {"interval": self.interval, "pings": self.pings, "pongs": self.pongs,
+                "silence": time.monotonic() - self.last_heard, "srtt": self.srtt,
+                "rtt_p50": samples[len(samples) // 2] if samples else None,
+                "rtt_p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))] if samples else None}
+
+
+def backoff_delays(base=0.5, factor=2.0, maximum=30.0, jitter=0.2):
+    # Exponential backoff with jitter, so two peers retrying don't stay in lockstep
+    delay = base
+    while True:
+        yield delay * random.uniform(1 - jitter, 1 + jitter)
+        delay = min(delay * factor, maximum)
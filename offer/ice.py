@@ -0,0 +1,83 @@
+# ice.py
+# TURN/STUN servers for both peers. Twilio Network Traversal credentials used to be
+# fetched at import time, which put a round trip to Twilio in front of everything
+# else. Now they are fetched on a background thread when a client is created,
+# awaited only when the peer connection is built, and reused until shortly before
+# they expire. Without Twilio credentials, or with ICE_HOST_ONLY set (both peers on
+# one host or LAN), the peers use host candidates only.
+import os
+import time
+import asyncio
+import threading
+from aiortc import RTCIceServer
+
+# Refresh this many seconds before Twilio says the credentials expire
+EXPIRY_MARGIN = 300
+
+
+def fetch_twilio(ttl=None):
+    # Returns (servers, seconds they are valid for)
+    from twilio.rest import Client
+    client = Client(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
+    token = client.tokens.create(ttl=ttl) if ttl else client.tokens.create()
+    servers = [RTCIceServer(urls=server["urls"], username=server.get("username"),
+                            credential=server.get("credential")) for server in token.ice_servers]
+    return servers, int(token.ttl or 86400)
+
+
+class IceServers:
+    def __init__(self, fetch=None, margin=EXPIRY_MARGIN):
+        self.fetch = fetch or fetch_twilio
+        self.margin = margin
+        self.servers = None
+        self.expires = 0.0
+        self.lock = threading.Lock()
+        self.fetches = 0
+        self.failures = 0
+
+    def configured(self):
+        if os.getenv("ICE_HOST_ONLY"):
+            return False
+        return self.fetch is not fetch_twilio or bool(os.getenv("TWILIO_ACCOUNT_SID") and os.getenv("TWILIO_AUTH_TOKEN"))
+
+    def get_sync(self):
+        # One fetch at a time; callers that queued behind it get its result
+        with self.lock:
+            if self.servers is not None and time.monotonic() < self.expires:
+                return self.servers
+            if not self.configured():
+                print("Using host ICE candidates only")
+                self.servers, self.expires = [], float("inf")
+                return self.servers
+            start = time.monotonic()
+            try:
+                servers, ttl = self.fetch()
+            except Exception as e:
+                self.failures += 1
+                print(f"Error fetching ICE servers: {e}")
+                # Expired credentials may still be accepted for a while; better than none
+                return self.servers or []
+            self.fetches += 1
+            self.servers = servers
+            self.expires = start + max(ttl - self.margin, ttl / 2)
+            print(f"Fetched {len(servers)} ICE servers in {time.monotonic() - start:.2f}s")
+            return servers
+
+    async def get(self):
+        if self.servers is not None and time.monotonic() < self.expires:
+            return self.servers
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_sync)
+
+    def prefetch(self):
+        # Works with or without a running event loop, so constructors can call it
+        if self.servers is None or time.monotonic() >= self.expires:
+            threading.Thread(target=self.get_sync, name="ice-prefetch", daemon=True).start()
+
+    def stats(self):
+        remaining = self.expires - time.monotonic() if self.servers is not None else 0.0
+        return {"servers": len(self.servers or []), "fetches": self.fetches, "failures": self.failures,
+                "expires_in": None if remaining == float("inf") else max(0.0, remaining)}
+
+
+# Shared by every client in the process
+ice_servers = IceServers()
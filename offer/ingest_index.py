@@ -0,0 +1,84 @@
+# ingest_index.py
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def image_hash(image):
+    # Hash of the decoded pixels, so the same picture re-encoded still matches
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class IngestIndex:
+    # Content-addressed record of what is already in the vector store: file hash ->
+    # chunk ids, chunk hash -> id. Skipped ingests are logged with their reason.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS files "
+                            "(hash TEXT PRIMARY KEY, source TEXT, chunk_ids TEXT, ingested_at REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, source TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS skips "
+                            "(at REAL, source TEXT, kind TEXT, hash TEXT, reason TEXT)")
+
+    def find_file(self, digest):
+        with self.lock:
+            row = self.db.execute("SELECT source, chunk_ids FROM files WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        return {"source": row[0], "chunk_ids": json.loads(row[1])}
+
+    def record_file(self, digest, source, chunk_ids):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                            (digest, source, json.dumps(chunk_ids), time.time()))
+
+    def known_chunks(self, digests):
+        # Returns {hash: source} for the hashes that are already stored
+        digests = list(digests)
+        known = {}
+        with self.lock:
+            for i in range(0, len(digests), 500):
+                batch = digests[i:i + 500]
+                rows = self.db.execute(f"SELECT hash, source FROM chunks WHERE hash IN ({','.join('?' * len(batch))})",
+                                       batch)
+                known.update(rows.fetchall())
+        return known
+
+    def record_chunks(self, digests, source):
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?)", [(d, source) for d in digests])
+
+    def record_skip(self, source, kind, digest, reason):
+        print(f"Skipping {kind} from {source}: {reason}")
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO skips VALUES (?, ?, ?, ?, ?)", (time.time(), source, kind, digest, reason))
+
+    def skips(self, limit=100):
+        with self.lock:
+            rows = self.db.execute("SELECT at, source, kind, hash, reason FROM skips ORDER BY at DESC LIMIT ?",
+                                   (limit,)).fetchall()
+        return [dict(zip(("at", "source", "kind", "hash", "reason"), row)) for row in rows]
+
+    def close(self):
+        self.db.close()
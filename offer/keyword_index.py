@@ -0,0 +1,148 @@
+# keyword_index.py
+# BM25 over the chunks in the memory log, kept in sqlite next to the vector store.
+# Exact terms such as invoice numbers and dates are found here even when their
+# embeddings score below the vector store's threshold.
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from langchain.schema import Document
+from ingest_index import content_hash
+
+TOKEN = re.compile(r"[a-z0-9]+(?:[-./:][a-z0-9]+)*")
+STOPWORDS = frozenset("a an and are as at be by do does for from has have how i in is it me my of on or "
+                      "our so that the their there this to was were what when where which who why will "
+                      "with you your".split())
+
+
+def tokenize(text):
+    # Identifiers like INV-100123 or 2024-03-05 are kept whole and also split into parts
+    tokens = []
+    for token in TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = re.split(r"[-./:]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part and part not in STOPWORDS)
+    return tokens
+
+
+def is_keyword_query(query):
+    # A quoted phrase, or a few words at least one of which has a digit in it
+    query = query.strip()
+    if len(query) > 2 and query[0] == query[-1] and query[0] in "\"'":
+        return True
+    words = [word for word in query.split() if word.lower().strip("?!.,") not in STOPWORDS]
+    return 0 < len(words) <= 3 and any(char.isdigit() for char in query)
+
+
+class KeywordIndex:
+    # Inverted index: postings (term, chunk hash, term frequency) plus each chunk's
+    # text, source and length. Adding chunks is incremental; chunks already indexed
+    # are ignored. Thread-safe like IngestIndex.
+    def __init__(self, path, k1=1.2, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS docs "
+                            "(hash TEXT PRIMARY KEY, source TEXT, content TEXT, length INTEGER)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS postings "
+                            "(term TEXT, hash TEXT, tf INTEGER, PRIMARY KEY (term, hash)) WITHOUT ROWID")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.docs, self.total_length = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+
+    def __len__(self):
+        return self.docs
+
+    def _meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def add(self, entries, position=None):
+        # entries are (hash, source, content). position is the memory log's position()
+        # once these were written to it, so sync() only reads what comes after.
+        rows, postings = [], []
+        for digest, source, content in entries:
+            tokens = tokenize(content)
+            rows.append((digest, source, content, len(tokens)))
+            postings.append(Counter(tokens))
+        with self.lock, self.db:
+            added = 0
+            for (digest, source, content, length), counts in zip(rows, postings):
+                cursor = self.db.execute("INSERT OR IGNORE INTO docs VALUES (?, ?, ?, ?)",
+                                         (digest, source, content, length))
+                if cursor.rowcount == 0:
+                    continue
+                added += 1
+                self.total_length += length
+                self.db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?)",
+                                    [(term, digest, tf) for term, tf in counts.items()])
+            self.docs += added
+            if position is not None:
+                self._advance(*position)
+        return added
+
+    def _advance(self, inode, offset):
+        # Concurrent ingests may finish out of order; the position only moves forward
+        if inode == self._meta("memory_inode") and offset <= self._meta("memory_offset"):
+            return
+        self.db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                            [("memory_inode", inode), ("memory_offset", offset)])
+
+    def sync(self, memory, batch_size=500):
+        # Indexes memory log entries written while the index wasn't looking, e.g. by
+        # an older version or before a crash. Only the log past the stored position
+        # is read; a compacted (new) log is re-scanned in full.
+        memory.migrate()
+        inode, size = memory.position()
+        with self.lock:
+            offset = self._meta("memory_offset") if self._meta("memory_inode") == inode else 0
+        if offset > size:
+            offset = 0
+        if offset == size:
+            return 0
+        start = offset
+        added, batch = 0, []
+        for entry, offset in memory.read_from(start):
+            batch.append((content_hash(entry["content"]), entry["source"], entry["content"]))
+            if len(batch) >= batch_size:
+                added += self.add(batch, position=(inode, offset))
+                batch = []
+        added += self.add(batch, position=(inode, offset))
+        print(f"Keyword index caught up with {offset - start} bytes of the memory log, {added} new chunks")
+        return added
+
+    def search(self, query, k=10):
+        # Returns [(Document, score)], best first
+        terms = Counter(tokenize(query))
+        if not terms or not self.docs:
+            return []
+        average_length = self.total_length / self.docs
+        scores = Counter()
+        with self.lock:
+            for term, query_tf in terms.items():
+                rows = self.db.execute("SELECT d.hash, p.tf, d.length FROM postings p JOIN docs d ON d.hash = p.hash "
+                                       "WHERE p.term = ?", (term,)).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (self.docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                for digest, tf, length in rows:
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[digest] += query_tf * idf * tf * (self.k1 + 1) / norm
+            best = scores.most_common(k)
+            docs = {}
+            if best:
+                docs = {digest: (source, content) for digest, source, content in self.db.execute(
+                    f"SELECT hash, source, content FROM docs WHERE hash IN ({','.join('?' * len(best))})",
+                    [digest for digest, _ in best])}
+        return [(Document(page_content=docs[digest][1], metadata={"source": docs[digest][0]}), score)
+                for digest, score in best if digest in docs]
+
+    def close(self):
+        self.db.close()
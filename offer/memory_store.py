@@ -0,0 +1,187 @@
+# memory_store.py
+import os
+import json
+import threading
+
+
+class MemoryLog:
+    # Append-only JSON Lines store for memory entries. Each ingest appends only its
+    # new chunks; the file is rewritten only by compact(). A legacy memory.json
+    # (one JSON array) is still read, and migrated on the first write.
+    def __init__(self, path='memory.jsonl', legacy_path=None, compact_threshold=10000):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.compact_threshold = compact_threshold
+        self.lock = threading.Lock()
+        self._entries = None
+        self._appended = 0
+
+    @classmethod
+    def for_json_path(cls, json_path, **kwargs):
+        # memory.json -> memory.jsonl, with memory.json kept as the legacy source
+        if json_path.endswith('.jsonl'):
+            return cls(json_path, **kwargs)
+        root, _ = os.path.splitext(json_path)
+        return cls(root + '.jsonl', legacy_path=json_path, **kwargs)
+
+    def _legacy_entries(self):
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return []
+        with open(self.legacy_path, 'r') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                return []
+        return data if isinstance(data, list) else []
+
+    def _needs_migration(self):
+        return not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path)
+
+    def __iter__(self):
+        # Streams entries from disk without holding the whole corpus in memory
+        if self._entries is not None:
+            yield from list(self._entries)
+            return
+        if self._needs_migration():
+            yield from self._legacy_entries()
+            return
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from an interrupted write
+                    continue
+
+    @property
+    def entries(self):
+        # Loaded lazily on first access, then kept up to date by append()
+        if self._entries is None:
+            with self.lock:
+                if self._entries is None:
+                    self._entries = list(self.__iter__())
+        return self._entries
+
+    def __len__(self):
+        if self._entries is not None:
+            return len(self._entries)
+        return sum(1 for _ in self.__iter__())
+
+    def append(self, new_entries):
+        # Returns the log's position() after the write
+        new_entries = list(new_entries)
+        if not new_entries:
+            return self.position()
+        with self.lock:
+            if self._needs_migration():
+                self._rewrite(self._legacy_entries())
+            self._trim_torn_line()
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(entry) + '\n' for entry in new_entries))
+                position = (os.fstat(f.fileno()).st_ino, f.tell())
+            if self._entries is not None:
+                self._entries.extend(new_entries)
+            self._appended += len(new_entries)
+            should_compact = self.compact_threshold and self._appended >= self.compact_threshold
+        if should_compact:
+            self.compact()
+            return self.position()
+        return position
+
+    def _trim_torn_line(self, block_size=4096):
+        # A write cut short by a crash leaves a last line without its newline; new
+        # entries appended to it would be joined onto the fragment and lost with it
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            f.seek(end - 1)
+            if f.read(1) == b'\n':
+                return
+            position = end
+            while position > 0:
+                start = max(0, position - block_size)
+                f.seek(start)
+                block = f.read(position - start)
+                newline = block.rfind(b'\n')
+                if newline != -1:
+                    start += newline + 1
+                    break
+                position = start
+            print(f"Dropping a torn last line of {end - start} bytes from {self.path}")
+            f.truncate(start)
+
+    def migrate(self):
+        # Writes the legacy memory.json out as the log, if that hasn't happened yet
+        with self.lock:
+            if self._needs_migration():
+                self._rewrite(self._legacy_entries())
+
+    def position(self):
+        # (inode, size) of the log file. Readers that remember it can read only what
+        # was appended since; a compacted log is a new file with a new inode.
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return (0, 0)
+        return (stat.st_ino, stat.st_size)
+
+    def read_from(self, offset):
+        # Yields (entry, offset after its line) for the whole lines from offset on. A
+        # torn last line is left for the next reader, once it has been completed.
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                yield entry, offset
+
+    def compact(self):
+        # Drops duplicate and unreadable lines and rewrites the log in one pass. The same
+        # text from two sources is kept once for each source.
+        with self.lock:
+            seen = set()
+            entries = []
+            for entry in self._iter_file():
+                key = (entry.get('source'), entry.get('content'))
+                if key in seen:
+                    continue
+                seen.add(key)
+                entries.append(entry)
+            self._rewrite(entries)
+            if self._entries is not None:
+                self._entries = entries
+            self._appended = 0
+        return len(entries)
+
+    def _iter_file(self):
+        entries = self._entries
+        self._entries = None
+        try:
+            yield from self.__iter__()
+        finally:
+            self._entries = entries
+
+    def _rewrite(self, entries):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,207 @@
+# ocr.py
+# Text extraction for ingest_image. TesseractOCR runs locally in worker processes;
+# OpenAIVisionOCR is the remote GPT-4o call ingest_image used to make, kept as a
+# fallback for when Tesseract is missing or reads nothing.
+import io
+import os
+import abc
+import base64
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+
+def preprocess(image, max_side=2500, grayscale=True):
+    # Upright, single channel and no larger than max_side: Tesseract gains nothing
+    # from more pixels than that, and they cost time in every step. With max_side
+    # None the size is kept, for images that are tiled before they are shrunk.
+    image = ImageOps.exif_transpose(image)
+    if grayscale:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return shrink(image, max_side) if max_side else image
+
+
+def shrink(image, max_side):
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+def tiles(image, tile_height=1600, overlap=80):
+    # Horizontal bands across the full width, so lines of text are never cut in half
+    # sideways; the overlap keeps a line cut at a band edge whole in one of the bands
+    width, height = image.size
+    if height <= tile_height:
+        return [image]
+    bands = []
+    top = 0
+    while top < height:
+        bottom = min(height, top + tile_height)
+        bands.append(image.crop((0, top, width, bottom)))
+        if bottom == height:
+            break
+        top = bottom - overlap
+    return bands
+
+
+def merge_tiles(texts):
+    # Drops lines at the top of a band that repeat the end of the previous band
+    lines = []
+    for text in texts:
+        band = [line for line in text.splitlines() if line.strip()]
+        for size in range(min(len(lines), len(band), 3), 0, -1):
+            if [line.strip() for line in lines[-size:]] == [line.strip() for line in band[:size]]:
+                band = band[size:]
+                break
+        lines.extend(band)
+    return "\n".join(lines)
+
+
+def _tesseract_image(mode, size, data, lang, config):
+    # Runs in a worker process; the image travels as raw pixels, not an encoded file
+    image = Image.frombytes(mode, size, data)
+    return pytesseract.image_to_string(image, lang=lang, config=config)
+
+
+class OCRBackend(abc.ABC):
+    name = "base"
+
+    @abc.abstractmethod
+    def extract(self, image):
+        pass
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class TesseractOCR(OCRBackend):
+    name = "tesseract"
+
+    def __init__(self, workers=2, lang="eng", config="--psm 6", max_side=2500, tile_above=2000,
+                 tile_height=1600, overlap=80):
+        self.workers = workers
+        self.lang = lang
+        self.config = config
+        self.max_side = max_side
+        self.tile_above = tile_above
+        self.tile_height = tile_height
+        self.overlap = overlap
+        self.pool = None
+
+    @staticmethod
+    def available():
+        return pytesseract is not None and shutil.which(getattr(pytesseract.pytesseract, "tesseract_cmd",
+                                                                "tesseract")) is not None
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    def bands(self, image):
+        # Tall scans are cut into bands at full resolution and each band is shrunk on
+        # its own, so a long receipt keeps the text height it was scanned at
+        image = preprocess(image, max_side=None)
+        bands = tiles(image, self.tile_height, self.overlap) if image.size[1] > self.tile_above else [image]
+        return [shrink(band, self.max_side) for band in bands]
+
+    def extract(self, image):
+        if pytesseract is None:
+            raise RuntimeError("pytesseract is not installed")
+        # Bands are read in parallel across the pool
+        bands = self.bands(image)
+        pool = self._get_pool()
+        tasks = [pool.submit(_tesseract_image, band.mode, band.size, band.tobytes(), self.lang, self.config)
+                 for band in bands]
+        return merge_tiles([task.result() for task in tasks])
+
+    def shutdown(self, wait=True):
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait)
+            self.pool = None
+
+
+class OpenAIVisionOCR(OCRBackend):
+    name = "openai"
+
+    def __init__(self, client, model="gpt-4o", max_tokens=2000, max_side=2000):
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_side = max_side
+
+    def extract(self, image):
+        # Downscaled before upload; grayscale JPEGs are much smaller and read the same
+        image = preprocess(image, max_side=self.max_side)
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG", quality=85)
+        encoded_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "Extract only text from this image"},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{encoded_image}"
+                            },
+                        },
+                    ],
+                }
+            ],
+            max_tokens=self.max_tokens,
+        )
+        return response.choices[0].message.content or ""
+
+
+class FallbackOCR(OCRBackend):
+    # Tries each backend in order until one returns at least min_chars of text
+    def __init__(self, backends, min_chars=1):
+        self.backends = backends
+        self.min_chars = min_chars
+        self.name = "+".join(backend.name for backend in backends)
+        self.used = {backend.name: 0 for backend in backends}
+
+    def extract(self, image):
+        text = ""
+        for backend in self.backends:
+            try:
+                text = backend.extract(image)
+            except Exception as e:
+                print(f"OCR backend {backend.name} failed: {e}")
+                continue
+            if len(text.strip()) >= self.min_chars:
+                self.used[backend.name] += 1
+                return text
+        return text
+
+    def shutdown(self, wait=True):
+        for backend in self.backends:
+            backend.shutdown(wait=wait)
+
+
+def default_ocr(openai_client, backend=None):
+    # OCR_BACKEND: "tesseract", "openai", or "auto" (local first, GPT-4o as fallback)
+    backend = backend or os.getenv("OCR_BACKEND", "auto")
+    remote = OpenAIVisionOCR(openai_client)
+    if backend == "openai":
+        return remote
+    if backend == "tesseract":
+        return TesseractOCR(workers=int(os.getenv("OCR_WORKERS", "2")))
+    if TesseractOCR.available():
+        return FallbackOCR([TesseractOCR(workers=int(os.getenv("OCR_WORKERS", "2"))), remote])
+    print("Tesseract not found, using GPT-4o for OCR")
+    return remote
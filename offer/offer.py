@@ -1,37 +1,50 @@
-
-from aiortc import RTCIceCandidate, RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
+from aiortc import RTCIceCandidate, RTCPeerConnection, RTCSessionDescription, RTCConfiguration
 import json
 import asyncio
-import requests
 import os
 from dotenv import load_dotenv
 import aiohttp
 import aioconsole
-from twilio.rest import Client
+import threading
+import time
 import io
 import base64
+import tempfile
+from collections import OrderedDict
+from contextlib import aclosing
 from PIL import Image
-from rag import ChatPDF
+from tenants import TenantRegistry, SharedResources
+from workers import WorkerPool, LoopLagMonitor, PoolBusy
+from file_transfer import FileReceiver, TransferError, is_file_frame
+from signaling import SignalingClient
+from ice import ice_servers
+from tracing import tracer, span, start_exporters
+from heartbeat import Heartbeat, backoff_delays
+from resend import ResendQueue
+from wire import WireFormat, WireError
 
 load_dotenv()
 
-# Twilio credentials
-account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-client = Client(account_sid, auth_token)
-
-# Generate NTS Token
-token = client.tokens.create()
+# Models and clients are loaded once per process; each client id gets its own store
+_registry = None
+_registry_lock = threading.Lock()
 
-# Extract ICE servers from the token response
-ice_servers = [RTCIceServer(urls=server["urls"], username=server.get("username"), credential=server.get("credential")) for server in token.ice_servers]
+def default_registry(embedding):
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TenantRegistry(SharedResources(os.getenv("TENANTS_DIR", "./tenants"), embedding=embedding),
+                                       max_open=int(os.getenv("MAX_OPEN_TENANTS", "8")))
+    return _registry
 
 class WebRTCClient:
-    def __init__(self, signaling_server_url, id):
+    def __init__(self, signaling_server_url, id, registry=None):
         self.SIGNALING_SERVER_URL = signaling_server_url
         self.ID = id
-        self.config = RTCConfiguration(iceServers=ice_servers)
+        self.config = None
+        ice_servers.prefetch()
         self.peer_connection = None
+        self.signaling = SignalingClient(signaling_server_url)
         self.channels = {}
         self.channels_ready = {
             'chat': asyncio.Event(),
@@ -41,28 +54,78 @@ class WebRTCClient:
             'user':asyncio.Event()
 
         }
-        self.assistant = ChatPDF()
+        # Blocking ChatPDF work runs in the pool so the loop keeps serving ICE and keep-alives
+        self.workers = WorkerPool()
+        self.loop_lag = LoopLagMonitor()
+        # Chroma, the models and this client's store load in the background; signaling
+        # starts straight away and only questions and uploads wait for them
+        self.registry = registry
+        self._assistant = self.workers.io_executor.submit(self._open_assistant)
+        self.file_receiver = FileReceiver()
+        # One per peer connection; replaced on reconnect
+        self.heartbeat = None
+        self.reconnecting = None
+        self.closed = False
+        # Responses are kept until acknowledged and sent again after a reconnect
+        # Messages go out as JSON text until the peer says it reads the compact format
+        self.wire = WireFormat()
+        self.resend = ResendQueue(self.send_heartbeat, self.wire.encode)
+        # Ids of recent file transfers, so one sent again after a reconnect is ingested once
+        self.completed_transfers = OrderedDict()
+
+    def _open_assistant(self):
+        if self.registry is None:
+            self.registry = default_registry(self.workers.embeddings())
+        # Documents and notes stored before per-client stores become this client's
+        self.registry.adopt(self.ID)
+        return self.registry.acquire(self.ID)
+
+    def _release_assistant(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.registry.release(self.ID)
+
+    @property
+    def assistant(self):
+        # Blocks until loaded; on the event loop use get_assistant()
+        return self._assistant.result()
+
+    async def get_assistant(self):
+        return await asyncio.wrap_future(self._assistant)
 
-    async def keep_alive(self):
-        while True:
-            if self.channels_ready['keep_alive'].is_set():
-                try:
-                    self.channels['keep_alive'].send("keep-alive")
-                except Exception as e:
-                    print(f"Error sending keep-alive: {e}")
-            await asyncio.sleep(5)
+    def send_heartbeat(self, text):
+        channel = self.channels.get('keep_alive')
+        if channel and channel.readyState == "open":
+            channel.send(text)
+
+    def control(self, message):
+        # keep_alive carries heartbeats, acknowledgements for the resend queue and the
+        # wire format hello
+        data = self.heartbeat.receive(message)
+        if data is not None and data.get("type") == "ack":
+            self.resend.acked(data)
+        elif data is not None and data.get("type") == "hello":
+            self.wire.negotiate(data)
 
     async def setup_signal(self):
         print("Starting setup")
+        start_exporters()
+        self.loop_lag.start()
         await self.create_peer_connection()
-        asyncio.create_task(self.periodic_reconnection())
 
     async def create_peer_connection(self):
-        self.peer_connection = RTCPeerConnection(configuration=self.config)
-        
+        connect_started = time.perf_counter()
+        # Cached credentials unless they are about to expire
+        self.config = RTCConfiguration(iceServers=await ice_servers.get())
+        self.peer_connection = peer_connection = RTCPeerConnection(configuration=self.config)
+        self.heartbeat = Heartbeat(self.send_heartbeat, self.on_peer_dead)
+        self.wire.reset()
+
         @self.peer_connection.on("iceconnectionstatechange")
         async def on_iceconnectionstatechange():
-            print(f"ICE connection state is {self.peer_connection.iceConnectionState}")
+            print(f"ICE connection state is {peer_connection.iceConnectionState}")
+            # No need to wait for the heartbeat to notice
+            if peer_connection.iceConnectionState == "failed" and peer_connection is self.peer_connection:
+                self.on_peer_dead()
 
         @self.peer_connection.on("icegatheringstatechange")
         async def on_icegatheringstatechange():
@@ -80,49 +143,76 @@ class WebRTCClient:
             async def on_open(channel=channel, name=channel_name):
                 print(f"Channel {name} opened")
                 self.channels_ready[name].set()
+                if all(event.is_set() for event in self.channels_ready.values()):
+                    tracer.record("peer.connect", time.perf_counter() - connect_started)
                 if name == "keep_alive":
-                    asyncio.create_task(self.keep_alive())
+                    self.heartbeat.start()
+                    self.send_heartbeat(self.wire.hello())
 
             @channel.on("message")
             async def on_message(message, name=channel_name):
-
-                if name=="upload":
+                self.heartbeat.heard()
+                if name=="upload" and is_file_frame(message):
+                    await self.handle_file_frame(message)
+                elif name=="upload":
+                    request_id = None
                     try:
-                        data = json.loads(message)
+                        data = self.wire.decode(message)
+                        if not self.resend.accept(name, data):
+                            return
+                        request_id = data.get("id")
                         if data["type"] == "image":
-                            # Decode and save or process the image
-                            img_data = base64.b64decode(data["data"])
-                            img = Image.open(io.BytesIO(img_data))
-                            # img = Image.open(io.BytesIO(img_data))
-                            self.assistant.ingest_image(img,'file')
-                            img.save("received_image.png")
-                            print(f"Received an image via RTC Datachannel {name}")
+                            # Decode, ingest and save the image in the worker pool
+                            with span("offer.upload", trace_id=request_id, kind="image") as upload:
+                                await self.workers.run_io(self.ingest_image_data, data["data"])
+                                print(f"Received an image via RTC Datachannel {name}")
+                                await self.send_message('response', "Image ingested.", id=request_id,
+                                                        server_time=upload.elapsed())
                         elif data["type"] == "text":
                             print(f"Received via RTC Datachannel {name}: {data['data']}")
                         else:
                             print(f"Received unknown data type via RTC Datachannel {name}")
-                    except json.JSONDecodeError:
+                    except (json.JSONDecodeError, WireError):
                         print(f"Received invalid JSON via RTC Datachannel {name}: {message}")
+                    except PoolBusy as e:
+                        print(f"Dropping upload, worker pool is busy: {e}")
+                        await self.send_message('response', "The assistant is busy, please upload again shortly.",
+                                                id=request_id)
+                    except Exception as e:
+                        print(f"Error ingesting upload: {e}")
+                        await self.send_message('response', f"Could not ingest the upload: {e}", id=request_id)
                 elif name=='user':
+                    request_id = None
                     try:
-                        data = json.loads(message)
+                        data = self.wire.decode(message)
+                        if not self.resend.accept(name, data):
+                            return
+                        # The answer peer matches responses to questions by this id
+                        request_id = data.get("id")
                         if data["type"] == "text":
                             print(f"Received via RTC Datachannel {name}: {data['data']}")
-                            response=self.assistant.ask(data['data'])
-                            await self.send_message('response',response)
-                    except json.JSONDecodeError:
+                            if data.get("stream"):
+                                await self.stream_answer(data['data'], request_id)
+                            else:
+                                # The request id is the trace id; server_time lets the answer
+                                # peer tell time spent here from time in transit
+                                with span("offer.question", trace_id=request_id) as question:
+                                    assistant = await self.get_assistant()
+                                    result = await self.workers.run_io(assistant.respond, data['data'])
+                                    await self.send_message('response', result["answer"], id=request_id,
+                                                            cached=result["cached"], cache=result.get("cache"),
+                                                            server_time=question.elapsed())
+                    except (json.JSONDecodeError, WireError):
                         print(f"Received invalid JSON via RTC Datachannel {name}: {message}")
+                    except PoolBusy as e:
+                        print(f"Rejecting question, worker pool is busy: {e}")
+                        await self.send_message('response', "The assistant is busy, please try again shortly.",
+                                                id=request_id)
                 elif name=='keep_alive':
-                    try:
-                        data = json.loads(message)
-                        if data["type"] == "text":
-                            print(data)
-                    except json.JSONDecodeError:
-                        print(f"Received invalid JSON via RTC Datachannel {name}: {message}")
-                            
+                    self.control(message)
                 else:
                     try:
-                        data = json.loads(message)
+                        data = self.wire.decode(message)
                         if data["type"] == "image":
                             # Decode and save or process the image
                             img_data = base64.b64decode(data["data"])
@@ -131,10 +221,10 @@ class WebRTCClient:
                             print(f"Received an image via RTC Datachannel {name}")
                         elif data["type"] == "text":
                             print(f"Received via RTC Datachannel {name}: {data['data']}")
-                            await self.send_message('response',"Response")
+                            await self.send_message('response',"Response", id=data.get("id"))
                         else:
                             print(f"Received unknown data type via RTC Datachannel {name}")
-                    except json.JSONDecodeError:
+                    except (json.JSONDecodeError, WireError):
                         print(f"Received invalid JSON via RTC Datachannel {name}: {message}")
                     except Exception as e:
                         print(f"Error processing message: {e}")
@@ -147,18 +237,24 @@ class WebRTCClient:
             @channel.on("open")
             def on_open():
                 print(f"Data channel '{channel.label}' is open")
-                if channel.label == "keep_alive":
-                    asyncio.create_task(self.keep_alive())
+
+            @channel.on("message")
+            def on_message(message):
+                # The answer peer's hello can arrive here, before it switches to our channel
+                self.heartbeat.heard()
+                if channel.label == 'keep_alive':
+                    self.control(message)
 
         await self.create_and_send_offer()
 
     async def create_and_send_offer(self):
         try:
-            offer = await self.peer_connection.createOffer()
-            await self.peer_connection.setLocalDescription(offer)
-            message = {"id": self.ID, "sdp": self.peer_connection.localDescription.sdp, "type": self.peer_connection.localDescription.type}
-            r = requests.post(self.SIGNALING_SERVER_URL + '/offer', data=message)
-            print(f"Offer sent, status: {r.status_code}")
+            with span("signaling.offer"):
+                offer = await self.peer_connection.createOffer()
+                await self.peer_connection.setLocalDescription(offer)
+                message = {"id": self.ID, "sdp": self.peer_connection.localDescription.sdp, "type": self.peer_connection.localDescription.type}
+                status = await self.signaling.post('/offer', message)
+            print(f"Offer sent, status: {status}")
         except Exception as e:
             print(f"Error during offer creation and sending: {str(e)}")
             return
@@ -167,56 +263,195 @@ class WebRTCClient:
 
     async def wait_for_answer(self):
         try:
-            while True:
-                resp = requests.get(self.SIGNALING_SERVER_URL + "/get_answer")
-                if resp.status_code == 503:
-                    print("Answer not ready, trying again")
-                    await asyncio.sleep(1)
-                elif resp.status_code == 200:
-                    data = resp.json()
-                    if data["type"] == "answer":
-                        rd = RTCSessionDescription(sdp=data["sdp"], type=data["type"])
-                        await self.peer_connection.setRemoteDescription(rd)
-                        print("Remote description set")
-                        break
-                    else:
-                        print("Wrong type")
-                        break
-                print(f"Answer polling status: {resp.status_code}")
+            # Long-polls, so the answer is applied as soon as it is posted
+            with span("signaling.wait_answer"):
+                data = await self.signaling.poll("/get_answer", {"id": self.ID})
+            if data["type"] == "answer":
+                rd = RTCSessionDescription(sdp=data["sdp"], type=data["type"])
+                await self.peer_connection.setRemoteDescription(rd)
+                print("Remote description set")
+            else:
+                print("Wrong type")
         except Exception as e:
             print(f"Error during answer polling: {str(e)}")
             return
 
-    async def periodic_reconnection(self):
-        while True:
-            await asyncio.sleep(180000)  # Wait for 3 minutes
-            print("Reconnecting after 3 minutes...")
-            await self.reconnect()
+    def on_peer_dead(self):
+        if self.closed or (self.reconnecting is not None and not self.reconnecting.done()):
+            return
+        print("Peer is not responding, reconnecting")
+        # Until the connection is back, responses wait in the resend queue
+        self.resend.holding = True
+        self.reconnecting = asyncio.create_task(self.reconnect())
+
+    async def resume(self):
+        # aiortc can't restart ICE, but while its ICE and SCTP transports are up a short
+        # outage can pass on its own, so the connection gets a grace period before it
+        # is torn down and renegotiated
+        pc = self.peer_connection
+        if pc is None or pc.connectionState != "connected" or pc.sctp is None or pc.sctp.state != "connected":
+            return False
+        return await self.heartbeat.revive(self.heartbeat.dead_after / 3)
+
+    async def reconnect(self, timeout=30.0):
+        # Resumes the connection if it can, otherwise renegotiates with backoff until
+        # every channel is open again. Questions and uploads being answered keep
+        # running; their responses, and any the answer peer never acknowledged, are
+        # sent once the connection is back.
+        started = time.perf_counter()
+        if await self.resume():
+            tracer.record("peer.resume", time.perf_counter() - started)
+            print(f"Connection resumed, resending {self.resend.replay(self.channels)} message(s)")
+            return True
+        for attempt, delay in enumerate(backoff_delays(), 1):
+            if self.heartbeat:
+                self.heartbeat.stop()
+            if self.peer_connection:
+                await self.peer_connection.close()
+            self.channels = {}
+            self.channels_ready = {name: asyncio.Event() for name in self.channels_ready}
+            try:
+                await asyncio.wait_for(self.create_peer_connection(), timeout)
+                await asyncio.wait_for(asyncio.gather(*(event.wait() for event in self.channels_ready.values())),
+                                       timeout)
+                tracer.record("peer.reconnect", time.perf_counter() - started, attempts=attempt)
+                print(f"Reconnected after {attempt} attempt(s), resending {self.resend.replay(self.channels)} message(s)")
+                return True
+            except asyncio.TimeoutError:
+                print(f"Reconnect attempt {attempt} timed out, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
 
-    async def reconnect(self):
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.reconnecting is not None:
+            self.reconnecting.cancel()
+        if self.heartbeat:
+            self.heartbeat.stop()
         if self.peer_connection:
             await self.peer_connection.close()
-        self.channels = {}
-        self.channels_ready = {
-            'chat': asyncio.Event(),
-            'keep_alive': asyncio.Event()
-        }
-        await self.create_peer_connection()
+        await self.signaling.close()
+        # Unpins this client's store so the registry can close it; one still opening
+        # is released as soon as it is open
+        self._assistant.add_done_callback(self._release_assistant)
+        self.workers.shutdown(wait=False)
+
+    async def handle_file_frame(self, message):
+        try:
+            transfer = self.file_receiver.feed(message)
+        except TransferError as e:
+            print(f"Dropping file transfer: {e}")
+            # Tells the sender now rather than leaving it to wait out its timeout
+            if e.transfer_id not in self.completed_transfers:
+                await self.send_message('response', f"Could not receive the file: {e}", id=e.transfer_id,
+                                        error=True)
+            return
+        except ValueError as e:
+            print(f"Dropping file frame: {e}")
+            return
+        if transfer is None:
+            return
+
+        if transfer.id in self.completed_transfers:
+            print(f"Ignoring {transfer.name}, it was already received before reconnecting")
+            return
+        self.completed_transfers[transfer.id] = True
+        if len(self.completed_transfers) > 256:
+            self.completed_transfers.popitem(last=False)
+        print(f"Received {transfer.name} ({transfer.size} bytes) via RTC Datachannel upload "
+              f"in {transfer.elapsed:.2f}s")
+        tracer.record("offer.receive", transfer.elapsed, trace_id=transfer.id, bytes=transfer.size)
+        try:
+            with span("offer.upload", trace_id=transfer.id, kind=transfer.mime) as upload:
+                await self.workers.run_io(self.ingest_file, transfer, asyncio.get_running_loop())
+                await self.send_message('response', f"{transfer.name} ingested.", id=transfer.id,
+                                        server_time=upload.elapsed())
+        except PoolBusy as e:
+            print(f"Dropping upload, worker pool is busy: {e}")
+            await self.send_message('response', "The assistant is busy, please upload again shortly.",
+                                    id=transfer.id)
+        except Exception as e:
+            print(f"Error ingesting {transfer.name}: {e}")
+            await self.send_message('response', f"Could not ingest {transfer.name}: {e}", id=transfer.id)
+
+    def ingest_file(self, transfer, loop):
+        if transfer.mime == "application/pdf" or transfer.name.lower().endswith(".pdf"):
+            # Page extraction reads from a path
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tf:
+                tf.write(transfer.data)
+                path = tf.name
+
+            # Runs in a worker thread; progress frames are sent from the event loop
+            def progress(event):
+                asyncio.run_coroutine_threadsafe(
+                    self.send_message('response', event, message_type="progress", id=transfer.id), loop)
+
+            try:
+                self.assistant.ingest_stream(path, source=transfer.name, progress=progress)
+            finally:
+                os.remove(path)
+        elif transfer.mime.startswith("image/"):
+            img = Image.open(io.BytesIO(transfer.buffer))
+            self.assistant.ingest_image(img, transfer.name)
+        else:
+            raise ValueError(f"Unsupported file type {transfer.mime}")
+
+    def ingest_image_data(self, encoded):
+        img = Image.open(io.BytesIO(base64.b64decode(encoded)))
+        self.assistant.ingest_image(img,'file')
+        img.save("received_image.png")
+
+    async def stream_answer(self, question, request_id=None):
+        # Sends the answer as sequenced 'token' frames followed by an 'end' frame.
+        # The generator is advanced in the worker pool so frames go out as tokens arrive.
+        seq = 0
+        info = {}
+        with span("offer.question", trace_id=request_id, stream=True) as answer:
+            try:
+                assistant = await self.get_assistant()
+                # Closed as soon as sending fails, which also closes the model stream
+                async with aclosing(self.workers.iterate_io(assistant.ask_stream(question, info))) as tokens:
+                    async for token in tokens:
+                        await self.send_message('response', token, message_type="token", seq=seq, id=request_id)
+                        seq += 1
+            except PoolBusy as e:
+                print(f"Rejecting question, worker pool is busy: {e}")
+                await self.send_message('response', "The assistant is busy, please try again shortly.",
+                                        message_type="token", seq=seq, id=request_id)
+                seq += 1
+            except Exception as e:
+                print(f"Error streaming answer: {e}")
+            await self.send_message('response', "", message_type="end", seq=seq, id=request_id,
+                                    cached=info.get("cached", False), cache=info.get("cache"),
+                                    server_time=answer.elapsed())
+
+    def metrics(self):
+        metrics = {"loop_lag": self.loop_lag.stats(), "workers": self.workers.stats(), "ice": ice_servers.stats(),
+                   "assistant_ready": self._assistant.done(), "stages": tracer.stats(),
+                   "heartbeat": self.heartbeat.stats() if self.heartbeat else None, "resend": self.resend.stats(),
+                   "wire": self.wire.stats()}
+        if self._assistant.done() and self._assistant.exception() is None:
+            metrics.update({"context": self.assistant.context_packer.stats(),
+                            "answer_cache": self.assistant.cache_stats(), "tenants": self.registry.stats()})
+        return metrics
 
     async def get_user_input(self):
         return await aioconsole.ainput("User: ")
 
-    async def send_message(self, channel_name, message, is_image=False):
-        if channel_name not in self.channels:
+    async def send_message(self, channel_name, message, is_image=False, message_type="text", **fields):
+        if channel_name not in self.channels_ready:
             print(f"Invalid channel name: {channel_name}")
             return
 
-        if not self.channels_ready[channel_name].is_set():
+        # While reconnecting, messages are queued and sent once the connection is back
+        if not self.channels_ready[channel_name].is_set() and not self.resend.holding:
             print(f"Channel {channel_name} is not ready yet. Please wait.")
             return
 
-        channel = self.channels[channel_name]
-        if channel and channel.readyState == "open":
+        # Messages on the request channels are kept even if the channel just closed
+        channel = self.channels.get(channel_name)
+        if self.resend.keeps(channel_name) or (channel and channel.readyState == "open"):
             if is_image:
                 # If the message is an image (file path or PIL Image object)
                 if isinstance(message, str):
@@ -234,18 +469,21 @@ class WebRTCClient:
                     raise ValueError("Image must be a file path or a PIL Image object")
                 
                 # Prepare the message with a flag indicating it's an image
-                data_to_send = json.dumps({
+                frame = {
                     "type": "image",
                     "data": img_str
-                })
+                }
             else:
-                # If it's a regular text message
-                data_to_send = json.dumps({
-                    "type": "text",
-                    "data": message
-                })
-
-            print(f"Sending via RTC Datachannel {channel_name}: {'[IMAGE]' if is_image else message}")
-            channel.send(data_to_send)
+                # If it's a regular text message, or a frame of a streamed one
+                frame = {
+                    "type": message_type,
+                    "data": message,
+                    **fields
+                }
+
+            if message_type == "text":
+                print(f"Sending via RTC Datachannel {channel_name}: {'[IMAGE]' if is_image else message}")
+            if not self.resend.send(channel, channel_name, frame) and message_type == "text":
+                print(f"Connection is down, {channel_name} message queued until it is back")
         else:
             print(f"Channel {channel_name} is not open. Cannot send message.")
\ No newline at end of file
@@ -0,0 +1,13 @@
+# pdf_pages.py
+# Page text extraction for streaming ingest. Kept free of heavy imports because it
+# is loaded by every worker process.
+from pypdf import PdfReader
+
+
+def page_count(path):
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(path, start, end):
+    reader = PdfReader(path)
+    return [(number, reader.pages[number].extract_text() or "") for number in range(start, min(end, len(reader.pages)))]
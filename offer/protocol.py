@@ -0,0 +1,80 @@
+# protocol.py
+# Shared by the offer and answer peers. Every request carries an "id" that the
+# other side echoes in its response frames, so many requests can be in flight
+# on one connection.
+import uuid
+import asyncio
+from collections import OrderedDict
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+class PendingRequests:
+    # Futures for single responses and queues for streamed ones, keyed by request id
+    def __init__(self):
+        self.futures = OrderedDict()
+        self.streams = OrderedDict()
+        self.progress_listeners = {}
+
+    def __len__(self):
+        return len(self.futures) + len(self.streams)
+
+    def create(self, request_id=None, on_progress=None):
+        request_id = request_id or new_request_id()
+        future = asyncio.get_event_loop().create_future()
+        self.futures[request_id] = future
+        if on_progress is not None:
+            self.progress_listeners[request_id] = on_progress
+        return request_id, future
+
+    def open_stream(self, request_id=None):
+        request_id = request_id or new_request_id()
+        queue = asyncio.Queue()
+        self.streams[request_id] = queue
+        return request_id, queue
+
+    def resolve(self, request_id, result):
+        # Responses without an id come from peers that predate the protocol;
+        # they answer requests in order, so they go to the oldest request.
+        if request_id is None and self.futures:
+            request_id = next(iter(self.futures))
+        future = self.futures.pop(request_id, None)
+        if future is None:
+            return False
+        if not future.done():
+            future.set_result(result)
+        return True
+
+    def feed(self, request_id, frame):
+        if request_id is None and self.streams:
+            request_id = next(iter(self.streams))
+        queue = self.streams.get(request_id)
+        if queue is None:
+            return False
+        queue.put_nowait(frame)
+        return True
+
+    def progress(self, request_id, event):
+        listener = self.progress_listeners.get(request_id)
+        if listener is None:
+            return False
+        try:
+            listener(event)
+        except Exception as e:
+            print(f"Error in progress listener for {request_id}: {e}")
+        return True
+
+    def discard(self, request_id):
+        self.progress_listeners.pop(request_id, None)
+        future = self.futures.pop(request_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+        self.streams.pop(request_id, None)
+
+    async def wait(self, request_id, future, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self.discard(request_id)
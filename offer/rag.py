@@ -1,7 +1,10 @@
-
 # rag.py
 import os
 import json
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 from langchain.vectorstores import Chroma
 from langchain.chat_models import ChatOllama
@@ -19,13 +22,32 @@ import base64
 import io
 from dateutil.relativedelta import relativedelta
 import datetime
+from actions import ActionExtractor, analyze_text_for_actions, perform_action
+from memory_store import MemoryLog
+from cache import LRUCache, SemanticCache, normalize_query
+from ingest_index import IngestIndex, content_hash, file_hash, image_hash
+from embedding_cache import CachedEmbeddings, LazyEmbeddings
+from workers import DEFAULT_EMBEDDING_MODEL
+from pdf_pages import page_count, extract_pages
+from ocr import default_ocr
+from keyword_index import KeywordIndex, is_keyword_query
+from retrieval import HybridRetriever
+from context import ContextPacker, estimate_tokens
+from tracing import span, tracer
 
 
 os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
 
 class ChatPDF:
-    def __init__(self, json_path='memory.json', persist_directory="./chroma_db"):
-        self.model = ChatOllama(model="llama3")
+    def __init__(self, json_path='memory.json', persist_directory="./chroma_db", action_batch_size=8,
+                 action_concurrency=4, cache_size=256, cache_ttl=3600, embedding=None, embedding_batch_size=64,
+                 page_workers=2, ocr=None, context_budget=768, context_candidates=12, semantic_cache_size=256,
+                 semantic_threshold=0.92, model=None, openai_client=None, chroma_client=None, collection_name=None,
+                 page_pool=None):
+        # model, openai_client, embedding, ocr, page_pool and chroma_client may be shared
+        # between instances (see tenants.py); only what is created here is closed by close()
+        self.model = model or ChatOllama(model="llama3",
+                                         base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=100)
         self.prompt = PromptTemplate.from_template(
             """
@@ -37,173 +59,394 @@ class ChatPDF:
             Answer: [/INST]
             """
         )
-        self.embedding = FastEmbedEmbeddings()
         self.json_path = json_path
         self.persist_directory = persist_directory
-        self.memory_data = self._load_memory()
+        self.memory = self._load_memory()
+        os.makedirs(self.persist_directory, exist_ok=True)
+
+        # Vectors are cached by model and text hash; only new texts reach the model
+        self._owns_embedding = not isinstance(embedding, CachedEmbeddings)
+        if self._owns_embedding:
+            # FastEmbed loads its model on the first texts that miss the cache
+            embedding = CachedEmbeddings(embedding or LazyEmbeddings(FastEmbedEmbeddings, DEFAULT_EMBEDDING_MODEL),
+                                         os.path.join(self.persist_directory, "embedding_cache.sqlite3"),
+                                         batch_size=embedding_batch_size)
+        self.embedding = embedding
+
+        # What is already stored, by content hash, so re-uploads cost nothing
+        self.ingest_index = IngestIndex(os.path.join(self.persist_directory, "ingest_index.sqlite3"))
+        self._ingesting = set()
+        self._ingesting_lock = threading.Lock()
+
+        # BM25 over the same chunks as the memory log, for exact terms the vectors miss
+        self.keyword_index = KeywordIndex(os.path.join(self.persist_directory, "keyword_index.sqlite3"))
+        self.keyword_index.sync(self.memory)
+
+        # Worker processes for streaming PDF ingest, started on first use
+        self.page_workers = page_workers
+        self._page_pool = page_pool
+        self._owns_page_pool = page_pool is None
+
+        # Retrieval over-fetches; the packer keeps the best chunks that fit the prompt budget
+        self.context_candidates = context_candidates
+        self.context_packer = ContextPacker(self.embedding, budget=context_budget, vectors=self._stored_vectors)
+
+        # Answers are cached per vector store version, which changes on every ingest
+        self.store_version = 0
+        self.answer_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        # Reworded questions are matched by embedding similarity
+        self.semantic_cache = SemanticCache(maxsize=semantic_cache_size, threshold=semantic_threshold, ttl=cache_ttl)
         
         # Configure OpenAI client
-        self.openai_client = OpenAI()
-        
-        # Initialize or load the vector store
+        self.openai_client = openai_client or OpenAI()
+
+        # Local OCR when Tesseract is installed, GPT-4o otherwise or as its fallback
+        self._owns_ocr = ocr is None
+        self.ocr = ocr or default_ocr(self.openai_client)
+
+        # Action extraction runs in the background so ingestion doesn't wait on GPT-4
+        self.actions = ActionExtractor(self.openai_client, self.perform_action, batch_size=action_batch_size,
+                                       max_concurrency=action_concurrency)
+
+        # Initialize or load the vector store: a collection in a shared Chroma client,
+        # or the default collection in persist_directory
+        self.chroma_client = chroma_client
+        self.collection_name = collection_name
         self._initialize_vector_store()
 
     def _load_memory(self):
-        if os.path.exists(self.json_path):
-            with open(self.json_path, 'r') as f:
-                try:
-                    return json.load(f)
-                except json.JSONDecodeError:
-                    return []
-        return []
-
-    def _save_memory(self):
-        with open(self.json_path, 'w') as f:
-            json.dump(self.memory_data, f)
+        # Entries are read lazily; an existing memory.json is picked up as legacy data
+        return MemoryLog.for_json_path(self.json_path)
+
+    @property
+    def memory_data(self):
+        return self.memory.entries
+
+    def _save_memory(self, entries):
+        # Only the new entries are appended to the log; returns its position after
+        return self.memory.append(entries)
 
     def _initialize_vector_store(self):
-        if os.path.exists(self.persist_directory):
+        if self.chroma_client is not None:
+            # A client-backed collection is persisted by Chroma on every write
+            self.vector_store = Chroma(client=self.chroma_client, collection_name=self.collection_name,
+                                       embedding_function=self.embedding)
+        elif os.path.exists(self.persist_directory):
             self.vector_store = Chroma(persist_directory=self.persist_directory, embedding_function=self.embedding)
         else:
             self.vector_store = Chroma(persist_directory=self.persist_directory, embedding_function=self.embedding)
             self.vector_store.persist()
         
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity_score_threshold",
-            search_kwargs={
-                "k": 3,
-                "score_threshold": 0.5,
-            },
-        )
+        self.retriever = HybridRetriever(self.vector_store, self.keyword_index, k=3, score_threshold=0.5)
         
-        self.chain = ({"context": self.retriever, "question": RunnablePassthrough()}
-                      | self.prompt
-                      | self.model
-                      | StrOutputParser())
+        # Retrieval happens once in ask(); the chain only formats the prompt and generates
+        self.chain = self.prompt | self.model | StrOutputParser()
+
+    def _claim(self, digest, source, kind):
+        # Returns False if this content is already stored or being ingested right now
+        existing = self.ingest_index.find_file(digest)
+        if existing is not None:
+            self.ingest_index.record_skip(source, kind, digest, f"duplicate of {existing['source']}")
+            return False
+        with self._ingesting_lock:
+            if digest in self._ingesting:
+                self.ingest_index.record_skip(source, kind, digest, "same content is already being ingested")
+                return False
+            self._ingesting.add(digest)
+        return True
 
-    def ingest(self, pdf_file_path: str):
-        docs = PyPDFLoader(file_path=pdf_file_path).load()
-        self._process_documents(docs, source=pdf_file_path)
+    def _release(self, digest):
+        with self._ingesting_lock:
+            self._ingesting.discard(digest)
+
+    def ingest(self, pdf_file_path: str, source=None):
+        source = source or pdf_file_path
+        digest = file_hash(pdf_file_path)
+        if not self._claim(digest, source, "file"):
+            return None
+        try:
+            with span("rag.ingest", source=source, kind="pdf"):
+                docs = PyPDFLoader(file_path=pdf_file_path).load()
+                return self._process_documents(docs, source=source, file_digest=digest)
+        finally:
+            self._release(digest)
 
     def ingest_image(self, image: Image, image_name: str):
-        # Convert image to base64
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        encoded_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
-
-        # Extract text using OpenAI
-        response = self.openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Extract only text from this image"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{encoded_image}"
-                            },
-                        },
-                    ],
-                }
-            ],
-            max_tokens=300,
-        )
+        digest = image_hash(image)
+        if not self._claim(digest, image_name, "image"):
+            return None
+        try:
+            with span("rag.ingest", source=image_name, kind="image"):
+                return self._ingest_image(image, image_name, digest)
+        finally:
+            self._release(digest)
 
-        extracted_text = response.choices[0].message.content
+    def _ingest_image(self, image: Image, image_name: str, digest):
+        with span("ocr.extract", backend=type(self.ocr).__name__):
+            extracted_text = self.ocr.extract(image)
 
         if not extracted_text.strip():
             raise ValueError(f"No text found in the image {image_name}")
 
+        # The extracted text is analyzed for actions along with its chunks
         doc = Document(page_content=extracted_text, metadata={"source": image_name})
-        self._process_documents([doc], source=image_name)
+        return self._process_documents([doc], source=image_name, file_digest=digest)
 
-        # Analyze the extracted text for actions
-        self.analyze_text_for_actions(extracted_text)
+    def _process_documents(self, docs, source, file_digest=None):
+        chunks, digests = self._store_chunks(self._split(docs, source), source)
 
-    def _process_documents(self, docs, source):
+        if file_digest is not None:
+            self.ingest_index.record_file(file_digest, source, digests)
+
+        # Analyze the chunks for actions in batches, without blocking the caller
+        return self.actions.submit([chunk.page_content for chunk in chunks], source)
+
+    def _split(self, docs, source):
         chunks = self.text_splitter.split_documents(docs)
         chunks = filter_complex_metadata(chunks)
-
         for chunk in chunks:
-            self.memory_data.append({"source": source, "content": chunk.page_content})
-            # Analyze each chunk for actions
-            self.analyze_text_for_actions(chunk.page_content)
+            chunk.metadata["source"] = source
+        return chunks
 
-        self._save_memory()
+    def _store_chunks(self, chunks, source):
+        # Chunks are stored under their content hash; known ones are skipped before embedding
+        digests = [content_hash(chunk.page_content) for chunk in chunks]
+        known = self.ingest_index.known_chunks(digests)
+        new_chunks, new_digests, seen = [], [], set()
+        for chunk, digest in zip(chunks, digests):
+            if digest in known:
+                self.ingest_index.record_skip(source, "chunk", digest, f"duplicate chunk of {known[digest]}")
+            elif digest in seen:
+                self.ingest_index.record_skip(source, "chunk", digest, "repeated within the same document")
+            else:
+                seen.add(digest)
+                new_chunks.append(chunk)
+                new_digests.append(digest)
+
+        if new_chunks:
+            with span("rag.store", chunks=len(new_chunks)):
+                position = self._save_memory([{"source": source, "content": chunk.page_content}
+                                              for chunk in new_chunks])
+                self.keyword_index.add([(digest, source, chunk.page_content)
+                                        for chunk, digest in zip(new_chunks, new_digests)], position=position)
+
+                self.vector_store.add_documents(new_chunks, ids=new_digests)
+                self._persist()
+                self.ingest_index.record_chunks(new_digests, source)
+                self._invalidate_answers()
+
+        return new_chunks, new_digests
+
+    def _persist(self):
+        if self.chroma_client is None:
+            self.vector_store.persist()
+
+    def close(self):
+        # Releases what this instance opened. Shared objects are left to their owner.
+        # Action extraction still running for this store is waited for.
+        self.actions.shutdown(wait=True)
+        self.ingest_index.close()
+        self.keyword_index.close()
+        if self._owns_embedding:
+            self.embedding.close()
+        if self._owns_page_pool and self._page_pool is not None:
+            self._page_pool.shutdown(wait=False)
+        if self._owns_ocr:
+            self.ocr.shutdown(wait=False)
+        self.answer_cache.clear()
+        self.semantic_cache.clear()
+        self.vector_store = None
+        self.retriever = None
+        self.memory = None
+
+    def _get_page_pool(self):
+        if self._page_pool is None:
+            self._page_pool = ProcessPoolExecutor(max_workers=self.page_workers,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        return self._page_pool
+
+    def ingest_stream(self, pdf_file_path: str, source=None, progress=None, batch_size=64, pages_per_task=4):
+        # Extracts pages in worker processes and commits chunks to Chroma every
+        # batch_size chunks, so early pages are searchable while later ones are still
+        # being read. progress, if given, is called with a dict after every commit.
+        # Returns the action extraction futures, one per committed batch.
+        source = source or pdf_file_path
+        digest = file_hash(pdf_file_path)
+        if not self._claim(digest, source, "file"):
+            if progress:
+                progress({"type": "progress", "source": source, "stage": "skipped"})
+            return []
+
+        tasks = []
+        started = time.perf_counter()
+        try:
+            pages_total = page_count(pdf_file_path)
+            pool = self._get_page_pool()
+            tasks = [pool.submit(extract_pages, pdf_file_path, start, start + pages_per_task)
+                     for start in range(0, pages_total, pages_per_task)]
+
+            status = {"type": "progress", "source": source, "stage": "pages", "pages_done": 0,
+                      "pages_total": pages_total, "chunks_stored": 0}
+            pending, digests, action_futures = [], [], []
+
+            def commit():
+                stored, stored_digests = self._store_chunks(pending, source)
+                if stored and not digests:
+                    tracer.record("rag.first_searchable", time.perf_counter() - started, source=source)
+                pending.clear()
+                digests.extend(stored_digests)
+                status["chunks_stored"] += len(stored)
+                action_futures.append(self.actions.submit([chunk.page_content for chunk in stored], source))
+                if progress:
+                    progress(dict(status))
+
+            # Tasks are consumed in page order so the first pages are committed first
+            for task in tasks:
+                for number, text in task.result():
+                    doc = Document(page_content=text, metadata={"source": source, "page": number})
+                    pending.extend(self._split([doc], source))
+                    status["pages_done"] += 1
+                    if len(pending) >= batch_size:
+                        commit()
+            commit()
+
+            self.ingest_index.record_file(digest, source, digests)
+            tracer.record("rag.ingest", time.perf_counter() - started, source=source, kind="pdf",
+                          pages=pages_total)
+            if progress:
+                progress(dict(status, stage="done"))
+            return action_futures
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._release(digest)
 
-        self.vector_store.add_documents(chunks)
-        self.vector_store.persist()
     def check_vector_store_contents(self):
         all_docs = self.vector_store.get()
         print("Vector store contents:", all_docs)
+    def _invalidate_answers(self):
+        self.store_version += 1
+        self.answer_cache.clear()
+        self.semantic_cache.clear()
+
+    def _stored_vectors(self, digests):
+        # Chunks are stored under their content hash, with the vectors computed at ingest
+        stored = self.vector_store.get(ids=digests, include=["embeddings"])
+        embeddings = stored.get("embeddings")
+        if embeddings is None:
+            return {}
+        return {digest: list(vector) for digest, vector in zip(stored["ids"], embeddings)}
+
+    def _build_context(self, query):
+        with span("rag.retrieve"):
+            candidates = self.retriever.get_relevant_documents(query, k=self.context_candidates)
+        with span("rag.pack"):
+            context, info = self.context_packer.pack(candidates)
+        prefill = estimate_tokens(self.prompt.format(context=context, question=query))
+        self.context_packer.record(prefill)
+        print(f"Context: {info['used']} pieces from {info['candidates']} retrieved chunks, "
+              f"{info['context_tokens']} context tokens, {prefill} prefill tokens")
+        return context, prefill
+
     def ask(self, query: str):
-        context = self.retriever.get_relevant_documents(query)
-        print("Retrieved context:", context)
-        self.check_vector_store_contents
-        return self.chain.invoke(query)
+        return self.respond(query)["answer"]
+
+    def _cached_answer(self, query):
+        # Returns (cache result or None, a function that stores a fresh answer)
+        version = self.store_version
+        key = (normalize_query(query), version)
+        answer = self.answer_cache.get(key)
+        if answer is not None:
+            return {"answer": answer, "cached": True, "cache": "exact"}, None
+
+        # Exact lookups skip the embedding model here as they do in retrieval. The
+        # query vector is cached, so retrieval doesn't embed the question again.
+        vector = None if is_keyword_query(query) else self.embedding.embed_query(query)
+        if vector is not None:
+            hit = self.semantic_cache.get(query, vector, version)
+            if hit is not None:
+                answer, question, similarity = hit
+                print(f"Semantic cache hit for {query!r}: {question!r} ({similarity:.3f})")
+                # The same wording again is then an exact hit
+                self.answer_cache.put(key, answer)
+                return {"answer": answer, "cached": True, "cache": "semantic", "similarity": similarity,
+                        "matched": question}, None
+
+        def store(answer):
+            self.answer_cache.put(key, answer)
+            if vector is not None:
+                self.semantic_cache.put(query, vector, answer, version)
+        return None, store
+
+    def respond(self, query: str):
+        with span("rag.cache_lookup"):
+            cached, store = self._cached_answer(query)
+        if cached is not None:
+            return cached
+
+        context, prefill = self._build_context(query)
+        with span("rag.llm", prefill_tokens=prefill):
+            answer = self.chain.invoke({"context": context, "question": query})
+        store(answer)
+        return {"answer": answer, "cached": False, "prefill_tokens": prefill}
+
+    def ask_stream(self, query: str, info=None):
+        # Yields the answer token by token as the model generates it. info, if given,
+        # is filled in with whether the answer came from a cache.
+        with span("rag.cache_lookup"):
+            cached, store = self._cached_answer(query)
+        if info is not None:
+            info.update({k: v for k, v in (cached or {"cached": False}).items() if k != "answer"})
+        if cached is not None:
+            yield cached["answer"]
+            return
+
+        context, prefill = self._build_context(query)
+        tokens = []
+        # Timed without a span: the consumer may advance the generator from another thread
+        start = time.perf_counter()
+        for token in self.chain.stream({"context": context, "question": query}):
+            if not tokens:
+                tracer.record("rag.llm_first_token", time.perf_counter() - start, prefill_tokens=prefill)
+            tokens.append(token)
+            yield token
+        tracer.record("rag.llm", time.perf_counter() - start, prefill_tokens=prefill, tokens=len(tokens))
+        store("".join(tokens))
+
+    def cache_stats(self):
+        return {"exact": self.answer_cache.stats(), "semantic": self.semantic_cache.stats()}
 
     def clear(self):
         self.vector_store = None
         self.retriever = None
         self.chain = None
         self._initialize_vector_store()
+        self._invalidate_answers()
 
-    def analyze_text_for_actions(self, text):
-        current_date = datetime.datetime.now()
-    
-        response = self.openai_client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "Analyze the following text and identify if any actions need to be taken. "
-                                          "Specifically, look for: "
-                                          "1. Dates of events or appointments "
-                                          "2. Tasks or to-do items "
-                                          "3. Reminders "
-                                          f"Today's date is {current_date.strftime('%Y-%m-%d')}. "
-                                          "For any dates mentioned in relative terms (e.g., 'this Friday,' 'next Monday'), "
-                                          "calculate and provide the actual date. "
-                                          "If an action is found, provide it in the following format: "
-                                          "ACTION: [Type of action (e.g., SET_ALARM, ADD_TODO, SET_REMINDER)] "
-                                          "DETAILS: [Relevant details including specific date (YYYY-MM-DD), time, and description] "
-                                          "If no action is needed, respond with 'No action required.'"},
-                {"role": "user", "content": text}
-            ],
-            max_tokens=150
-        )
-
-        analysis = response.choices[0].message.content
+    def reindex(self, batch_size=256):
+        # Rebuilds the vector store from the memory log. Vectors come from the
+        # embedding cache, so this mostly costs Chroma writes.
+        batch, ids, seen = [], [], set()
+        for entry in self.memory:
+            digest = content_hash(entry["content"])
+            if digest in seen:
+                continue
+            seen.add(digest)
+            batch.append(Document(page_content=entry["content"], metadata={"source": entry["source"]}))
+            ids.append(digest)
+            if len(batch) >= batch_size:
+                self.vector_store.add_documents(batch, ids=ids)
+                batch, ids = [], []
+        if batch:
+            self.vector_store.add_documents(batch, ids=ids)
+        self._persist()
+        self._invalidate_answers()
+        print(f"Reindexed {len(seen)} chunks, embedding cache: {self.embedding.stats()}")
+        return len(seen)
 
-        if "ACTION:" in analysis:
-            print("Action identified:")
-            print(analysis)
-            self.perform_action(analysis)
-        else:
-            print("No action required.")
+    def analyze_text_for_actions(self, text):
+        return analyze_text_for_actions(self.openai_client, text, model=self.actions.model,
+                                        max_tokens=self.actions.max_tokens_per_chunk)
 
     def perform_action(self, action_text):
-        action_type = action_text.split("ACTION:")[1].split("\n")[0].strip()
-        details = action_text.split("DETAILS:")[1].strip()
-
-        if action_type == "SET_ALARM":
-            self.set_alarm(details)
-        elif action_type == "ADD_TODO":
-            self.add_todo(details)
-        elif action_type == "SET_REMINDER":
-            self.set_reminder(details)
-
-    def set_alarm(self, details):
-        # This is a placeholder function. In a real application, you would integrate
-        # with a calendar or alarm system.
-        print(f"Alarm set: {details}")
-
-    def add_todo(self, details):
-        # This is a placeholder function. In a real application, you would integrate
-        # with a to-do list or task management system.
-        print(f"Todo added: {details}")
-
-    def set_reminder(self, details):
-        # This is a placeholder function. In a real application, you would integrate
-        # with a reminder or notification system.
-        print(f"Reminder set: {details}")
\ No newline at end of file
+        perform_action(action_text)
\ No newline at end of file
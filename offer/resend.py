@@ -0,0 +1,132 @@
+# resend.py
+# Keeps requests and responses across reconnects. Shared by the offer and answer peers.
+#
+# Messages on the request channels are numbered per channel ("sn", with "ep" the
+# sender's epoch, so a restarted peer starts a new count) and a copy is kept until
+# the other peer acknowledges it. Acknowledgements go out on the keep_alive channel
+# a moment after messages arrive, one frame covering every channel. While the
+# connection is down, messages are only queued; once it is back the unacknowledged
+# ones are sent again in order and the receiver drops any it had already seen.
+#
+# The queue is bounded. Beyond the limits the oldest messages are dropped, and the
+# receiver accepts the gap. Peers from before this ignore the extra fields and never
+# acknowledge, so for them the queue just stays at its limit.
+import json
+import asyncio
+from collections import OrderedDict
+from protocol import new_request_id
+
+RELIABLE_CHANNELS = ("user", "upload", "response")
+
+
+class Outbox:
+    def __init__(self, max_messages, max_bytes):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.next = 1
+        self.unacked = OrderedDict()
+        self.bytes = 0
+        self.dropped = 0
+
+    def add(self, frame, size):
+        # Frames are kept rather than their encoding, which may change on reconnect
+        sn = self.next
+        self.next += 1
+        self.unacked[sn] = (frame, size)
+        self.bytes += size
+        while len(self.unacked) > self.max_messages or (self.bytes > self.max_bytes and len(self.unacked) > 1):
+            _, (_, old) = self.unacked.popitem(last=False)
+            self.bytes -= old
+            self.dropped += 1
+        return sn
+
+    def ack(self, sn):
+        while self.unacked:
+            first = next(iter(self.unacked))
+            if first > sn:
+                break
+            self.bytes -= self.unacked.pop(first)[1]
+
+
+class ResendQueue:
+    def __init__(self, send_control, encode=json.dumps, channels=RELIABLE_CHANNELS, max_messages=1000,
+                 max_bytes=8 * 1024 * 1024, ack_delay=0.1):
+        # send_control sends a text frame on the keep_alive channel; encode turns a
+        # frame into what goes on the wire
+        self.send_control = send_control
+        self.encode = encode
+        self.epoch = new_request_id()[:8]
+        self.outboxes = {name: Outbox(max_messages, max_bytes) for name in channels}
+        self.received = {}
+        self.ack_delay = ack_delay
+        self.ack_timer = None
+        # Set while the connection is down; sends are queued until replay()
+        self.holding = False
+        self.replayed = 0
+        self.duplicates = 0
+
+    def keeps(self, name):
+        return name in self.outboxes
+
+    def send(self, channel, name, frame):
+        # True if the message went out now, False if it waits for replay()
+        outbox = self.outboxes.get(name)
+        if outbox is not None:
+            frame["sn"] = outbox.next
+            frame["ep"] = self.epoch
+        message = self.encode(frame)
+        if outbox is not None:
+            outbox.add(frame, len(message))
+        if self.holding or channel is None or channel.readyState != "open":
+            return False
+        channel.send(message)
+        return True
+
+    def accept(self, name, frame):
+        # False for a message already received before a reconnect
+        sn = frame.get("sn")
+        if sn is None or name not in self.outboxes:
+            return True
+        epoch, last = self.received.get(name, (None, 0))
+        if frame.get("ep") == epoch and sn <= last:
+            self.duplicates += 1
+            return False
+        self.received[name] = (frame.get("ep"), sn)
+        if self.ack_timer is None:
+            self.ack_timer = asyncio.get_running_loop().call_later(self.ack_delay, self.send_ack)
+        return True
+
+    def send_ack(self):
+        self.ack_timer = None
+        if self.received:
+            try:
+                self.send_control(json.dumps({"type": "ack", "acks": self.received}))
+            except Exception as e:
+                print(f"Error sending acknowledgement: {e}")
+
+    def acked(self, frame):
+        for name, (epoch, sn) in frame.get("acks", {}).items():
+            outbox = self.outboxes.get(name)
+            if outbox is not None and epoch == self.epoch:
+                outbox.ack(sn)
+
+    def replay(self, channels):
+        # Acknowledge first so the other side doesn't resend what already arrived
+        self.holding = False
+        self.send_ack()
+        count = 0
+        for name, outbox in self.outboxes.items():
+            channel = channels.get(name)
+            if channel is None or channel.readyState != "open":
+                continue
+            for frame, _ in outbox.unacked.values():
+                channel.send(self.encode(frame))
+                count += 1
+        self.replayed += count
+        return count
+
+    def stats(self):
+        return {"unacked": sum(len(outbox.unacked) for outbox in self.outboxes.values()),
+                "unacked_bytes": sum(outbox.bytes for outbox in self.outboxes.values()),
+                "dropped": sum(outbox.dropped for outbox in self.outboxes.values()),
+                "replayed": self.replayed, "duplicates": self.duplicates, "holding": self.holding}
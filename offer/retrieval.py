@@ -0,0 +1,49 @@
+# retrieval.py
+from ingest_index import content_hash
+from keyword_index import is_keyword_query
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    # Each ranking is a list of Documents, best first. Documents are matched by content
+    # hash, which is also their id in Chroma and in the keyword index.
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            digest = content_hash(doc.page_content)
+            docs.setdefault(digest, doc)
+            scores[digest] = scores.get(digest, 0.0) + 1.0 / (k + rank + 1)
+    return [docs[digest] for digest in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever:
+    # Vector search with a relevance threshold fused with BM25. Queries that look
+    # like exact lookups (an invoice number, a date, a quoted phrase) go to BM25
+    # alone and never reach the embedding model.
+    def __init__(self, vector_store, keyword_index, k=3, fetch_k=10, score_threshold=0.5, rrf_k=60):
+        self.vector_store = vector_store
+        self.keyword_index = keyword_index
+        self.k = k
+        self.fetch_k = fetch_k
+        self.score_threshold = score_threshold
+        self.rrf_k = rrf_k
+        self.keyword_only = 0
+        self.hybrid = 0
+
+    def vector_search(self, query, k=None):
+        results = self.vector_store.similarity_search_with_relevance_scores(query, k=k or self.fetch_k)
+        return [doc for doc, score in results if score >= self.score_threshold]
+
+    def keyword_search(self, query, k=None):
+        return [doc for doc, _ in self.keyword_index.search(query, k=k or self.fetch_k)]
+
+    def get_relevant_documents(self, query, k=None):
+        k = k or self.k
+        keyword_docs = self.keyword_search(query)
+        if keyword_docs and is_keyword_query(query):
+            self.keyword_only += 1
+            return keyword_docs[:k]
+        self.hybrid += 1
+        return reciprocal_rank_fusion([self.vector_search(query), keyword_docs], k=self.rrf_k)[:k]
+
+    def stats(self):
+        return {"keyword_only": self.keyword_only, "hybrid": self.hybrid, "indexed_chunks": len(self.keyword_index)}
@@ -1,18 +1,51 @@
-
-
 from flask import Flask, request, jsonify, Response
 from langchain_community.llms import Ollama
+import os
+import math
 import base64
-import asyncio
 import concurrent.futures
 import json
-from langchain_community.llms import Ollama
+from sessions import SessionStore, ROLES
+from summarizer import Summarizer, SummarizerBusy
 
 app = Flask(__name__)
-ollama_model = Ollama(model="phi3")
+ollama_model = Ollama(model="phi3", base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
+
+# One pool for the lifetime of the server, shared by all /summarize requests
+summarizer = Summarizer(ollama_model,
+                        max_concurrency=int(os.getenv("SUMMARIZE_CONCURRENCY", 4)),
+                        max_queue=int(os.getenv("SUMMARIZE_QUEUE", 64)))
+SUMMARIZE_TIMEOUT = 120
+
+
+# Offers, answers and ICE candidates, one mailbox per pairing id
+sessions = SessionStore(ttl=300)
+
+# Upper bound on how long a long-poll request is held open
+MAX_WAIT = 60
+
 
+def wait_param():
+    # Anything that isn't a number of seconds from 0 to MAX_WAIT is no wait, or the cap
+    try:
+        wait = float(request.args.get("wait", 0) or 0)
+    except ValueError:
+        return 0.0
+    if math.isnan(wait):
+        return 0.0
+    return min(max(wait, 0.0), MAX_WAIT)
 
-data = {}
+
+def take(kind):
+    # Pops the offer or answer for ?id=<pairing id>. With ?wait=<seconds>, blocks until
+    # it is posted or the wait runs out.
+    return sessions.take(request.args.get("id"), kind, wait_param())
+
+
+def put(kind):
+    sessions.put(request.form['id'], kind,
+                 {"id" : request.form['id'], "type" : request.form['type'], "sdp" : request.form['sdp']},
+                 client_id=request.form.get('client'))
 
 @app.route('/test')
 def test():
@@ -20,16 +53,16 @@ def test():
 
 @app.route('/offer', methods=['POST'])
 def offer():
-    if request.form.get("type") == "offer":
-        data["offer"] = {"id" : request.form['id'], "type" : request.form['type'], "sdp" : request.form['sdp']}
+    if request.form.get("type") == "offer" and request.form.get("id"):
+        put("offer")
         return Response(status=200)
     else:
         return Response(status=400)
 
 @app.route('/answer', methods=['POST'])
 def answer():
-    if request.form.get("type") == "answer":
-        data["answer"] = {"id" : request.form['id'], "type" : request.form['type'], "sdp" : request.form['sdp']}
+    if request.form.get("type") == "answer" and request.form.get("id"):
+        put("answer")
         return Response(status=200)
     else:
         return Response(status=400)
@@ -38,35 +71,62 @@ def answer():
 
 @app.route('/get_offer', methods=['GET'])
 def get_offer():
-    if "offer" in data:
-        j = json.dumps(data["offer"])
-        del data["offer"]
-        return Response(j, status=200, mimetype='application/json')
+    offer = take("offer")
+    if offer is not None:
+        return Response(json.dumps(offer), status=200, mimetype='application/json')
     else:
         return Response(status=503)
 
 @app.route('/get_answer', methods=['GET'])
 def get_answer():
-    if "answer" in data:
-        j = json.dumps(data["answer"])
-        del data["answer"]
-        return Response(j, status=200, mimetype='application/json')
+    answer = take("answer")
+    if answer is not None:
+        return Response(json.dumps(answer), status=200, mimetype='application/json')
     else:
         return Response(status=503)
 
-async def summarize_text(text):
-    loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        summary = await loop.run_in_executor(pool, ollama_model.invoke, "Give the best option from the given. Casual shoes for a men of size 8" + text)
-    return summary
+@app.route('/candidate', methods=['POST'])
+def candidate():
+    # Trickle ICE: role is the sender's role, the candidate is queued for the other side
+    role = request.form.get("role")
+    if role not in ROLES or not request.form.get("id") or "candidate" not in request.form:
+        return Response(status=400)
+    queued = sessions.add_candidate(request.form['id'], role, {
+        "candidate": request.form['candidate'],
+        "sdpMid": request.form.get('sdpMid'),
+        "sdpMLineIndex": request.form.get('sdpMLineIndex'),
+    })
+    return Response(status=200 if queued else 429)
+
+@app.route('/get_candidates', methods=['GET'])
+def get_candidates():
+    role = request.args.get("role")
+    if role not in ROLES or not request.args.get("id"):
+        return Response(status=400)
+    candidates = sessions.take_candidates(request.args['id'], role, wait_param())
+    return Response(json.dumps(candidates), status=200, mimetype='application/json')
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(sessions.stats())
 
 @app.route('/summarize', methods=['POST'])
 def summarize():
     data = request.json
     input_text = data['text']
-    summary = asyncio.run(summarize_text(input_text))
+    try:
+        summary = summarizer.submit(input_text).result(timeout=SUMMARIZE_TIMEOUT)
+    except SummarizerBusy:
+        return Response(status=503, headers={"Retry-After": "1"})
+    except concurrent.futures.TimeoutError:
+        return Response(status=504)
     return jsonify({'summary': summary})
 
+@app.route('/summarize/stats', methods=['GET'])
+def summarize_stats():
+    return jsonify(summarizer.stats())
+
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=9090, debug=True)
+    # threaded: each long-poll request holds a thread while it waits
+    app.run(host="0.0.0.0", port=9090, debug=True, threaded=True)
 
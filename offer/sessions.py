@@ -0,0 +1,118 @@
+# sessions.py
+# Signaling state for server.py: one mailbox per pairing id, so many offer/answer
+# pairs can signal through one server at the same time.
+import time
+import threading
+from collections import deque, OrderedDict
+
+ROLES = ("offer", "answer")
+
+
+def other_role(role):
+    return "answer" if role == "offer" else "offer"
+
+
+class Session:
+    def __init__(self, pairing_id):
+        self.pairing_id = pairing_id
+        self.slots = {}
+        # Candidates are queued for the role that will read them
+        self.candidates = {role: deque() for role in ROLES}
+        self.clients = {}
+        self.changed = threading.Condition()
+        self.touched = time.monotonic()
+
+
+class SessionStore:
+    # Thread-safe: the store lock guards the session table, each session's condition
+    # guards its mailbox. Sessions idle for longer than ttl seconds are dropped.
+    def __init__(self, ttl=300, max_candidates=200):
+        self.ttl = ttl
+        self.max_candidates = max_candidates
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        # Notified on every post, for legacy requests that don't name a session
+        self.any_changed = threading.Condition()
+        self.last_sweep = time.monotonic()
+
+    def session(self, pairing_id):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_sweep > min(self.ttl, 30):
+                self._sweep(now)
+            session = self.sessions.get(pairing_id)
+            if session is None:
+                session = self.sessions[pairing_id] = Session(pairing_id)
+            self.sessions.move_to_end(pairing_id)
+            session.touched = now
+            return session
+
+    def _sweep(self, now):
+        self.last_sweep = now
+        while self.sessions:
+            pairing_id, session = next(iter(self.sessions.items()))
+            if now - session.touched <= self.ttl:
+                break
+            del self.sessions[pairing_id]
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def put(self, pairing_id, kind, value, client_id=None):
+        session = self.session(pairing_id)
+        with session.changed:
+            session.slots[kind] = value
+            if client_id:
+                session.clients[kind] = client_id
+            session.changed.notify_all()
+        with self.any_changed:
+            self.any_changed.notify_all()
+
+    def take(self, pairing_id, kind, wait=0):
+        if pairing_id is None:
+            return self._take_any(kind, wait)
+        session = self.session(pairing_id)
+        with session.changed:
+            if wait > 0:
+                session.changed.wait_for(lambda: kind in session.slots, timeout=wait)
+            return session.slots.pop(kind, None)
+
+    def _take_any(self, kind, wait):
+        # Requests from older clients carry no id; serve them the oldest pending item
+        deadline = time.monotonic() + wait
+        while True:
+            with self.lock:
+                sessions = list(self.sessions.values())
+            for session in sessions:
+                with session.changed:
+                    if kind in session.slots:
+                        return session.slots.pop(kind)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            with self.any_changed:
+                self.any_changed.wait(timeout=min(remaining, 1.0))
+
+    def add_candidate(self, pairing_id, from_role, candidate):
+        session = self.session(pairing_id)
+        with session.changed:
+            queue = session.candidates[other_role(from_role)]
+            if len(queue) >= self.max_candidates:
+                return False
+            queue.append(candidate)
+            session.changed.notify_all()
+        return True
+
+    def take_candidates(self, pairing_id, role, wait=0):
+        session = self.session(pairing_id)
+        with session.changed:
+            queue = session.candidates[role]
+            if wait > 0:
+                session.changed.wait_for(lambda: len(queue) > 0, timeout=wait)
+            candidates = list(queue)
+            queue.clear()
+            return candidates
+
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.sessions)}
@@ -0,0 +1,45 @@
+# signaling.py
+# Async client for the signaling server in server.py, shared by both peers. One
+# pooled aiohttp session per client; offers and answers are fetched by long-polling,
+# so they arrive as soon as the other side posts them.
+import time
+import asyncio
+import aiohttp
+
+LONG_POLL_WAIT = 25
+
+
+class SignalingClient:
+    def __init__(self, base_url, wait=LONG_POLL_WAIT):
+        self.base_url = base_url.rstrip('/')
+        self.wait = wait
+        self.http = None
+
+    def session(self):
+        if self.http is None or self.http.closed:
+            self.http = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, connect=10, sock_read=self.wait + 10))
+        return self.http
+
+    async def post(self, path, message):
+        async with self.session().post(self.base_url + path, data=message) as resp:
+            return resp.status
+
+    async def poll(self, path, params=None):
+        # Returns the JSON body once the server has it. A server without long-poll
+        # support answers 503 straight away; back off a second then, as before.
+        params = dict(params or {}, wait=self.wait)
+        while True:
+            start = time.monotonic()
+            async with self.session().get(self.base_url + path, params=params) as resp:
+                if resp.status == 200:
+                    return await resp.json(content_type=None)
+                if resp.status != 503:
+                    raise RuntimeError(f"Signaling server returned {resp.status} for {path}")
+            if time.monotonic() - start < 1:
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
@@ -0,0 +1,53 @@
+# summarizer.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PROMPT = "Give the best option from the given. Casual shoes for a men of size 8"
+
+
+class SummarizerBusy(Exception):
+    pass
+
+
+class Summarizer:
+    # Long-lived pool for /summarize. max_concurrency requests run against the model
+    # at once and at most max_queue are accepted in total; identical texts already in
+    # flight share one model call.
+    def __init__(self, model, max_concurrency=4, max_queue=64):
+        self.model = model
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="summarize")
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def submit(self, text):
+        with self.lock:
+            future = self.inflight.get(text)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            if len(self.inflight) >= self.max_queue:
+                self.rejected += 1
+                raise SummarizerBusy(f"{len(self.inflight)} summaries already queued")
+            future = self.executor.submit(self._summarize, text)
+            self.inflight[text] = future
+        future.add_done_callback(lambda _: self._done(text, future))
+        return future
+
+    def _done(self, text, future):
+        with self.lock:
+            if self.inflight.get(text) is future:
+                del self.inflight[text]
+
+    def _summarize(self, text):
+        with self.lock:
+            self.calls += 1
+        return self.model.invoke(PROMPT + text)
+
+    def stats(self):
+        with self.lock:
+            return {"inflight": len(self.inflight), "calls": self.calls, "coalesced": self.coalesced,
+                    "rejected": self.rejected}
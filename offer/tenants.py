@@ -0,0 +1,248 @@
+# tenants.py
+# One ChatPDF per user or client id, all in one process. The expensive objects (the
+# llama3 client, the embedding model and its cache, the OpenAI client, OCR and PDF
+# worker pools, the Chroma client) are created once in SharedResources. Each tenant
+# has its own Chroma collection, memory log and indexes, opened on first use and
+# closed again when it has been idle longest and too many are open.
+#
+# The store from before tenants (./memory.json and the default collection in
+# ./chroma_db) is copied into one tenant's store the first time that tenant opens;
+# see TenantRegistry.adopt(). The old files are left where they were.
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import itertools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# Collection langchain's Chroma uses when given none, as ChatPDF did before tenants
+LEGACY_COLLECTION = "langchain"
+
+
+def tenant_key(tenant_id):
+    # Filesystem- and Chroma-safe, and distinct even for ids that differ only in
+    # characters that get replaced
+    digest = hashlib.sha256(str(tenant_id).encode()).hexdigest()[:12]
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", str(tenant_id))[:40].strip("_-") or "tenant"
+    return f"{safe}-{digest}"
+
+
+def adopt_legacy_store(directory, chroma_client, collection_name, json_path, persist_directory, batch_size=500):
+    # Copies a pre-tenant store into a tenant's: memory log entries, the vectors as
+    # they are (nothing is embedded again) and the ingest index, so re-uploads of
+    # files stored before are still skipped. The keyword index is rebuilt from the
+    # memory log when the tenant opens. Returns False if there was nothing to adopt.
+    import chromadb
+    from memory_store import MemoryLog
+    from ingest_index import IngestIndex
+
+    marker = os.path.join(directory, "legacy_adopted")
+    legacy_memory = MemoryLog.for_json_path(json_path)
+    if os.path.exists(marker) or not (len(legacy_memory) or os.path.isdir(persist_directory)):
+        return False
+    print(f"Adopting the store in {json_path} and {persist_directory}")
+
+    memory = MemoryLog.for_json_path(os.path.join(directory, "memory.json"))
+    entries = iter(legacy_memory)
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+        if not batch:
+            break
+        memory.append(batch)
+
+    vectors = 0
+    if os.path.isdir(persist_directory):
+        try:
+            source = chromadb.PersistentClient(path=persist_directory).get_collection(LEGACY_COLLECTION)
+        except Exception as e:
+            print(f"No collection to adopt in {persist_directory}: {e}")
+            source = None
+        if source is not None:
+            target = chroma_client.get_or_create_collection(collection_name)
+            for offset in itertools.count(0, batch_size):
+                batch = source.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+                if not len(batch["ids"]):
+                    break
+                # upsert, so a copy interrupted before the marker is written can run again
+                target.upsert(ids=batch["ids"], embeddings=batch["embeddings"], documents=batch["documents"],
+                              metadatas=batch["metadatas"])
+                vectors += len(batch["ids"])
+
+        legacy_index = os.path.join(persist_directory, "ingest_index.sqlite3")
+        if os.path.exists(legacy_index):
+            index_path = os.path.join(directory, "ingest_index.sqlite3")
+            IngestIndex(index_path).close()
+            db = sqlite3.connect(index_path)
+            try:
+                db.execute("ATTACH DATABASE ? AS legacy", (legacy_index,))
+                with db:
+                    for table in ("files", "chunks", "skips"):
+                        db.execute(f"INSERT OR IGNORE INTO {table} SELECT * FROM legacy.{table}")
+            finally:
+                db.close()
+
+    with open(marker, "w") as f:
+        f.write(f"{json_path}\n{persist_directory}\n")
+    print(f"Adopted {len(memory)} memory entries and {vectors} vectors")
+    return True
+
+
+class SharedResources:
+    def __init__(self, root="./tenants", embedding=None, embedding_batch_size=64, page_workers=2, ocr=None):
+        import chromadb
+        from openai import OpenAI
+        from langchain.chat_models import ChatOllama
+        from langchain.embeddings import FastEmbedEmbeddings
+        from embedding_cache import CachedEmbeddings, LazyEmbeddings
+        from workers import DEFAULT_EMBEDDING_MODEL
+        from ocr import default_ocr
+
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.model = ChatOllama(model="llama3", base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
+        self.openai_client = OpenAI()
+        if embedding is None:
+            # Loads while the first tenant opens instead of before it
+            embedding = LazyEmbeddings(FastEmbedEmbeddings, DEFAULT_EMBEDDING_MODEL)
+            embedding.warm()
+        # The cache is keyed by text hash only, so tenants storing the same text share a vector
+        self.embedding = CachedEmbeddings(embedding,
+                                          os.path.join(root, "embedding_cache.sqlite3"),
+                                          batch_size=embedding_batch_size)
+        self.ocr = ocr or default_ocr(self.openai_client)
+        # Worker processes are only started when a PDF is streamed in
+        self.page_pool = ProcessPoolExecutor(max_workers=page_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.chroma_client = chromadb.PersistentClient(path=os.path.join(root, "chroma"))
+
+    def close(self):
+        self.page_pool.shutdown(wait=False)
+        self.ocr.shutdown(wait=False)
+        self.embedding.close()
+
+
+class TenantRegistry:
+    # acquire() opens a tenant if needed and pins it; release() unpins it. Pinned
+    # tenants are never closed. Of the unpinned ones, those idle for idle_ttl seconds
+    # are closed, and the least recently used are closed while more than max_open
+    # tenants are open. chatpdf_kwargs are passed to every ChatPDF.
+    def __init__(self, shared=None, root="./tenants", max_open=8, idle_ttl=900, **chatpdf_kwargs):
+        self.shared = shared or SharedResources(root)
+        self.root = self.shared.root
+        self.max_open = max_open
+        self.idle_ttl = idle_ttl
+        self.chatpdf_kwargs = chatpdf_kwargs
+        self.open = OrderedDict()
+        self.lock = threading.Lock()
+        self.legacy = {}
+        self.opened = 0
+        self.closed = 0
+
+    def adopt(self, tenant_id, json_path="memory.json", persist_directory="./chroma_db"):
+        # The pre-tenant store at these paths is copied into tenant_id's store when it
+        # is next opened, unless an earlier open already did
+        self.legacy[tenant_id] = (json_path, persist_directory)
+
+    def _open(self, tenant_id):
+        from rag import ChatPDF
+        key = tenant_key(tenant_id)
+        directory = os.path.join(self.root, "users", key)
+        collection_name = f"tenant-{key}"[:63]
+        os.makedirs(directory, exist_ok=True)
+        print(f"Opening tenant {tenant_id}")
+        if tenant_id in self.legacy:
+            adopt_legacy_store(directory, self.shared.chroma_client, collection_name, *self.legacy[tenant_id])
+        return ChatPDF(json_path=os.path.join(directory, "memory.json"), persist_directory=directory,
+                       embedding=self.shared.embedding, model=self.shared.model,
+                       openai_client=self.shared.openai_client, ocr=self.shared.ocr,
+                       page_pool=self.shared.page_pool, chroma_client=self.shared.chroma_client,
+                       collection_name=collection_name, **self.chatpdf_kwargs)
+
+    def acquire(self, tenant_id):
+        # Opening a tenant can take seconds, so it happens outside the lock. The entry
+        # goes in first, pinned, with a future that callers for the same tenant wait on.
+        with self.lock:
+            entry = self.open.get(tenant_id)
+            opening = entry is None
+            if opening:
+                entry = self.open[tenant_id] = {"assistant": None, "ready": Future(), "pins": 0}
+            entry["pins"] += 1
+            entry["used"] = time.monotonic()
+            self.open.move_to_end(tenant_id)
+            closing = self._evict()
+        self._close(closing)
+        if opening:
+            try:
+                assistant = self._open(tenant_id)
+            except BaseException as e:
+                with self.lock:
+                    self.open.pop(tenant_id, None)
+                entry["ready"].set_exception(e)
+                raise
+            with self.lock:
+                entry["assistant"] = assistant
+                self.opened += 1
+                closing = self._evict()
+            entry["ready"].set_result(assistant)
+            self._close(closing)
+        return entry["ready"].result()
+
+    def release(self, tenant_id):
+        with self.lock:
+            entry = self.open.get(tenant_id)
+            if entry is not None:
+                entry["pins"] = max(0, entry["pins"] - 1)
+                entry["used"] = time.monotonic()
+            closing = self._evict()
+        self._close(closing)
+
+    @contextmanager
+    def lease(self, tenant_id):
+        assistant = self.acquire(tenant_id)
+        try:
+            yield assistant
+        finally:
+            self.release(tenant_id)
+
+    def _evict(self):
+        # Called with the lock held; takes the tenants to close out of self.open and
+        # returns them for _close(), which runs after the lock is released
+        now = time.monotonic()
+        excess = len(self.open) - self.max_open
+        closing = []
+        for tenant_id, entry in list(self.open.items()):
+            if entry["pins"] or entry["assistant"] is None:
+                continue
+            if excess > 0 or now - entry["used"] > self.idle_ttl:
+                closing.append((tenant_id, self.open.pop(tenant_id)))
+                excess -= 1
+        return closing
+
+    def _close(self, closing):
+        # Waits for the tenant's action extraction to finish, so it can take a while
+        for tenant_id, entry in closing:
+            if entry["assistant"] is None:
+                continue
+            print(f"Closing idle tenant {tenant_id}")
+            try:
+                entry["assistant"].close()
+            except Exception as e:
+                print(f"Error closing tenant {tenant_id}: {e}")
+            with self.lock:
+                self.closed += 1
+
+    def stats(self):
+        with self.lock:
+            return {"open": len(self.open), "pinned": sum(1 for entry in self.open.values() if entry["pins"]),
+                    "opened": self.opened, "closed": self.closed}
+
+    def close(self):
+        with self.lock:
+            closing = list(self.open.items())
+            self.open.clear()
+        self._close(closing)
+        self.shared.close()
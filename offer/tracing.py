@@ -0,0 +1,231 @@
+# tracing.py
+# Spans and per-stage latency histograms, used by both peers. A span times one stage
+# of a request. Spans opened while another is active (in the same task, or in a
+# worker thread started through WorkerPool) become its children and share its trace
+# id. The trace id is the request id the peers already exchange, so one trace covers
+# a question from the answer peer through retrieval and the model and back.
+#
+# Every finished span is counted in its stage's histogram, which costs a lock and a
+# few additions. The spans of a sample of traces (and all failed spans) are kept for
+# inspection; the sample is chosen by trace id, so both peers keep the same traces.
+# Histograms are exported as Prometheus text from a local HTTP endpoint, or together
+# with the kept spans as a JSON file.
+import os
+import json
+import time
+import zlib
+import random
+import bisect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Seconds; Prometheus-style upper bounds, the last bucket is everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_current = contextvars.ContextVar("span", default=None)
+
+
+def new_span_id():
+    # Not for security; uuid4 reads os.urandom and costs several times more
+    return f"{random.getrandbits(64):016x}"
+
+
+def current_trace_id():
+    span = _current.get()
+    return span.trace_id if span is not None else None
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        # Upper bound of the bucket the q-th observation falls in; past the last bound,
+        # the slowest observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def stats(self):
+        return {"count": self.count, "mean": self.sum / self.count if self.count else 0.0,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99), "max": self.max}
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "wall", "duration", "attrs", "error")
+
+    def __init__(self, name, trace_id, parent_id, attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.wall = time.time()
+        self.duration = None
+        self.attrs = attrs
+        self.error = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def to_dict(self):
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start": self.wall, "duration": self.duration, "error": self.error, **self.attrs}
+
+
+class Tracer:
+    def __init__(self, service="chatpdf", sample_rate=0.1, keep=1000):
+        self.service = service
+        self.sample_rate = sample_rate
+        self.histograms = {}
+        self.errors = {}
+        self.spans = deque(maxlen=keep)
+        self.lock = threading.Lock()
+        self.server = None
+
+    @contextmanager
+    def span(self, name, trace_id=None, **attrs):
+        parent = _current.get()
+        if trace_id is None:
+            trace_id = parent.trace_id if parent is not None else new_span_id()
+        span = Span(name, trace_id, parent.span_id if parent is not None else None, attrs)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = span.elapsed()
+            _current.reset(token)
+            self._finish(span)
+
+    def record(self, name, seconds, trace_id=None, **attrs):
+        # A stage timed elsewhere, e.g. the other peer's share of a round trip
+        parent = _current.get()
+        span = Span(name, trace_id or (parent.trace_id if parent is not None else None),
+                    parent.span_id if parent is not None else None, attrs)
+        span.duration = seconds
+        span.wall -= seconds
+        self._finish(span)
+
+    def _finish(self, span):
+        with self.lock:
+            histogram = self.histograms.get(span.name)
+            if histogram is None:
+                histogram = self.histograms[span.name] = Histogram()
+            histogram.observe(span.duration)
+            if span.error is not None:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+            if span.error is not None or self.sampled(span.trace_id):
+                self.spans.append(span)
+
+    def sampled(self, trace_id):
+        return trace_id is not None and zlib.crc32(trace_id.encode()) < self.sample_rate * 2 ** 32
+
+    def stats(self):
+        with self.lock:
+            return {name: dict(histogram.stats(), errors=self.errors.get(name, 0))
+                    for name, histogram in sorted(self.histograms.items())}
+
+    def traces(self, trace_id=None):
+        with self.lock:
+            return [span.to_dict() for span in self.spans if trace_id is None or span.trace_id == trace_id]
+
+    def prometheus(self):
+        lines = ["# HELP chatpdf_stage_seconds Time spent in each stage of a request",
+                 "# TYPE chatpdf_stage_seconds histogram"]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                labels = f'service="{self.service}",stage="{name}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'chatpdf_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'chatpdf_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"chatpdf_stage_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"chatpdf_stage_seconds_count{{{labels}}} {histogram.count}")
+            lines.append("# HELP chatpdf_stage_errors_total Stages that ended with an exception")
+            lines.append("# TYPE chatpdf_stage_errors_total counter")
+            for name, count in sorted(self.errors.items()):
+                lines.append(f'chatpdf_stage_errors_total{{service="{self.service}",stage="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def export_json(self, path):
+        # Written to a temporary file first so readers never see half a file
+        data = {"service": self.service, "exported": time.time(), "stages": self.stats(), "spans": self.traces()}
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    def serve(self, port=9464, host="127.0.0.1"):
+        # /metrics in Prometheus text format, /traces as JSON (?trace=<id> for one trace)
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                if path == "/metrics":
+                    body, kind = tracer.prometheus().encode(), "text/plain; version=0.0.4"
+                elif path == "/traces":
+                    trace_id = query[len("trace="):] if query.startswith("trace=") else None
+                    body, kind = json.dumps(tracer.traces(trace_id)).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Metrics on http://{host}:{self.server.server_port}/metrics")
+        return self.server.server_port
+
+
+# Shared by everything in the process. TRACE_SAMPLE_RATE is the share of spans kept
+# for /traces and the JSON export.
+tracer = Tracer(service=os.getenv("TRACE_SERVICE", "chatpdf"), sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.1")))
+span = tracer.span
+_exporting = False
+
+
+def start_exporters():
+    # Called by the peers at setup: METRICS_PORT serves /metrics there, TRACE_EXPORT
+    # names a JSON file written at exit. Only the first call does anything.
+    global _exporting
+    if _exporting:
+        return
+    _exporting = True
+    if os.getenv("METRICS_PORT"):
+        try:
+            tracer.serve(int(os.getenv("METRICS_PORT")))
+        except OSError as e:
+            print(f"Could not serve metrics on port {os.getenv('METRICS_PORT')}: {e}")
+    if os.getenv("TRACE_EXPORT"):
+        import atexit
+        atexit.register(tracer.export_json, os.getenv("TRACE_EXPORT"))
@@ -0,0 +1,142 @@
+# wire.py
+# Encoding of the JSON messages on the DataChannels, shared by both peers. When the
+# keep_alive channel opens each peer sends a hello listing the formats it can read,
+# and from the other's hello on, messages go out as binary frames:
+#   magic "NW", version, codec, compression
+# followed by the message as msgpack (or JSON where msgpack isn't installed),
+# compressed with zstd or deflate when it is at least COMPRESS_THRESHOLD bytes and
+# compressing makes it smaller. Until a hello arrives, and always with peers from
+# before this, messages are JSON text as they were. Receivers read both.
+#
+# "NW" is distinct from file_transfer's "NF", so upload frames are still told apart.
+import json
+import zlib
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"NW"
+VERSION = 1
+HEADER = struct.Struct("!2sBBB")
+
+# In order of preference
+CODECS = ("msgpack", "json") if msgpack is not None else ("json",)
+COMPRESSION = ("zstd", "deflate") if zstandard is not None else ("deflate",)
+CODEC_IDS = {"msgpack": 0, "json": 1}
+COMPRESSION_IDS = {None: 0, "deflate": 1, "zstd": 2}
+
+# Below this, compression saves too little to be worth the CPU
+COMPRESS_THRESHOLD = 512
+# Largest message a compressed frame may expand to
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class WireError(Exception):
+    pass
+
+
+def is_wire_frame(message):
+    return isinstance(message, (bytes, bytearray)) and message[:2] == MAGIC
+
+
+class WireFormat:
+    def __init__(self, threshold=COMPRESS_THRESHOLD, codecs=CODECS, compression=COMPRESSION, level=3):
+        self.threshold = threshold
+        self.codecs = codecs
+        self.compressions = compression
+        self.level = level
+        self.codec = None
+        self.compression = None
+        self.zstd_compressor = zstandard.ZstdCompressor(level=level) if zstandard is not None else None
+        self.zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+        self.messages = 0
+        self.compressed = 0
+        self.bytes_out = 0
+
+    def hello(self):
+        return json.dumps({"type": "hello", "wire": {"version": VERSION, "codecs": list(self.codecs),
+                                                      "compression": list(self.compressions)}})
+
+    def negotiate(self, data):
+        # Called with the other peer's hello; picks the formats both can read
+        wire = data.get("wire") or {}
+        if wire.get("version") != VERSION:
+            self.reset()
+            return
+        self.codec = next((codec for codec in self.codecs if codec in wire.get("codecs", ())), None)
+        self.compression = next((name for name in self.compressions if name in wire.get("compression", ())), None)
+        print(f"Wire format: {self.codec or 'json text'}, compression {self.compression or 'off'}")
+
+    def reset(self):
+        # A new connection may have a different peer on the other end
+        self.codec = None
+        self.compression = None
+
+    def encode(self, frame):
+        if self.codec is None:
+            return json.dumps(frame)
+        if self.codec == "msgpack":
+            body = msgpack.packb(frame, use_bin_type=True)
+        else:
+            body = json.dumps(frame).encode()
+        compression = None
+        if self.compression is not None and len(body) >= self.threshold:
+            packed = self.compress(body)
+            if len(packed) < len(body):
+                body, compression = packed, self.compression
+        message = HEADER.pack(MAGIC, VERSION, CODEC_IDS[self.codec], COMPRESSION_IDS[compression]) + body
+        self.messages += 1
+        self.compressed += compression is not None
+        self.bytes_out += len(message)
+        return message
+
+    def compress(self, body):
+        if self.compression == "zstd":
+            return self.zstd_compressor.compress(body)
+        return zlib.compress(body, self.level)
+
+    def decode(self, message):
+        # Text is JSON; binary must be a wire frame
+        if isinstance(message, str):
+            return json.loads(message)
+        if not is_wire_frame(message):
+            raise WireError("Not a wire frame")
+        magic, version, codec, compression = HEADER.unpack_from(message)
+        if version != VERSION:
+            raise WireError(f"Unsupported wire version {version}")
+        body = memoryview(message)[HEADER.size:]
+        try:
+            if compression == COMPRESSION_IDS["zstd"]:
+                if self.zstd_decompressor is None:
+                    raise WireError("zstd frame but zstandard is not installed")
+                body = self.zstd_decompressor.decompress(body, max_output_size=MAX_MESSAGE_SIZE)
+            elif compression == COMPRESSION_IDS["deflate"]:
+                inflater = zlib.decompressobj()
+                body = inflater.decompress(body, MAX_MESSAGE_SIZE)
+                if inflater.unconsumed_tail:
+                    raise WireError(f"Message larger than {MAX_MESSAGE_SIZE} bytes")
+            elif compression != COMPRESSION_IDS[None]:
+                raise WireError(f"Unknown compression {compression}")
+            if codec == CODEC_IDS["msgpack"]:
+                if msgpack is None:
+                    raise WireError("msgpack frame but msgpack is not installed")
+                return msgpack.unpackb(body, raw=False)
+            if codec == CODEC_IDS["json"]:
+                return json.loads(bytes(body))
+        except WireError:
+            raise
+        except Exception as e:
+            raise WireError(f"Invalid wire frame: {e}") from e
+        raise WireError(f"Unknown codec {codec}")
+
+    def stats(self):
+        return {"codec": self.codec, "compression": self.compression, "messages": self.messages,
+                "compressed": self.compressed, "bytes_out": self.bytes_out}
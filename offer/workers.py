@@ -0,0 +1,201 @@
+# workers.py
+import time
+import asyncio
+import functools
+import contextvars
+import multiprocessing
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from langchain.embeddings.base import Embeddings
+from tracing import tracer
+
+
+# The model FastEmbedEmbeddings loads by default
+DEFAULT_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class WorkerPool:
+    # Runs blocking ChatPDF work off the event loop: threads for I/O-bound calls
+    # (Chroma, OpenAI, Ollama), processes for embedding. At most max_running calls
+    # run at once and at most max_waiting more may queue behind them; beyond that
+    # callers get PoolBusy instead of piling up.
+    def __init__(self, io_workers=8, cpu_workers=1, max_running=8, max_waiting=32,
+                 embedding_model=DEFAULT_EMBEDDING_MODEL):
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="chatpdf-io")
+        self.cpu_workers = cpu_workers
+        self.embedding_model = embedding_model
+        self.cpu_executor = None
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self._slots = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_cpu_executor(self):
+        if self.cpu_executor is None:
+            # spawn, not fork: the parent already runs aiortc and executor threads
+            self.cpu_executor = ProcessPoolExecutor(max_workers=self.cpu_workers,
+                                                    mp_context=multiprocessing.get_context("spawn"),
+                                                    initializer=_init_embedding_worker,
+                                                    initargs=(self.embedding_model,))
+        return self.cpu_executor
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_running)
+        if self._slots.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise PoolBusy(f"{self.waiting} requests already waiting")
+        self.waiting += 1
+        queued = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        tracer.record("worker.queue", time.perf_counter() - queued)
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+
+    async def run_io(self, fn, *args, **kwargs):
+        # The call runs in a copy of the caller's context, so its spans join the caller's trace
+        async with self.slot():
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self.io_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+    async def iterate_io(self, iterator):
+        # Advances a blocking iterator in a thread, holding one slot for the whole iteration.
+        # However the iteration ends, the iterator is closed in a worker before the slot is
+        # released, so a generator's model stream doesn't stay open until garbage collection.
+        async with self.slot():
+            context = contextvars.copy_context()
+            done = object()
+            pending = None
+            try:
+                while True:
+                    pending = self.io_executor.submit(context.run, next, iterator, done)
+                    item = await asyncio.wrap_future(pending)
+                    if item is done:
+                        break
+                    yield item
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    await asyncio.wrap_future(self.io_executor.submit(_close_after, pending, context, close))
+
+    def embeddings(self, batch_size=64):
+        return ProcessPoolEmbeddings(self._get_cpu_executor, batch_size=batch_size, model_name=self.embedding_model)
+
+    def stats(self):
+        return {"running": self.running, "waiting": self.waiting, "completed": self.completed,
+                "rejected": self.rejected}
+
+    def shutdown(self, wait=True):
+        self.io_executor.shutdown(wait=wait)
+        if self.cpu_executor is not None:
+            self.cpu_executor.shutdown(wait=wait)
+
+
+def _close_after(pending, context, close):
+    # A cancelled await doesn't stop the thread running next(); the generator can only be
+    # closed once that call has returned
+    if pending is not None:
+        wait([pending])
+    try:
+        context.run(close)
+    except Exception as e:
+        print(f"Error closing iterator: {e}")
+
+
+_worker_embedding = None
+
+
+def _init_embedding_worker(model_name):
+    global _worker_embedding
+    from langchain.embeddings import FastEmbedEmbeddings
+    _worker_embedding = FastEmbedEmbeddings(model_name=model_name)
+
+
+def _embed_documents(texts):
+    return _worker_embedding.embed_documents(texts)
+
+
+def _embed_query(text):
+    return _worker_embedding.embed_query(text)
+
+
+class ProcessPoolEmbeddings(Embeddings):
+    # FastEmbed running in worker processes, so tokenization and inference don't hold
+    # the GIL of the process that serves the DataChannels
+    def __init__(self, get_executor, batch_size=64, model_name=DEFAULT_EMBEDDING_MODEL):
+        self.get_executor = get_executor
+        self.batch_size = batch_size
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        executor = self.get_executor()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors = []
+        for result in executor.map(_embed_documents, batches):
+            vectors.extend(result)
+        return vectors
+
+    def embed_query(self, text):
+        return self.get_executor().submit(_embed_query, text).result()
+
+
+class LoopLagMonitor:
+    # Measures how late the event loop wakes up from a short sleep. Anything running
+    # synchronously on the loop shows up here as lag.
+    def __init__(self, interval=0.1, window=600, report_every=60):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.report_every = report_every
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        last_report = time.monotonic()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.samples.append(max(0.0, now - start - self.interval))
+            if self.report_every and now - last_report >= self.report_every:
+                last_report = now
+                stats = self.stats()
+                print(f"Event loop lag: p50 {stats['p50'] * 1000:.1f}ms, p99 {stats['p99'] * 1000:.1f}ms, "
+                      f"max {stats['max'] * 1000:.1f}ms")
+
+    def stats(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "samples": len(samples),
+            "p50": samples[len(samples) // 2],
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "max": samples[-1],
+        }
@@ -0,0 +1,8 @@
+# conftest.py
+# The tests import the offer and answer modules flatly, as the peers do, and share the
+# benchmarks' offline stand-ins: the stub OpenAI server and the counting embedding.
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "offer"), os.path.join(ROOT, "answer"), os.path.join(ROOT, "benchmarks")]
@@ -0,0 +1,49 @@
+from langchain.docstore.document import Document
+
+from context import ContextPacker, estimate_tokens
+from fixtures import CountingEmbeddings
+from ingest_index import content_hash
+
+
+def documents(count):
+    return [Document(page_content=f"chunk {i} about invoice {i * 7} " * 20, metadata={"source": f"doc{i}.pdf"})
+            for i in range(count)]
+
+
+def test_rerank_reuses_stored_vectors():
+    docs = documents(6)
+    embedding = CountingEmbeddings()
+    stored = dict(zip([content_hash(doc.page_content) for doc in docs],
+                      embedding.embed_documents([doc.page_content for doc in docs])))
+    embedding.texts_embedded = embedding.document_calls = 0
+    lookups = []
+
+    def vectors(digests):
+        lookups.append(digests)
+        return {digest: stored[digest] for digest in digests if digest in stored}
+
+    packer = ContextPacker(embedding, vectors=vectors)
+    ranked = packer.rerank(docs)
+    assert sorted(doc.page_content for doc in ranked) == sorted(doc.page_content for doc in docs)
+    assert len(lookups) == 1
+    assert embedding.texts_embedded == 0
+
+
+def test_rerank_embeds_only_missing_vectors():
+    docs = documents(5)
+    embedding = CountingEmbeddings()
+    stored = {content_hash(docs[0].page_content): embedding.embed_documents([docs[0].page_content])[0]}
+    embedding.texts_embedded = embedding.document_calls = 0
+
+    packer = ContextPacker(embedding, vectors=lambda digests: {d: stored[d] for d in digests if d in stored})
+    packer.rerank(docs)
+    assert embedding.texts_embedded == 4
+
+
+def test_default_budget_fits_baseline_context():
+    # The baseline passed the top three 1000-character chunks
+    docs = [Document(page_content=("x" * 99 + "\n") * 10, metadata={"source": f"doc{i}.pdf"}) for i in range(3)]
+    packer = ContextPacker()
+    context, info = packer.pack(docs)
+    assert info["used"] == 3
+    assert estimate_tokens(context) <= packer.budget
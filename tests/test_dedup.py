@@ -0,0 +1,97 @@
+# test_dedup.py
+# Re-uploading content that is already stored must cost no embedding calls and no
+# OpenAI requests (OCR or action extraction), store nothing new and record why it
+# was skipped.
+import os
+import pytest
+
+from stub_openai import StubOpenAIServer
+from fixtures import CountingEmbeddings, make_pdf, make_corpus, make_text_image
+from ingest_index import file_hash
+
+
+@pytest.fixture(scope="module")
+def openai_stub():
+    stub = StubOpenAIServer(latency=0.0).start()
+    saved = {name: os.environ.get(name) for name in ("OPENAI_BASE_URL", "OPENAI_API_KEY")}
+    os.environ.update(OPENAI_BASE_URL=stub.base_url, OPENAI_API_KEY="stub")
+    yield stub
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    stub.stop()
+
+
+@pytest.fixture
+def embedding():
+    return CountingEmbeddings()
+
+
+@pytest.fixture
+def assistant(openai_stub, embedding, tmp_path):
+    from rag import ChatPDF
+    assistant = ChatPDF(json_path=str(tmp_path / "memory.json"), persist_directory=str(tmp_path / "chroma_db"),
+                        embedding=embedding)
+    yield assistant
+    assistant.close()
+
+
+def wait(result):
+    # ingest() returns the action extraction future, or None when nothing was stored
+    if result is not None:
+        result.result()
+    return result
+
+
+def costs(assistant, embedding, openai_stub):
+    return embedding.texts_embedded, openai_stub.requests, len(assistant.memory)
+
+
+def skip_reasons(assistant, source):
+    return [skip["reason"] for skip in assistant.ingest_index.skips() if skip["source"] == source]
+
+
+def write_pdf(tmp_path, name, pages):
+    path = tmp_path / name
+    path.write_bytes(make_pdf(pages))
+    return str(path)
+
+
+def test_same_file_twice(assistant, embedding, openai_stub, tmp_path):
+    path = write_pdf(tmp_path, "notes.pdf", make_corpus(pages=5))
+    wait(assistant.ingest(path, source="notes.pdf"))
+    before = costs(assistant, embedding, openai_stub)
+    assert before[0] > 0 and before[2] > 0
+
+    assert wait(assistant.ingest(path, source="notes-again.pdf")) is None
+    assert costs(assistant, embedding, openai_stub) == before
+    assert skip_reasons(assistant, "notes-again.pdf") == ["duplicate of notes.pdf"]
+
+
+def test_same_image_twice(assistant, embedding, openai_stub):
+    image = make_text_image(["Dentist appointment", "Friday 10am"])
+    wait(assistant.ingest_image(image, "appointment.png"))
+    before = costs(assistant, embedding, openai_stub)
+    assert before[1] > 0
+
+    # Same pixels under another name, as a fresh object
+    assert wait(assistant.ingest_image(image.copy(), "appointment-copy.png")) is None
+    assert costs(assistant, embedding, openai_stub) == before
+    assert skip_reasons(assistant, "appointment-copy.png") == ["duplicate of appointment.png"]
+
+
+def test_new_file_with_overlapping_chunks(assistant, embedding, openai_stub, tmp_path):
+    pages = make_corpus(pages=5)
+    wait(assistant.ingest(write_pdf(tmp_path, "notes.pdf", pages), source="notes.pdf"))
+    before = costs(assistant, embedding, openai_stub)
+
+    # A different file made of pages already stored, in another order
+    path = write_pdf(tmp_path, "excerpt.pdf", pages[3:] + pages[:2])
+    wait(assistant.ingest(path, source="excerpt.pdf"))
+    assert costs(assistant, embedding, openai_stub) == before
+    reasons = skip_reasons(assistant, "excerpt.pdf")
+    assert reasons and set(reasons) == {"duplicate chunk of notes.pdf"}
+    # The new file is still recorded, so uploading it again is skipped as a whole
+    assert assistant.ingest_index.find_file(file_hash(path))["source"] == "excerpt.pdf"
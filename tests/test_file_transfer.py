@@ -0,0 +1,87 @@
+# test_file_transfer.py
+import asyncio
+import pytest
+
+from file_transfer import FileReceiver, TransferError, HEADER, MAGIC, VERSION, CHUNK, send_file
+
+TRANSFER_ID = "0123456789abcdef"
+
+
+class Channel:
+    # Collects what send_file sends
+    label = "upload"
+    readyState = "open"
+    bufferedAmount = 0
+    bufferedAmountLowThreshold = 0
+
+    def __init__(self):
+        self.frames = []
+
+    def send(self, frame):
+        self.frames.append(bytes(frame))
+
+
+def frames(data, transfer_id=TRANSFER_ID, chunk_size=1000):
+    channel = Channel()
+    asyncio.run(send_file(channel, data, "notes.pdf", "application/pdf", transfer_id, chunk_size=chunk_size))
+    return channel.frames
+
+
+def test_round_trip():
+    data = bytes(range(256)) * 20
+    receiver = FileReceiver()
+    results = [receiver.feed(frame) for frame in frames(data)]
+    assert results[:-1] == [None] * (len(results) - 1)
+    assert bytes(results[-1].data) == data and results[-1].id == TRANSFER_ID
+    assert receiver.transfers == {}
+
+
+def test_short_frame_is_a_value_error():
+    with pytest.raises(ValueError):
+        FileReceiver().feed(MAGIC + b"\x01")
+
+
+def test_invalid_metadata_is_a_value_error():
+    start = frames(b"x")[0]
+    with pytest.raises(ValueError):
+        FileReceiver().feed(start[:HEADER.size] + b'{"name": "no size"}')
+
+
+def test_unknown_transfer_is_reported_once():
+    receiver = FileReceiver()
+    chunk = HEADER.pack(MAGIC, VERSION, CHUNK, bytes.fromhex(TRANSFER_ID), 0) + b"data"
+    with pytest.raises(TransferError) as error:
+        receiver.feed(chunk)
+    assert error.value.transfer_id == TRANSFER_ID
+    assert receiver.feed(chunk) is None
+
+
+def test_checksum_mismatch_names_the_transfer():
+    sent = frames(b"a" * 3000)
+    sent[-1] = sent[-1][:HEADER.size] + b"0" * 64
+    receiver = FileReceiver()
+    for frame in sent[:-1]:
+        receiver.feed(frame)
+    with pytest.raises(TransferError) as error:
+        receiver.feed(sent[-1])
+    assert error.value.transfer_id == TRANSFER_ID
+
+
+def test_too_many_bytes_in_flight():
+    receiver = FileReceiver(max_in_flight=5000)
+    receiver.feed(frames(b"a" * 4000)[0])
+    with pytest.raises(TransferError) as error:
+        receiver.feed(frames(b"b" * 2000, transfer_id="fedcba9876543210")[0])
+    assert error.value.transfer_id == "fedcba9876543210"
+    assert receiver.in_flight() == 4000
+
+
+def test_idle_transfers_expire():
+    sent = frames(b"a" * 3000)
+    receiver = FileReceiver(idle_timeout=10)
+    receiver.feed(sent[0])
+    receiver.expire(now=receiver.transfers[bytes.fromhex(TRANSFER_ID)].last_frame + 11)
+    assert receiver.transfers == {} and receiver.expired == 1
+    # Late frames of the dropped transfer are ignored; sending it again starts over
+    assert receiver.feed(sent[1]) is None
+    assert [receiver.feed(frame) for frame in sent][-1].size == 3000
@@ -0,0 +1,52 @@
+import json
+import time
+
+from heartbeat import Heartbeat
+
+
+def heartbeat():
+    sent = []
+    return Heartbeat(sent.append, lambda: None, dead_after=8), sent
+
+
+def test_ping_is_answered_with_pong():
+    beat, sent = heartbeat()
+    assert beat.receive(json.dumps({"type": "ping", "seq": 4, "time": 12.5})) is None
+    assert json.loads(sent[-1]) == {"type": "pong", "seq": 4, "time": 12.5}
+
+
+def test_pong_records_rtt_and_backs_off():
+    beat, sent = heartbeat()
+    beat._ping(time.monotonic())
+    ping = json.loads(sent[-1])
+    assert beat.receive(json.dumps({"type": "pong", "seq": ping["seq"], "time": ping["time"]})) is None
+    assert beat.outstanding is None
+    assert beat.pongs == 1
+    assert beat.srtt is not None and beat.srtt >= 0
+    assert beat.interval > beat.min_interval
+
+
+def test_stale_pong_is_ignored():
+    beat, sent = heartbeat()
+    beat._ping(time.monotonic())
+    beat.receive(json.dumps({"type": "pong", "seq": beat.outstanding + 1, "time": 0}))
+    assert beat.outstanding is not None
+    assert beat.pongs == 0
+
+
+def test_malformed_pong_is_ignored():
+    beat, sent = heartbeat()
+    beat._ping(time.monotonic())
+    seq = beat.outstanding
+    for frame in ({"type": "pong", "seq": seq}, {"type": "pong", "seq": seq, "time": "soon"}):
+        assert beat.receive(json.dumps(frame)) is None
+    assert beat.outstanding == seq
+    assert beat.pongs == 0 and beat.srtt is None
+
+
+def test_other_frames_pass_through():
+    beat, _ = heartbeat()
+    before = beat.last_heard
+    assert beat.receive(json.dumps({"type": "ack", "acks": {}})) == {"type": "ack", "acks": {}}
+    assert beat.receive("keep-alive") is None
+    assert beat.last_heard >= before
@@ -0,0 +1,79 @@
+# test_keyword_index.py
+# sync() reads only the part of the memory log written since the index last saw it.
+import pytest
+
+from memory_store import MemoryLog
+from keyword_index import KeywordIndex
+
+
+def entries(start, count, source="notes.pdf"):
+    return [{"source": source, "content": f"invoice INV-{100000 + i} is due"} for i in range(start, start + count)]
+
+
+class Unreadable(MemoryLog):
+    # Fails if anything reads the whole log
+    def __iter__(self):
+        raise AssertionError("the whole log was read")
+
+    def __len__(self):
+        raise AssertionError("the whole log was counted")
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "memory.jsonl"), str(tmp_path / "keyword_index.sqlite3")
+
+
+def test_sync_reads_only_new_entries(paths):
+    log_path, index_path = paths
+    MemoryLog(log_path).append(entries(0, 50))
+    index = KeywordIndex(index_path)
+    assert index.sync(MemoryLog(log_path)) == 50
+
+    # Nothing new: nothing is read
+    assert index.sync(Unreadable(log_path)) == 0
+
+    # Written while the index wasn't looking
+    MemoryLog(log_path).append(entries(50, 5))
+    log = Unreadable(log_path)
+    read = []
+    log.read_from = lambda offset, read_from=log.read_from: read.append(offset) or read_from(offset)
+    assert index.sync(log) == 5
+    assert read and read[0] > 0
+    assert len(index) == 55
+    assert index.search("INV-100052")[0][0].page_content == "invoice INV-100052 is due"
+
+
+def test_add_with_position_needs_no_sync(paths):
+    log_path, index_path = paths
+    log = MemoryLog(log_path)
+    index = KeywordIndex(index_path)
+    new = entries(0, 3)
+    position = log.append(new)
+    index.add([(str(i), entry["source"], entry["content"]) for i, entry in enumerate(new)], position=position)
+    assert index.sync(Unreadable(log_path)) == 0
+
+
+def test_compacted_log_is_rescanned(paths):
+    log_path, index_path = paths
+    log = MemoryLog(log_path)
+    log.append(entries(0, 10))
+    log.append(entries(0, 10))
+    index = KeywordIndex(index_path)
+    assert index.sync(log) == 10
+    log.compact()
+    # A new file: scanned again, but nothing is indexed twice
+    assert index.sync(MemoryLog(log_path)) == 0
+    assert index.sync(Unreadable(log_path)) == 0
+
+
+def test_torn_last_line_waits(paths):
+    log_path, index_path = paths
+    MemoryLog(log_path).append(entries(0, 2))
+    with open(log_path, "a") as f:
+        f.write('{"source": "notes.pdf", "content": "half a li')
+    index = KeywordIndex(index_path)
+    assert index.sync(MemoryLog(log_path)) == 2
+    with open(log_path, "a") as f:
+        f.write('ne"}\n')
+    assert index.sync(MemoryLog(log_path)) == 1
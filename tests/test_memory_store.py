@@ -0,0 +1,40 @@
+# test_memory_store.py
+import json
+
+from memory_store import MemoryLog
+
+
+def test_append_after_a_torn_line_keeps_new_entries(tmp_path):
+    log = MemoryLog(str(tmp_path / "memory.jsonl"))
+    log.append([{"source": "a.pdf", "content": "first"}])
+    # A crash in the middle of the next write
+    with open(log.path, "a") as f:
+        f.write('{"source": "a.pdf", "content": "sec')
+    log.append([{"source": "b.pdf", "content": "third"}, {"source": "b.pdf", "content": "fourth"}])
+    assert [entry["content"] for entry in MemoryLog(log.path)] == ["first", "third", "fourth"]
+
+
+def test_append_to_a_log_that_is_one_torn_line(tmp_path):
+    path = tmp_path / "memory.jsonl"
+    path.write_text('{"source": "a.pdf", "content": "cut sh')
+    log = MemoryLog(str(path))
+    log.append([{"source": "a.pdf", "content": "whole"}])
+    assert list(MemoryLog(str(path))) == [{"source": "a.pdf", "content": "whole"}]
+
+
+def test_compact_keeps_the_same_text_from_different_sources(tmp_path):
+    log = MemoryLog(str(tmp_path / "memory.jsonl"))
+    log.append([{"source": "a.pdf", "content": "same"}, {"source": "b.pdf", "content": "same"},
+                {"source": "a.pdf", "content": "same"}])
+    assert log.compact() == 2
+    assert [(entry["source"], entry["content"]) for entry in MemoryLog(log.path)] == [("a.pdf", "same"),
+                                                                                        ("b.pdf", "same")]
+
+
+def test_legacy_memory_json_still_loads(tmp_path):
+    legacy = tmp_path / "memory.json"
+    legacy.write_text(json.dumps([{"source": "old.pdf", "content": "kept"}]))
+    log = MemoryLog.for_json_path(str(legacy))
+    assert log.entries == [{"source": "old.pdf", "content": "kept"}]
+    log.append([{"source": "new.pdf", "content": "added"}])
+    assert [entry["source"] for entry in MemoryLog(log.path)] == ["old.pdf", "new.pdf"]
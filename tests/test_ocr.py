@@ -0,0 +1,55 @@
+# test_ocr.py
+# Tall scans are tiled at full resolution; only bands wider than max_side shrink.
+# The recall check needs the tesseract binary and is skipped without it.
+import re
+import pytest
+
+from ocr import TesseractOCR, preprocess, tiles, merge_tiles
+from fixtures import make_text_image, make_corpus
+
+
+def receipt(lines=200, width=1200, font_size=28):
+    text = [line for page in make_corpus(pages=lines // 40 + 1) for line in page][:lines]
+    return text, make_text_image(text, size=(width, 40 + int(font_size * 1.4) * lines), font_size=font_size)
+
+
+def test_tall_image_is_tiled_at_full_resolution():
+    _, image = receipt()
+    backend = TesseractOCR()
+    bands = backend.bands(image)
+    assert image.size[1] > backend.max_side * 3
+    assert all(band.size == (image.size[0], band.size[1]) for band in bands)
+    assert all(band.size[1] <= backend.tile_height for band in bands)
+    covered = sum(band.size[1] for band in bands) - backend.overlap * (len(bands) - 1)
+    assert covered == image.size[1]
+
+
+def test_wide_bands_are_shrunk_each_on_their_own():
+    image = make_text_image(["wide"], size=(5000, 4000))
+    backend = TesseractOCR()
+    bands = backend.bands(image)
+    assert len(bands) == len(tiles(preprocess(image, max_side=None), backend.tile_height, backend.overlap))
+    assert all(max(band.size) <= backend.max_side and band.mode == "L" for band in bands)
+
+
+def test_small_image_is_one_band():
+    image = make_text_image(["note"], size=(3000, 1000))
+    bands = TesseractOCR().bands(image)
+    assert len(bands) == 1 and max(bands[0].size) == 2500
+
+
+def test_merge_drops_lines_repeated_across_band_edges():
+    assert merge_tiles(["one\ntwo\nthree", "two\nthree\nfour"]) == "one\ntwo\nthree\nfour"
+
+
+@pytest.mark.skipif(not TesseractOCR.available(), reason="tesseract is not installed")
+def test_tall_receipt_text_is_read():
+    lines, image = receipt()
+    backend = TesseractOCR()
+    try:
+        text = backend.extract(image)
+    finally:
+        backend.shutdown()
+    expected = re.findall(r"[a-z0-9-]+", " ".join(lines).lower())
+    found = set(re.findall(r"[a-z0-9-]+", text.lower()))
+    assert sum(word in found for word in expected) / len(expected) > 0.9
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+from resend import Outbox, ResendQueue
+
+
+def test_outbox_numbers_and_acks():
+    outbox = Outbox(max_messages=10, max_bytes=1000)
+    assert [outbox.add({"n": i}, 10) for i in range(4)] == [1, 2, 3, 4]
+    assert outbox.bytes == 40
+    outbox.ack(2)
+    assert list(outbox.unacked) == [3, 4]
+    assert outbox.bytes == 20
+    outbox.ack(2)
+    assert list(outbox.unacked) == [3, 4]
+    outbox.ack(10)
+    assert not outbox.unacked and outbox.bytes == 0
+
+
+def test_outbox_drops_oldest_beyond_message_limit():
+    outbox = Outbox(max_messages=3, max_bytes=1000)
+    for i in range(5):
+        outbox.add({"n": i}, 10)
+    assert list(outbox.unacked) == [3, 4, 5]
+    assert outbox.dropped == 2
+    assert outbox.bytes == 30
+
+
+def test_outbox_drops_oldest_beyond_byte_limit_but_keeps_newest():
+    outbox = Outbox(max_messages=10, max_bytes=25)
+    for i in range(3):
+        outbox.add({"n": i}, 10)
+    assert list(outbox.unacked) == [2, 3]
+    outbox.add({"big": True}, 100)
+    assert list(outbox.unacked) == [4]
+    assert outbox.dropped == 3
+
+
+def accept_all(queue, frames):
+    async def run():
+        results = [queue.accept("user", frame) for frame in frames]
+        queue.ack_timer.cancel()
+        return results
+    return asyncio.run(run())
+
+
+def test_accept_drops_duplicates_within_an_epoch():
+    queue = ResendQueue(lambda message: None)
+    frames = [{"sn": 1, "ep": "a"}, {"sn": 2, "ep": "a"}, {"sn": 1, "ep": "a"}, {"sn": 2, "ep": "a"},
+              {"sn": 3, "ep": "a"}]
+    assert accept_all(queue, frames) == [True, True, False, False, True]
+    assert queue.duplicates == 2
+    assert queue.received["user"] == ("a", 3)
+
+
+def test_accept_starts_over_on_a_new_epoch():
+    # A restarted peer counts from 1 again; its messages are not duplicates
+    queue = ResendQueue(lambda message: None)
+    frames = [{"sn": 1, "ep": "a"}, {"sn": 2, "ep": "a"}, {"sn": 1, "ep": "b"}, {"sn": 1, "ep": "b"},
+              {"sn": 2, "ep": "a"}]
+    assert accept_all(queue, frames) == [True, True, True, False, True]
+    assert queue.duplicates == 1
+
+
+def test_accept_passes_unnumbered_and_unkept_channels():
+    queue = ResendQueue(lambda message: None)
+    assert queue.accept("user", {"type": "message"})
+    assert queue.accept("chat", {"sn": 1, "ep": "a"})
+    assert queue.ack_timer is None
+
+
+def test_acks_from_the_other_side_clear_the_outbox():
+    sent = []
+    queue = ResendQueue(sent.append)
+    queue.holding = True
+    for i in range(3):
+        assert not queue.send(None, "user", {"n": i})
+    queue.acked({"acks": {"user": ["stale", 3]}})
+    assert queue.stats()["unacked"] == 3
+    queue.acked(json.loads(json.dumps({"acks": {"user": [queue.epoch, 2]}})))
+    assert list(queue.outboxes["user"].unacked) == [3]
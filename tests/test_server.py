@@ -0,0 +1,20 @@
+# test_server.py
+import time
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("wait", ["abc", "-5", "nan", "-inf", ""])
+def test_bad_wait_is_no_wait(wait):
+    start = time.monotonic()
+    response = server.app.test_client().get(f"/get_offer?id=test-wait&wait={wait}")
+    assert response.status_code == 503
+    assert time.monotonic() - start < 1
+
+
+def test_wait_is_capped():
+    with server.app.test_request_context("/get_offer?id=test-wait&wait=inf"):
+        assert server.wait_param() == server.MAX_WAIT
+    with server.app.test_request_context("/get_offer?id=test-wait&wait=0.5"):
+        assert server.wait_param() == 0.5
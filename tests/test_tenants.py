@@ -0,0 +1,92 @@
+# test_tenants.py
+# Opening and closing tenants happens outside the registry lock, so one slow
+# tenant never holds up another. The stores are stand-ins; ChatPDF isn't built.
+import time
+import threading
+import pytest
+
+from tenants import TenantRegistry
+
+
+class Shared:
+    root = "unused"
+
+    def close(self):
+        pass
+
+
+class Store:
+    def __init__(self, close_delay=0.0):
+        self.close_delay = close_delay
+        self.closed = False
+
+    def close(self):
+        time.sleep(self.close_delay)
+        self.closed = True
+
+
+def registry(open_delay=0.0, close_delay=0.0, fail=(), **kwargs):
+    registry = TenantRegistry(Shared(), **kwargs)
+
+    def open_store(tenant_id):
+        time.sleep(open_delay if tenant_id == "slow" else 0.0)
+        if tenant_id in fail:
+            raise RuntimeError(f"cannot open {tenant_id}")
+        return Store(close_delay if tenant_id == "slow" else 0.0)
+    registry._open = open_store
+    return registry
+
+
+def elapsed(fn):
+    start = time.monotonic()
+    fn()
+    return time.monotonic() - start
+
+
+def test_slow_open_does_not_block_other_tenants():
+    tenants = registry(open_delay=1.0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tenants.acquire("slow"))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+
+    def lease_fast():
+        with tenants.lease("fast"):
+            pass
+    assert elapsed(lease_fast) < 0.5
+    assert elapsed(tenants.stats) < 0.5
+    for thread in threads:
+        thread.join()
+    # Everyone waiting on the same tenant gets the one store
+    assert len({id(store) for store in results}) == 1
+    assert tenants.stats()["opened"] == 2
+
+
+def test_failed_open_raises_and_leaves_nothing_behind():
+    tenants = registry(fail=("broken",))
+    with pytest.raises(RuntimeError):
+        tenants.acquire("broken")
+    assert tenants.stats()["open"] == 0
+
+
+def test_slow_close_does_not_block_other_tenants():
+    tenants = registry(close_delay=1.0, max_open=1)
+    slow = tenants.acquire("slow")
+    tenants.release("slow")
+    closer = threading.Thread(target=tenants.acquire, args=("other",))
+    closer.start()
+    time.sleep(0.1)
+    # "other" evicted "slow" and is closing it; the lock is free meanwhile
+    assert elapsed(tenants.stats) < 0.5
+    closer.join()
+    assert slow.closed and tenants.stats()["closed"] == 1
+
+
+def test_pinned_tenants_are_not_closed():
+    tenants = registry(max_open=1)
+    first = tenants.acquire("a")
+    tenants.acquire("b")
+    assert not first.closed
+    tenants.release("a")
+    assert first.closed
@@ -0,0 +1,20 @@
+# test_tracing.py
+from tracing import Histogram
+
+
+def test_quantiles_are_bucket_upper_bounds():
+    histogram = Histogram()
+    for seconds in (0.002, 0.003, 0.004, 0.2):
+        histogram.observe(seconds)
+    stats = histogram.stats()
+    assert (stats["p50"], stats["p99"], stats["max"]) == (0.005, 0.25, 0.2)
+
+
+def test_overflow_quantiles_report_the_slowest_observation():
+    histogram = Histogram()
+    for _ in range(10):
+        histogram.observe(400.0)
+    histogram.observe(450.0)
+    stats = histogram.stats()
+    assert stats["mean"] > 400
+    assert stats["p50"] == stats["p90"] == stats["p99"] == stats["max"] == 450.0
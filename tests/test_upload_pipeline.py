@@ -0,0 +1,34 @@
+# test_upload_pipeline.py
+# Scaling keeps the width of tall documents; only the short side and the pixel
+# count are capped.
+import io
+from PIL import Image
+
+from upload_pipeline import ImageUploadPipeline
+from fixtures import make_text_image
+
+
+def sent_size(pipeline, image):
+    data, _ = pipeline.encode(image)
+    return Image.open(io.BytesIO(data)).size
+
+
+def test_tall_document_keeps_its_width():
+    receipt = make_text_image(["total 12.50"] * 10, size=(1000, 6000))
+    assert sent_size(ImageUploadPipeline(), receipt) == (1000, 6000)
+
+
+def test_short_side_is_capped():
+    page = make_text_image(["page"], size=(3000, 4000))
+    assert sent_size(ImageUploadPipeline(), page) == (2000, 2667)
+
+
+def test_pixel_count_is_capped():
+    pipeline = ImageUploadPipeline(max_pixels=4_000_000)
+    width, height = sent_size(pipeline, make_text_image(["long"], size=(1600, 10000)))
+    assert width * height <= 4_000_000 and height / width == 10000 / 1600
+    assert width > 600
+
+
+def test_small_images_are_not_scaled():
+    assert sent_size(ImageUploadPipeline(), make_text_image(["note"], size=(800, 400))) == (800, 400)
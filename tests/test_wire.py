@@ -0,0 +1,93 @@
+import json
+import zlib
+
+import pytest
+
+import wire
+from wire import HEADER, MAGIC, VERSION, WireError, WireFormat, is_wire_frame
+
+CODECS = [codec for codec in ("msgpack", "json") if codec in wire.CODECS]
+COMPRESSIONS = [None] + list(wire.COMPRESSION)
+
+
+def negotiated(codec, compression, threshold=wire.COMPRESS_THRESHOLD):
+    fmt = WireFormat(threshold=threshold)
+    fmt.codec, fmt.compression = codec, compression
+    return fmt
+
+
+def frames():
+    return [{"type": "message", "content": "hi", "id": "abc"},
+            {"type": "response", "content": "invoice payment contract " * 200, "sn": 7, "ep": "a1b2"},
+            {"type": "metrics", "values": [1, 2.5, None, True], "nested": {"k": ["v"]}}]
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_round_trip(codec, compression):
+    sender, receiver = negotiated(codec, compression), WireFormat()
+    for frame in frames():
+        message = sender.encode(frame)
+        assert is_wire_frame(message)
+        assert receiver.decode(message) == frame
+
+
+@pytest.mark.parametrize("compression", wire.COMPRESSION)
+def test_large_messages_are_compressed(compression):
+    fmt = negotiated(CODECS[0], compression)
+    frame = frames()[1]
+    message = fmt.encode(frame)
+    assert message[4] == wire.COMPRESSION_IDS[compression]
+    assert len(message) < len(json.dumps(frame))
+    assert fmt.stats()["compressed"] == 1
+
+
+def test_small_messages_are_not_compressed():
+    message = negotiated(CODECS[0], wire.COMPRESSION[0]).encode(frames()[0])
+    assert message[4] == wire.COMPRESSION_IDS[None]
+
+
+def test_text_until_negotiated():
+    fmt = WireFormat()
+    message = fmt.encode(frames()[0])
+    assert isinstance(message, str)
+    assert fmt.decode(message) == frames()[0]
+
+
+def test_negotiate_picks_common_formats():
+    fmt = WireFormat()
+    fmt.negotiate({"wire": {"version": VERSION, "codecs": ["json"], "compression": ["deflate"]}})
+    assert (fmt.codec, fmt.compression) == ("json", "deflate")
+    fmt.negotiate({"wire": {"version": VERSION + 1, "codecs": ["json"]}})
+    assert fmt.codec is None
+
+
+@pytest.mark.parametrize("message", [
+    b"NF" + bytes(10),
+    b"plain bytes",
+    HEADER.pack(MAGIC, VERSION + 1, 1, 0) + b"{}",
+    HEADER.pack(MAGIC, VERSION, 9, 0) + b"{}",
+    HEADER.pack(MAGIC, VERSION, 1, 9) + b"{}",
+    HEADER.pack(MAGIC, VERSION, 1, 0) + b"{not json",
+    HEADER.pack(MAGIC, VERSION, 1, 1) + b"not deflate",
+])
+def test_bad_frames_are_rejected(message):
+    with pytest.raises(WireError):
+        WireFormat().decode(message)
+
+
+def test_oversized_deflate_frame_is_rejected(monkeypatch):
+    monkeypatch.setattr(wire, "MAX_MESSAGE_SIZE", 1024)
+    body = zlib.compress(json.dumps({"content": "x" * 4096}).encode())
+    with pytest.raises(WireError):
+        WireFormat().decode(HEADER.pack(MAGIC, VERSION, 1, 1) + body)
+
+
+@pytest.mark.skipif(wire.zstandard is None, reason="zstandard is not installed")
+def test_oversized_zstd_frame_is_rejected(monkeypatch):
+    monkeypatch.setattr(wire, "MAX_MESSAGE_SIZE", 1024)
+    # Written without the content size, so the limit is what stops it
+    compressor = wire.zstandard.ZstdCompressor(write_content_size=False)
+    body = compressor.compress(json.dumps({"content": "x" * 4096}).encode())
+    with pytest.raises(WireError):
+        WireFormat().decode(HEADER.pack(MAGIC, VERSION, 1, 2) + body)
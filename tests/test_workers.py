@@ -0,0 +1,87 @@
+import asyncio
+import threading
+from contextlib import aclosing
+
+from workers import WorkerPool
+
+
+def stream(events, count=10):
+    try:
+        for i in range(count):
+            yield i
+    finally:
+        events.append(("closed", threading.current_thread().name))
+
+
+def test_iterator_closed_when_consumer_stops_early():
+    events = []
+    pool = WorkerPool(max_running=1)
+
+    async def run():
+        seen = []
+        async with aclosing(pool.iterate_io(stream(events))) as tokens:
+            async for token in tokens:
+                seen.append(token)
+                if token == 2:
+                    break
+        return seen, pool.running
+
+    seen, running = asyncio.run(run())
+    pool.shutdown()
+    assert seen == [0, 1, 2]
+    assert running == 0
+    assert len(events) == 1 and events[0][1].startswith("chatpdf-io")
+
+
+def test_iterator_closed_when_consumer_fails():
+    events = []
+    pool = WorkerPool(max_running=1)
+
+    async def run():
+        try:
+            async with aclosing(pool.iterate_io(stream(events))) as tokens:
+                async for token in tokens:
+                    raise ConnectionError("channel closed")
+        except ConnectionError:
+            pass
+        # The slot is free again
+        return [token async for token in pool.iterate_io(iter(range(3)))]
+
+    assert asyncio.run(run()) == [0, 1, 2]
+    pool.shutdown()
+    assert len(events) == 1 and events[0][1].startswith("chatpdf-io")
+    assert pool.stats()["completed"] == 2
+
+
+def test_iterator_closed_after_cancel_mid_next():
+    events = []
+    started = threading.Event()
+    pool = WorkerPool(max_running=1)
+
+    def slow():
+        try:
+            yield 0
+            started.set()
+            threading.Event().wait(0.2)
+            yield 1
+        finally:
+            events.append(threading.current_thread().name)
+
+    async def consume():
+        async for _ in pool.iterate_io(slow()):
+            pass
+
+    async def run():
+        task = asyncio.create_task(consume())
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return pool.running
+
+    assert asyncio.run(run()) == 0
+    pool.shutdown()
+    assert len(events) == 1 and events[0].startswith("chatpdf-io")